@@ -1,16 +1,18 @@
 import logging, json
-from typing import List
 
 import azure.functions as func
-from src.storage import Storage
+from src.storage import Storage, NEEDS_ACTION_FILTER
 from src.data.observations import Observation
 from src.data.actionItems import ActionItem
 from src.data.topics import Topic
+from src.data.ledger import message_version
+from src.pipeline import from_other_runs
 from src.llm.connections import (
     infer_action_item_to_observations_connections,
     infer_action_item_to_topics_connections,
 )
-from src.llm.action_items import check_needs_action
+
+HANDLER = "HandleActionItemChange"
 
 
 def main(msg: func.ServiceBusMessage) -> None:
@@ -19,36 +21,67 @@ def main(msg: func.ServiceBusMessage) -> None:
     id: str = req_body.get("id")
 
     with Storage() as storage:
+        ledger = storage.open_ledger_entry(
+            HANDLER, id, message_version(req_body, msg.message_id)
+        )
+        if ledger.completed:
+            logging.info("DONE: Already processed.")
+            return
+
         logging.info(f"Getting Action Item with ID: {id}")
         action_item = storage.get_node(id, ActionItem)
 
-        logging.info("Infer related Observations")
-        existing_observations, relevance = storage.search_semantically(  # type: ignore
-            search_for=Observation, from_text=action_item.text, top_k=10, min_score=0.0
-        )
-        existing_observations_needing_action: List[Observation] = []
-        for observation in existing_observations:
-            scores = storage.get_observation_scores(observation)
-            if check_needs_action(scores):
-                existing_observations_needing_action.append(observation)
-        related_observations = infer_action_item_to_observations_connections(
-            action_item, existing_observations_needing_action
-        )
-        storage.add_action_item_to_observations_edges(action_item, related_observations)
-        logging.info(
-            f"Action Item: \n\n {action_item.text} \n\nAddresses Observations: {related_observations}\n\n"
-        )
+        if not ledger.is_done("observations"):
+            logging.info("Infer related Observations")
+            existing_observations, relevance = storage.search_semantically(  # type: ignore
+                search_for=Observation,
+                from_text=action_item.text,
+                top_k=10,
+                min_score=0.0,
+                adaptive=True,
+                filter=NEEDS_ACTION_FILTER,
+            )
+            existing_observations, relevance = from_other_runs(
+                action_item, existing_observations, relevance
+            )
+            related_observations = infer_action_item_to_observations_connections(
+                action_item,
+                existing_observations,
+                similarities=relevance,
+                embed=storage.embed_nodes,
+            )
+            storage.add_action_item_to_observations_edges(
+                action_item, related_observations
+            )
+            logging.info(
+                f"Action Item: \n\n {action_item.text} \n\nAddresses Observations: {related_observations}\n\n"
+            )
+            storage.complete_stage(ledger, "observations")
 
-        logging.info("Infer related Topics")
-        existing_topics, relevance = storage.search_semantically(  # type: ignore
-            search_for=Topic, from_text=action_item.text, top_k=10, min_score=0.0
-        )
-        related_topics = infer_action_item_to_topics_connections(
-            action_item, existing_topics
-        )
-        storage.add_action_item_to_topics_edges(action_item, related_topics)
-        logging.info(
-            f"Action Item: \n\n {action_item.text} \n\nAddresses Topics: {related_topics}\n\n"
-        )
+        if not ledger.is_done("topics"):
+            logging.info("Infer related Topics")
+            existing_topics, relevance = storage.search_semantically(  # type: ignore
+                search_for=Topic,
+                from_text=action_item.text,
+                top_k=10,
+                min_score=0.0,
+                adaptive=True,
+            )
+            existing_topics, relevance = from_other_runs(
+                action_item, existing_topics, relevance
+            )
+            related_topics = infer_action_item_to_topics_connections(
+                action_item,
+                existing_topics,
+                similarities=relevance,
+                embed=storage.embed_nodes,
+            )
+            storage.add_action_item_to_topics_edges(action_item, related_topics)
+            logging.info(
+                f"Action Item: \n\n {action_item.text} \n\nAddresses Topics: {related_topics}\n\n"
+            )
+            storage.complete_stage(ledger, "topics")
+
+        storage.complete_ledger_entry(ledger)
 
     logging.info("DONE: Finished processing.")
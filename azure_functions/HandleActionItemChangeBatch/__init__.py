@@ -0,0 +1,15 @@
+from typing import List
+
+import azure.functions as func
+from src.data.actionItems import ActionItem
+from src.queues import ACTION_ITEM_CHANGE_QUEUE
+from src.change_batches import ACTION_ITEM_STAGES, handle_change_batch
+
+# Shares its ledger entries, so a message done by either handler isn't done again
+HANDLER = "HandleActionItemChange"
+
+
+def main(msgs: List[func.ServiceBusMessage]) -> None:
+    handle_change_batch(
+        HANDLER, ACTION_ITEM_CHANGE_QUEUE, ActionItem, ACTION_ITEM_STAGES, msgs
+    )
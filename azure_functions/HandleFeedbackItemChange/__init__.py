@@ -1,17 +1,24 @@
 import logging, json
-from typing import List
 
 import azure.functions as func
 
 from src.data.feedbackItems import FeedbackItem
-from src.data.actionItems import ActionItem
-from src.data.topics import Topic
+from src.data.ledger import message_version
 from src.storage import Storage
+from src.pipeline import (
+    ACTION_ITEMS,
+    OBSERVATIONS,
+    FeedbackItemCheckpoint,
+    FeedbackItemPipeline,
+    run_remaining_stages,
+    scoring_message,
+    should_fan_out,
+)
+from src.queues import OBSERVATION_SCORING_QUEUE, send_messages
 
-from src.llm.observations import generate_observations, Observation
-from src.llm.action_items import generate_action_items, check_needs_action
-from src.llm.topics import generate_topics
-from src.llm.scores import score_observation, ScoreType
+from src.llm.concurrency import submit
+
+HANDLER = "HandleFeedbackItemChange"
 
 
 def main(msg: func.ServiceBusMessage) -> None:
@@ -20,53 +27,62 @@ def main(msg: func.ServiceBusMessage) -> None:
     id: str = req_body.get("id")
 
     with Storage() as storage:
+        ledger = storage.open_ledger_entry(
+            HANDLER, id, message_version(req_body, msg.message_id)
+        )
+        if ledger.completed:
+            logging.info("DONE: Already processed.")
+            return
+        # Tags what this run stores, so the change handlers skip what it already did (see src.pipeline)
+        storage.origin_run = ledger.id
+
         logging.info(f"INIT: Getting FeedbackItem with ID: {id}")
         feedback_item = storage.get_node(id, FeedbackItem)
 
-        logging.info("DATAPOINTS: Generating Observations")
-        observations = generate_observations(feedback_item.text)
-        observations_requiring_actions: List[Observation] = []
-        for observation in observations:
-            logging.info("DATAPOINTS: Scoring Observation")
-            scores = score_observation(
-                observation.text,
-                feedback_item.text,
-                [
-                    ScoreType.SATISFACTION,
-                    ScoreType.SPECIFICITY,
-                    ScoreType.BUSINESS_IMPACT,
-                ],
-            )
-            if check_needs_action(scores):
-                observations_requiring_actions.append(observation)
+        # A retry resumes from what the previous attempt generated, starting at its first unfinished stage
+        pipeline = FeedbackItemPipeline(
+            storage,
+            feedback_item,
+            checkpoint=FeedbackItemCheckpoint.from_json(ledger.checkpoint),
+            on_checkpoint=lambda checkpoint: storage.save_checkpoint(
+                ledger, checkpoint
+            ),
+        )
 
-            logging.info("DATAPOINTS: Adding to Storage")
-            storage.add_observation_for_feedback_item(observation, feedback_item)
-            for score in scores:
-                storage.add_score(observation, score)
+        # Long feedback items are scored and stored one observation per message, and whichever message
+        # finishes last runs the remaining stages (see HandleObservationScoring)
+        if ledger.fan_out > 0 or (
+            not ledger.is_done(OBSERVATIONS) and should_fan_out(feedback_item)
+        ):
+            if not ledger.is_done(OBSERVATIONS):
+                logging.info("DATAPOINTS: Generating Observations to fan out")
+                ledger.fan_out = len(pipeline.extract_observations())
+                storage.complete_stage(ledger, OBSERVATIONS)
+            if ledger.fan_out > 0:
+                # Sent again if this message is redelivered. Observations already done are skipped.
+                send_messages(
+                    OBSERVATION_SCORING_QUEUE,
+                    [
+                        scoring_message(ledger, observation)
+                        for observation in pipeline.checkpoint.observations
+                    ],
+                )
+                logging.info(f"DONE: Fanned out {ledger.fan_out} observations.")
+                return
 
-        logging.info("ACTIONITEMS: Generating new action items and adding to storage")
-        existing_action_items, scores = storage.search_semantically(
-            search_for=ActionItem, from_text=feedback_item.text, top_k=10, min_score=0.0
-        )
-        new_action_items = generate_action_items(
-            feedback_item.text, observations_requiring_actions, existing_action_items
-        )
-        for new_action_item in new_action_items:
-            storage.add_action_item(new_action_item)
-        logging.info(
-            f"Feedback Item {feedback_item.text}\n\nNew Action Items: {[new_action_item.text for new_action_item in new_action_items]}\n\n"
-        )
+        # Only depends on the feedback item, so it runs while observations are generated
+        action_items_search = None
+        if (
+            not ledger.is_done(ACTION_ITEMS)
+            and pipeline.checkpoint.action_items is None
+        ):
+            action_items_search = submit(pipeline.search_action_items)
 
-        logging.info("TOPICS: Generating new topics and adding to storage")
-        existing_topics, scores = storage.search_semantically(
-            search_for=Topic, from_text=feedback_item.text, top_k=10, min_score=0.0
-        )
-        new_topics = generate_topics(feedback_item.text, observations, existing_topics)
-        for new_topic in new_topics:
-            storage.add_topic(new_topic)
-        logging.info(
-            f"Feedback Item {feedback_item.text}\n\nNew Topics: {[new_topic.text for new_topic in new_topics]}\n\n"
-        )
+        if not ledger.is_done(OBSERVATIONS):
+            logging.info("DATAPOINTS: Generating Observations")
+            pipeline.add_observations()
+            storage.complete_stage(ledger, OBSERVATIONS)
+
+        run_remaining_stages(storage, ledger, pipeline, action_items_search)
 
     logging.info("DONE: Finished processing.")
@@ -3,14 +3,15 @@ import logging, json
 import azure.functions as func
 from src.storage import Storage
 from src.data.observations import Observation
-from src.data.topics import Topic
 from src.data.actionItems import ActionItem
+from src.data.ledger import message_version
+from src.pipeline import connects_observation, is_flag_update, raises_needs_action
 from src.llm.connections import (
     infer_observation_to_action_items_connections,
     infer_observation_to_topics_connections,
 )
 
-from src.llm.action_items import check_needs_action
+HANDLER = "HandleObservationChange"
 
 
 def main(msg: func.ServiceBusMessage) -> None:
@@ -18,39 +19,70 @@ def main(msg: func.ServiceBusMessage) -> None:
     req_body = json.loads(msg.get_body())
     id: str = req_body.get("id")
 
+    flag_update = is_flag_update(req_body)
+    if flag_update and not raises_needs_action(req_body):
+        logging.info("DONE: Only the flags changed.")
+        return
+
     with Storage() as storage:
+        ledger = storage.open_ledger_entry(
+            HANDLER, id, message_version(req_body, msg.message_id)
+        )
+        if ledger.completed:
+            logging.info("DONE: Already processed.")
+            return
+
         logging.info(f"Getting Observation with ID: {id}")
         observation = storage.get_node(id, Observation)
-        scores = storage.get_observation_scores(observation)
-
-        if check_needs_action(scores):
-            logging.info("Infer related Action Items")
-            existing_action_items, scores = storage.search_semantically(  # type: ignore
-                search_for=ActionItem,
-                from_text=observation.text,
-                top_k=10,
-                min_score=0.0,
-            )
-            related_action_items = infer_observation_to_action_items_connections(
-                observation, existing_action_items
+
+        run = storage.get_runs([observation]).get(observation.origin_run or "")
+        if run is not None and connects_observation(run, req_body):
+            logging.info(f"DONE: Connected by the run that stored it, {run.id}.")
+            storage.complete_ledger_entry(ledger)
+            return
+
+        if not ledger.is_done("action_items"):
+            if storage.observation_needs_action(observation):
+                logging.info("Infer related Action Items")
+                existing_action_items, scores = storage.search_semantically(  # type: ignore
+                    search_for=ActionItem,
+                    from_text=observation.text,
+                    top_k=10,
+                    min_score=0.0,
+                    adaptive=True,
+                )
+                related_action_items = infer_observation_to_action_items_connections(
+                    observation,
+                    existing_action_items,
+                    similarities=scores,
+                    embed=storage.embed_nodes,
+                )
+                storage.add_observation_to_action_items_edges(
+                    observation, related_action_items
+                )
+                logging.info(
+                    f"Observation: \n\n {observation.text} \n\nAddressed by Action Items: {related_action_items}\n\n"
+                )
+            storage.complete_stage(ledger, "action_items")
+
+        if not flag_update and not ledger.is_done("topics"):
+            logging.info("Infer related Topics")
+            existing_topics, scores = storage.search_topics(
+                observation, top_k=10, min_score=0.0, adaptive=True
             )
-            storage.add_observation_to_action_items_edges(
-                observation, related_action_items
+            related_topics = infer_observation_to_topics_connections(
+                observation,
+                existing_topics,
+                similarities=scores,
+                embed=storage.embed_nodes,
+                source=storage.topic_search_source(),
             )
+            storage.add_observation_to_topics_edges(observation, related_topics)
             logging.info(
-                f"Observation: \n\n {observation.text} \n\nAddressed by Action Items: {related_action_items}\n\n"
+                f"Observation: \n\n {observation.text} \n\nBelongs to Topics: {related_topics}\n\n"
             )
+            storage.complete_stage(ledger, "topics")
 
-        logging.info("Infer related Topics")
-        existing_topics, scores = storage.search_semantically(  # type: ignore
-            search_for=Topic, from_text=observation.text, top_k=10, min_score=0.0
-        )
-        related_topics = infer_observation_to_topics_connections(
-            observation, existing_topics
-        )
-        storage.add_observation_to_topics_edges(observation, related_topics)
-        logging.info(
-            f"Observation: \n\n {observation.text} \n\nBelongs to Topics: {related_topics}\n\n"
-        )
+        storage.complete_ledger_entry(ledger)
 
     logging.info("DONE: Finished processing.")
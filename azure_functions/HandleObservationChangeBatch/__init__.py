@@ -0,0 +1,15 @@
+from typing import List
+
+import azure.functions as func
+from src.data.observations import Observation
+from src.queues import OBSERVATION_CHANGE_QUEUE
+from src.change_batches import OBSERVATION_STAGES, handle_change_batch
+
+# Shares its ledger entries, so a message done by either handler isn't done again
+HANDLER = "HandleObservationChange"
+
+
+def main(msgs: List[func.ServiceBusMessage]) -> None:
+    handle_change_batch(
+        HANDLER, OBSERVATION_CHANGE_QUEUE, Observation, OBSERVATION_STAGES, msgs
+    )
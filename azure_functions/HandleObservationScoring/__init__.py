@@ -0,0 +1,89 @@
+import logging, json
+
+import azure.functions as func
+from src.storage import Storage
+from src.data.feedbackItems import FeedbackItem
+from src.data.observations import Observation
+from src.data.ledger import LedgerEntry
+from src.pipeline import (
+    FeedbackItemCheckpoint,
+    FeedbackItemPipeline,
+    run_remaining_stages,
+)
+
+HANDLER = "HandleObservationScoring"
+JOIN = "FeedbackItemJoin"
+
+
+def main(msg: func.ServiceBusMessage) -> None:
+    logging.info("INIT: Unpacking Request Body")
+    req_body = json.loads(msg.get_body())
+    feedback_item_id: str = req_body.get("feedback_item_id")
+    parent_id: str = req_body.get("ledger_id")
+    observation = Observation.model_validate(req_body.get("observation"))
+
+    with Storage() as storage:
+        parent = storage.get_node(parent_id, LedgerEntry)
+        if parent.completed:
+            logging.info("DONE: Feedback item already processed.")
+            return
+        storage.origin_run = parent.id
+
+        logging.info(f"Getting FeedbackItem with ID: {feedback_item_id}")
+        feedback_item = storage.get_node(feedback_item_id, FeedbackItem)
+
+        ledger = storage.open_ledger_entry(
+            HANDLER, observation.id, parent.version, parent_id=parent.id
+        )
+        if not ledger.completed:
+            pipeline = FeedbackItemPipeline(
+                storage,
+                feedback_item,
+                checkpoint=FeedbackItemCheckpoint.from_json(ledger.checkpoint),
+                on_checkpoint=lambda checkpoint: storage.save_checkpoint(
+                    ledger, checkpoint
+                ),
+            )
+            # Scores are checkpointed before they are stored, so a retry stores the same ones
+            if len(pipeline.checkpoint.observations) == 0:
+                pipeline.score_observations([observation])
+                pipeline.checkpoint.observations.append(observation)
+                pipeline.save()
+            logging.info("DATAPOINTS: Adding to Storage")
+            pipeline.store_observations(pipeline.checkpoint.observations)
+            storage.complete_ledger_entry(ledger)
+
+        # Checked even if this observation was done before, in case the join was interrupted
+        completed = storage.count_completed_children(parent)
+        logging.info(f"{completed} of {parent.fan_out} observations done.")
+        if completed < parent.fan_out:
+            return
+
+        join = LedgerEntry(
+            handler=JOIN,
+            node_id=feedback_item_id,
+            version=parent.version,
+            owner=observation.id,
+        )
+        if not storage.claim_ledger_entry(join):
+            logging.info("DONE: Another observation is finishing the feedback item.")
+            return
+
+        logging.info("Every observation is done. Finishing the feedback item.")
+        parent_checkpoint = FeedbackItemCheckpoint.from_json(parent.checkpoint)
+        # Reloaded, so they carry the needs_action flags they were stored with
+        parent_checkpoint.observations = storage.get_nodes(
+            [observation.id for observation in parent_checkpoint.observations],
+            Observation,
+        )
+        pipeline = FeedbackItemPipeline(
+            storage,
+            feedback_item,
+            checkpoint=parent_checkpoint,
+            on_checkpoint=lambda checkpoint: storage.save_checkpoint(
+                parent, checkpoint
+            ),
+        )
+        run_remaining_stages(storage, parent, pipeline)
+
+    logging.info("DONE: Finished processing.")
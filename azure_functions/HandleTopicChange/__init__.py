@@ -5,11 +5,15 @@ from src.storage import Storage
 from src.data.observations import Observation
 from src.data.topics import Topic
 from src.data.actionItems import ActionItem
+from src.data.ledger import message_version
+from src.pipeline import from_other_runs
 from src.llm.connections import (
     infer_topic_to_observations_connections,
     infer_topic_to_action_items_connections,
 )
 
+HANDLER = "HandleTopicChange"
+
 
 def main(msg: func.ServiceBusMessage) -> None:
     logging.info("INIT: Unpacking Request Body")
@@ -17,31 +21,61 @@ def main(msg: func.ServiceBusMessage) -> None:
     id: str = req_body.get("id")
 
     with Storage() as storage:
+        ledger = storage.open_ledger_entry(
+            HANDLER, id, message_version(req_body, msg.message_id)
+        )
+        if ledger.completed:
+            logging.info("DONE: Already processed.")
+            return
+
         logging.info(f"Getting Topic with ID: {id}")
         topic = storage.get_node(id, Topic)
 
-        logging.info("Infer related Observations")
-        existing_observations, scores = storage.search_semantically(  # type: ignore
-            search_for=Observation, from_text=topic.text, top_k=10, min_score=0.0
-        )
-        related_observations = infer_topic_to_observations_connections(
-            topic, existing_observations
-        )
-        storage.add_topic_to_observations_edges(topic, related_observations)
-        logging.info(
-            f"Topic: \n\n {topic.text} \n\nContains Observations: {related_observations}\n\n"
-        )
+        if not ledger.is_done("observations"):
+            logging.info("Infer related Observations")
+            existing_observations, scores = storage.search_semantically(  # type: ignore
+                search_for=Observation,
+                from_text=topic.text,
+                top_k=10,
+                min_score=0.0,
+                adaptive=True,
+            )
+            existing_observations, scores = from_other_runs(
+                topic, existing_observations, scores
+            )
+            related_observations = infer_topic_to_observations_connections(
+                topic,
+                existing_observations,
+                similarities=scores,
+                embed=storage.embed_nodes,
+            )
+            storage.add_topic_to_observations_edges(topic, related_observations)
+            logging.info(
+                f"Topic: \n\n {topic.text} \n\nContains Observations: {related_observations}\n\n"
+            )
+            storage.complete_stage(ledger, "observations")
 
-        logging.info("Infer related Action Items")
-        existing_action_items, scores = storage.search_semantically(  # type: ignore
-            search_for=ActionItem, from_text=topic.text, top_k=10, min_score=0.0
-        )
-        related_action_items = infer_topic_to_action_items_connections(
-            topic, existing_action_items
-        )
-        storage.add_topic_to_action_items_edges(topic, related_action_items)
-        logging.info(
-            f"Topic: \n\n {topic.text} \n\nContains Action Items: {related_action_items}\n\n"
-        )
+        if not ledger.is_done("action_items"):
+            logging.info("Infer related Action Items")
+            existing_action_items, scores = storage.search_semantically(  # type: ignore
+                search_for=ActionItem,
+                from_text=topic.text,
+                top_k=10,
+                min_score=0.0,
+                adaptive=True,
+            )
+            related_action_items = infer_topic_to_action_items_connections(
+                topic,
+                existing_action_items,
+                similarities=scores,
+                embed=storage.embed_nodes,
+            )
+            storage.add_topic_to_action_items_edges(topic, related_action_items)
+            logging.info(
+                f"Topic: \n\n {topic.text} \n\nContains Action Items: {related_action_items}\n\n"
+            )
+            storage.complete_stage(ledger, "action_items")
+
+        storage.complete_ledger_entry(ledger)
 
     logging.info("DONE: Finished processing.")
@@ -0,0 +1,13 @@
+from typing import List
+
+import azure.functions as func
+from src.data.topics import Topic
+from src.queues import TOPIC_CHANGE_QUEUE
+from src.change_batches import TOPIC_STAGES, handle_change_batch
+
+# Shares its ledger entries, so a message done by either handler isn't done again
+HANDLER = "HandleTopicChange"
+
+
+def main(msgs: List[func.ServiceBusMessage]) -> None:
+    handle_change_batch(HANDLER, TOPIC_CHANGE_QUEUE, Topic, TOPIC_STAGES, msgs)
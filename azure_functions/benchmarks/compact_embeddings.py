@@ -0,0 +1,117 @@
+"""
+Compares recall and memory of CompactEmbeddingStore precisions against the float32 baseline.
+
+Uses synthetic clustered unit vectors shaped like Ada embeddings so it runs offline:
+
+    python -m benchmarks.compact_embeddings --count 20000 --queries 200
+"""
+
+import argparse
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from src.vector.compact import CompactEmbeddingStore, Precision
+
+
+def generate_embeddings(
+    count: int, dimension: int, clusters: int, seed: int
+) -> np.ndarray:
+    """
+    Generates normalized vectors grouped around random centers, so neighbours are close like real embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    assignments = rng.integers(0, clusters, size=count)
+    noise = rng.normal(scale=0.6, size=(count, dimension)).astype(np.float32)
+    embeddings = centers[assignments] + noise
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def python_list_bytes(embeddings: np.ndarray) -> int:
+    """
+    Approximate size of the same embeddings held as lists of Python floats, as generate_embedding returns them.
+    """
+    sample = embeddings[0].tolist()
+    per_vector = sys.getsizeof(sample) + sum(sys.getsizeof(value) for value in sample)
+    return per_vector * embeddings.shape[0]
+
+
+def recall_at_k(expected: List[List[str]], actual: List[List[str]]) -> float:
+    hits = 0
+    total = 0
+    for expected_ids, actual_ids in zip(expected, actual):
+        hits += len(set(expected_ids) & set(actual_ids))
+        total += len(expected_ids)
+    return hits / total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rescore-candidates", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embeddings = generate_embeddings(
+        args.count + args.queries, args.dimension, args.clusters, args.seed
+    )
+    corpus = embeddings[: args.count]
+    queries = embeddings[args.count :]
+    ids = [f"Observation_{i}" for i in range(args.count)]
+    full_precision: Dict[str, List[float]] = {}
+
+    def full_precision_source(candidate_ids: List[str]) -> Dict[str, List[float]]:
+        return {id: full_precision[id] for id in candidate_ids}
+
+    stores: Dict[Precision, CompactEmbeddingStore] = {}
+    for precision in Precision:
+        store = CompactEmbeddingStore(args.dimension, precision)
+        store.add(ids, corpus)  # type: ignore
+        stores[precision] = store
+
+    baseline = stores[Precision.FLOAT32]
+    for id in ids:
+        full_precision[id] = baseline.get(id).tolist()
+    expected = [
+        [id for id, _ in baseline.search(query, args.top_k)] for query in queries  # type: ignore
+    ]
+
+    print(f"{args.count} vectors, dimension {args.dimension}, top_k {args.top_k}")
+    print(f"python lists: {python_list_bytes(corpus) / 2**20:10.1f} MiB")
+    for precision, store in stores.items():
+        for rescore in (False, True):
+            if rescore and precision == Precision.FLOAT32:
+                continue
+            source = full_precision_source if rescore else None
+            start = time.perf_counter()
+            actual = [
+                [
+                    id
+                    for id, _ in store.search(
+                        query,  # type: ignore
+                        args.top_k,
+                        full_precision_source=source,
+                        rescore_candidates=args.rescore_candidates,
+                    )
+                ]
+                for query in queries
+            ]
+            elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            label = precision.value + (" + rescore" if rescore else "")
+            print(
+                f"{label:18}: {store.memory_bytes() / 2**20:10.1f} MiB"
+                f"  recall@{args.top_k} {recall_at_k(expected, actual):.4f}"
+                f"  {elapsed_ms:.2f} ms/query"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Processes change messages for one node type in batches, for the *ChangeBatch handlers, which are triggered
+with Service Bus cardinality many.
+
+The batch handlers do the same work as HandleObservationChange, HandleTopicChange and HandleActionItemChange.
+However, the batch shares the requests a single message would make on its own:
+- the ledger entries and the changed nodes are each read in one query;
+- the embeddings are fetched in one request;
+- the vector queries for a stage run concurrently;
+- candidates found by several nodes are read once;
+- the connection prompts of a stage run concurrently (see src.llm.concurrency).
+
+Like the single message handlers, they skip the work done by the pipeline run that stored a node, and
+only connect an observation to action items again when its flags are updated (see src.pipeline).
+
+Each batch handler shares its ledger entries (see Storage.open_ledger_entry) with the single message handler
+of its queue, so a message done by either isn't done again. Only run one of them per queue: the batch handlers
+ship disabled in their function.json. To switch a queue over, set for example
+AzureWebJobs.HandleObservationChangeBatch.Disabled to false and AzureWebJobs.HandleObservationChange.Disabled
+to true.
+
+A message that fails doesn't stop the others. Once the batch is processed, the handler sends the failed
+messages to its queue again, delayed and with their message ids, and the batch succeeds. Raising would make
+Service Bus deliver the whole batch again, counting a delivery against the messages that were done too. A
+message is sent again at most MAX_RESENDS times, and messages that can't be read aren't sent again.
+"""
+
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import azure.functions as func
+from pydantic import BaseModel
+
+from src.queues import send_messages
+
+from src.data import ActionItem, LedgerEntry, Observation, Topic
+from src.data.ledger import message_version
+from src.storage import NEEDS_ACTION_FILTER, Storage
+from src.vector.cutoff import SimilaritySource
+from src.pipeline import (
+    connects_observation,
+    from_other_runs,
+    is_flag_update,
+    raises_needs_action,
+)
+from src.llm.concurrency import map_concurrently
+from src.llm.connections import (
+    infer_action_item_to_observations_connections,
+    infer_action_item_to_topics_connections,
+    infer_observation_to_action_items_connections,
+    infer_observation_to_topics_connections,
+    infer_topic_to_action_items_connections,
+    infer_topic_to_observations_connections,
+)
+
+PROCESSED = "processed"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# Counts how many times a failed message was sent again
+RESENDS_KEY = "_resends"
+MAX_RESENDS = 5
+RESEND_DELAY_SECONDS = 60.0
+
+
+class ConnectionStage(BaseModel):
+    """
+    One stage of a change handler: connecting the changed nodes to candidates of another type.
+    """
+
+    name: str
+    candidate_type: Any
+    infer: Callable[..., List[Any]]
+    add_edges: Callable[..., None]
+    filter: Optional[Dict[str, Any]] = None
+    # Only observations needing action are connected to action items
+    needs_action_only: bool = False
+    # Candidates stored by the same run as the node are left out (see src.pipeline.from_other_runs)
+    other_runs_only: bool = False
+    # Also run for flag updates of observations (see src.pipeline.is_flag_update)
+    on_flag_update: bool = False
+
+
+OBSERVATION_STAGES = [
+    ConnectionStage(
+        name="action_items",
+        candidate_type=ActionItem,
+        infer=infer_observation_to_action_items_connections,
+        add_edges=Storage.add_observation_to_action_items_edges,
+        needs_action_only=True,
+        on_flag_update=True,
+    ),
+    ConnectionStage(
+        name="topics",
+        candidate_type=Topic,
+        infer=infer_observation_to_topics_connections,
+        add_edges=Storage.add_observation_to_topics_edges,
+    ),
+]
+
+ACTION_ITEM_STAGES = [
+    ConnectionStage(
+        name="observations",
+        candidate_type=Observation,
+        infer=infer_action_item_to_observations_connections,
+        add_edges=Storage.add_action_item_to_observations_edges,
+        filter=NEEDS_ACTION_FILTER,
+        other_runs_only=True,
+    ),
+    ConnectionStage(
+        name="topics",
+        candidate_type=Topic,
+        infer=infer_action_item_to_topics_connections,
+        add_edges=Storage.add_action_item_to_topics_edges,
+        other_runs_only=True,
+    ),
+]
+
+TOPIC_STAGES = [
+    ConnectionStage(
+        name="observations",
+        candidate_type=Observation,
+        infer=infer_topic_to_observations_connections,
+        add_edges=Storage.add_topic_to_observations_edges,
+        other_runs_only=True,
+    ),
+    ConnectionStage(
+        name="action_items",
+        candidate_type=ActionItem,
+        infer=infer_topic_to_action_items_connections,
+        add_edges=Storage.add_topic_to_action_items_edges,
+    ),
+]
+
+
+class MessageResult(BaseModel):
+    message_id: str
+    node_id: str = ""
+    status: str = PROCESSED
+    error: str = ""
+    # None if the message can't be read
+    body: Optional[Dict[str, Any]] = None
+
+
+class BatchReport(BaseModel):
+    handler: str
+    results: List[MessageResult] = []
+
+    def failed(self) -> List[MessageResult]:
+        return [result for result in self.results if result.status == FAILED]
+
+    def summary(self) -> str:
+        counts = {
+            status: sum(1 for result in self.results if result.status == status)
+            for status in (PROCESSED, SKIPPED, FAILED)
+        }
+        lines = [
+            f"{self.handler}: {len(self.results)} messages. {counts[PROCESSED]} processed, {counts[SKIPPED]} skipped, {counts[FAILED]} failed."
+        ]
+        lines.extend(
+            f"  {result.message_id} ({result.node_id}): {result.error}"
+            for result in self.failed()
+        )
+        return "\n".join(lines)
+
+
+def find_candidates(
+    storage: Storage, stage: ConnectionStage, nodes: List[Any]
+) -> Tuple[List[Tuple[List[Any], List[float]]], SimilaritySource]:
+    """
+    The candidates and similarities of every node for a stage, searched like the single message handlers do,
+    and where the similarities come from.
+    """
+    if stage.candidate_type is Topic and all(
+        isinstance(node, Observation) for node in nodes
+    ):
+        return (
+            storage.search_topics_many(nodes, top_k=10, min_score=0.0, adaptive=True),
+            storage.topic_search_source(),
+        )
+    return (
+        storage.search_semantically_many(
+            search_for=stage.candidate_type,
+            embeddings=storage.embed_nodes(nodes),
+            top_k=10,
+            min_score=0.0,
+            adaptive=True,
+            filter=stage.filter,
+        ),
+        SimilaritySource.VECTOR,
+    )
+
+
+def process_change_batch(
+    storage: Storage,
+    handler: str,
+    node_type: Type[Any],
+    stages: List[ConnectionStage],
+    msgs: List[func.ServiceBusMessage],
+) -> BatchReport:
+    """
+    Runs every stage for the nodes the messages are about, recording each message's result.
+    """
+    report = BatchReport(handler=handler)
+
+    # Messages that can't be read fail on their own
+    keys: List[Tuple[str, str]] = []
+    results: List[MessageResult] = []
+    bodies: List[Dict[str, Any]] = []
+    for i, msg in enumerate(msgs):
+        result = MessageResult(message_id=getattr(msg, "message_id", None) or str(i))
+        report.results.append(result)
+        try:
+            req_body = json.loads(msg.get_body())
+            result.node_id = req_body["id"]
+            result.body = req_body
+        except (ValueError, KeyError, TypeError) as e:
+            result.status, result.error = FAILED, f"Unreadable message: {e}"
+            continue
+        if is_flag_update(req_body) and not raises_needs_action(req_body):
+            result.status = SKIPPED
+            continue
+        keys.append(
+            (
+                result.node_id,
+                message_version(req_body, getattr(msg, "message_id", None)),
+            )
+        )
+        results.append(result)
+        bodies.append(req_body)
+
+    ledgers = storage.open_ledger_entries(handler, keys)
+    pending: Dict[str, Tuple[LedgerEntry, MessageResult]] = {}
+    pending_bodies: Dict[str, Dict[str, Any]] = {}
+    for ledger, result, req_body in zip(ledgers, results, bodies):
+        # Done before, or the same change delivered twice in this batch
+        if ledger.completed or ledger.id in pending:
+            result.status = SKIPPED
+            continue
+        pending[ledger.id] = (ledger, result)
+        pending_bodies[ledger.id] = req_body
+
+    nodes = {
+        node.id: node
+        for node in storage.get_nodes(
+            sorted({ledger.node_id for ledger, _ in pending.values()}), node_type
+        )
+    }
+    for ledger, result in pending.values():
+        if ledger.node_id not in nodes:
+            result.status, result.error = FAILED, "Node not found"
+
+    if node_type is Observation:
+        runs = storage.get_runs(list(nodes.values()))
+        for ledger, result in pending.values():
+            run = runs.get(getattr(nodes.get(ledger.node_id), "origin_run", None) or "")
+            if run is not None and connects_observation(run, pending_bodies[ledger.id]):
+                storage.complete_ledger_entry(ledger)
+                result.status = SKIPPED
+
+    for stage in stages:
+        todo = [
+            (ledger, result)
+            for ledger, result in pending.values()
+            if result.status == PROCESSED
+            and not ledger.is_done(stage.name)
+            and (stage.on_flag_update or not is_flag_update(pending_bodies[ledger.id]))
+        ]
+        if stage.needs_action_only:
+            needs_action = storage.observations_need_action(
+                [nodes[ledger.node_id] for ledger, _ in todo]
+            )
+            for ledger, _ in todo:
+                if not needs_action[ledger.node_id]:
+                    storage.complete_stage(ledger, stage.name)
+            todo = [
+                (ledger, result)
+                for ledger, result in todo
+                if needs_action[ledger.node_id]
+            ]
+        if len(todo) == 0:
+            continue
+
+        logging.info(f"Infer related {stage.name} for {len(todo)} nodes")
+        try:
+            candidates, source = find_candidates(
+                storage, stage, [nodes[ledger.node_id] for ledger, _ in todo]
+            )
+        except Exception as e:
+            logging.exception(f"Searching {stage.name} failed: {e}")
+            for _, result in todo:
+                result.status, result.error = FAILED, f"{stage.name}: {e}"
+            continue
+
+        def connect(
+            item: Tuple[
+                Tuple[LedgerEntry, MessageResult], Tuple[List[Any], List[float]]
+            ],
+        ) -> None:
+            (ledger, result), (existing, similarities) = item
+            node = nodes[ledger.node_id]
+            try:
+                if stage.other_runs_only:
+                    existing, similarities = from_other_runs(
+                        node, existing, similarities
+                    )
+                related = stage.infer(
+                    node,
+                    existing,
+                    similarities=similarities,
+                    embed=storage.embed_nodes,
+                    source=source,
+                )
+                stage.add_edges(storage, node, related)
+                storage.complete_stage(ledger, stage.name)
+            except Exception as e:
+                logging.exception(f"{stage.name} failed for {node.id}: {e}")
+                result.status, result.error = FAILED, f"{stage.name}: {e}"
+
+        map_concurrently(connect, list(zip(todo, candidates)))
+
+    for ledger, result in pending.values():
+        if result.status == PROCESSED:
+            storage.complete_ledger_entry(ledger)
+
+    logging.info(report.summary())
+    return report
+
+
+def resend_failed(queue_name: str, report: BatchReport) -> None:
+    """
+    Sends the failed messages that can be read to the queue again, each delayed longer the more times it was
+    sent again, and logs the ones that are given up on.
+    """
+    resends: Dict[int, List[Tuple[str, Dict[str, Any]]]] = {}
+    for result in report.failed():
+        body = result.body
+        if body is None or int(body.get(RESENDS_KEY, 0)) >= MAX_RESENDS:
+            logging.error(
+                f"Giving up on {result.message_id} ({result.node_id}): {result.error}"
+            )
+            continue
+        count = int(body.get(RESENDS_KEY, 0)) + 1
+        resends.setdefault(count, []).append(
+            (result.message_id, {**body, RESENDS_KEY: count})
+        )
+
+    for count, messages in resends.items():
+        send_messages(
+            queue_name,
+            [body for _, body in messages],
+            message_ids=[message_id for message_id, _ in messages],
+            delay_seconds=RESEND_DELAY_SECONDS * count,
+        )
+
+
+def handle_change_batch(
+    handler: str,
+    queue_name: str,
+    node_type: Type[Any],
+    stages: List[ConnectionStage],
+    msgs: List[func.ServiceBusMessage],
+) -> BatchReport:
+    """
+    The body of a batch handler. Sends the failed messages to queue_name again once the batch is processed.
+    """
+    logging.info(f"INIT: Processing {len(msgs)} messages")
+    with Storage() as storage:
+        report = process_change_batch(storage, handler, node_type, stages, msgs)
+
+    resend_failed(queue_name, report)
+    logging.info("DONE: Finished processing.")
+    return report
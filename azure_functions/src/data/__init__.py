@@ -6,10 +6,13 @@ from src.data.topics import Topic
 from src.data.state import AppState
 from src.data.scores import Score
 from src.data.actionItems import ActionItem
+from src.data.ledger import LedgerEntry
 
 
 # Create a Union for all Graph Nodes
-GraphNode = Union[Review, FeedbackItem, Observation, ActionItem, Score, Topic, AppState]
+GraphNode = Union[
+    Review, FeedbackItem, Observation, ActionItem, Score, Topic, AppState, LedgerEntry
+]
 GraphNodeVar = TypeVar("GraphNodeVar", bound=GraphNode)
 
 # Create a Union for all Embeddable Graph Nodes
@@ -31,4 +34,5 @@ LABEL_TO_CLASS = {
     "Topic": Topic,
     "AppState": AppState,
     "ActionItem": ActionItem,
+    "LedgerEntry": LedgerEntry,
 }
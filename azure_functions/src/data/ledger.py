@@ -0,0 +1,78 @@
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+import hashlib
+import time
+
+
+def message_version(body: Dict[str, Any], message_id: Optional[str] = None) -> str:
+    """
+    The version of the node a change message is about. Messages from GraphChangeRouter carry the changed
+    document, whose etag changes on every write. Messages without one, e.g. sent by hand, fall back to the
+    Service Bus message id, so only redeliveries of the same message are skipped. Messages without either get
+    a version of their own, so they are never skipped.
+    """
+    version = body.get("_etag") or body.get("_ts")
+    if version:
+        return str(version)
+    if message_id:
+        return f"message:{message_id}"
+    return f"unversioned:{uuid4()}"
+
+
+def document_property(body: Dict[str, Any], key: str) -> Any:
+    """
+    A property of the node a change message is about, or None. The graph stores a vertex property as a list
+    of {"id": ..., "_value": ...}, while messages sent by hand may carry the plain value.
+    """
+    value = body.get(key)
+    if isinstance(value, list):
+        if len(value) == 0 or not isinstance(value[0], dict):
+            return None
+        return value[0].get("_value")
+    return value
+
+
+class LedgerEntry(BaseModel):
+    """
+    Progress of one handler on one version of a node, so a redelivered message skips the stages already done.
+    Entries are deleted once no message can be redelivered for them (see src.jobs.expire_ledger).
+    """
+
+    handler: str
+    node_id: str
+    version: str = ""
+    # Comma separated, since list properties don't round trip through the graph
+    completed_stages: str = ""
+    completed: bool = False
+    # JSON of the intermediate results a retry resumes from, if the handler keeps any
+    checkpoint: str = ""
+    # For entries of fanned out messages, the id of the entry they report to, and for that entry, the number
+    # of messages it fanned out to
+    parent_id: str = ""
+    fan_out: int = 0
+    # The message that claimed the entry, for work only one message may do
+    owner: str = ""
+    id: str = ""
+    created_at: float = 0
+    updated_at: float = 0
+
+    def model_post_init(self, __context: Any) -> None:
+        if self.id == "":
+            key = f"{self.handler}\x00{self.node_id}\x00{self.version}"
+            digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+            self.id: str = f"{self.__class__.__name__}_{digest}"
+        if self.created_at == 0:
+            self.created_at = time.time()
+        return super().model_post_init(__context)
+
+    def stages(self) -> List[str]:
+        return [stage for stage in self.completed_stages.split(",") if stage != ""]
+
+    def is_done(self, stage: str) -> bool:
+        return self.completed or stage in self.stages()
+
+    def mark_done(self, stage: str) -> None:
+        if stage not in self.stages():
+            self.completed_stages = ",".join(self.stages() + [stage])
+        self.updated_at = time.time()
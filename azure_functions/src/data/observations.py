@@ -1,13 +1,34 @@
 from pydantic import BaseModel
 from uuid import uuid4
-from typing import Any
+from typing import Any, Dict, Optional
 import time
 
+from src.data.scores import ScoreNames
+
+# The Observation field holding the value of each of its scores
+SCORE_FIELDS: Dict[ScoreNames, str] = {
+    ScoreNames.SATISFACTION: "satisfaction_score",
+    ScoreNames.SPECIFICITY: "specificity_score",
+    ScoreNames.BUSINESS_IMPACT: "business_impact_score",
+}
+
 
 class Observation(BaseModel):
     text: str
     id: str = ""
     created_at: float = 0
+    # Set from the observation's scores when they are stored, so searches don't have to traverse to them
+    needs_action: Optional[bool] = None
+    satisfaction_score: Optional[float] = None
+    specificity_score: Optional[float] = None
+    business_impact_score: Optional[float] = None
+    # Set by Storage.update_observation_flags, whose writes only change the flags, so the change handlers don't
+    # connect the observation again: when the flags were last written, and whether that write turned a False
+    # needs_action flag True
+    flags_updated_at: Optional[float] = None
+    needs_action_raised: bool = False
+    # The ledger entry of the run that created the node, if a pipeline run did (see Storage.origin_run)
+    origin_run: Optional[str] = None
 
     def model_post_init(self, __context: Any) -> None:
         if self.id == "":
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from uuid import uuid4
-from typing import Any
+from typing import Any, Optional
 import time
 
 
@@ -8,6 +8,8 @@ class Topic(BaseModel):
     text: str
     id: str = ""
     created_at: float = 0
+    # The ledger entry of the run that created the node, if a pipeline run did (see Storage.origin_run)
+    origin_run: Optional[str] = None
 
     def model_post_init(self, __context: Any) -> None:
         if self.id == "":
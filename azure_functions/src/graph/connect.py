@@ -1,6 +1,6 @@
 import logging
 import time
-from typing import List, Type, Dict, Any
+from typing import List, Type, Dict, Any, Iterator, Optional
 from enum import Enum
 from src.data import GraphNode, ListGraphNodes, LABEL_TO_CLASS, GraphNodeVar
 
@@ -14,6 +14,20 @@ if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
+def escape(value: str) -> str:
+    """
+    Escapes a string for a single quoted literal in a query: backslashes, e.g. in JSON, and single quotes.
+    """
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def quote_ids(ids: List[str]) -> str:
+    """
+    Ids as comma separated, escaped literals, e.g. for g.V(...).
+    """
+    return ", ".join(f"'{escape(id)}'" for id in ids)
+
+
 class GraphConnection:
     def __init__(self, strong_consistency: bool = False) -> None:
         self.strong_consistency = strong_consistency
@@ -51,14 +65,24 @@ class GraphConnection:
         logging.info(f"Reset graph {self.graph_name}.")
 
     def delete_node(self, id: str):
-        query = f"g.V('{id}').drop()"
+        query = f"g.V('{escape(id)}').drop()"
         result = self.submit_query(query)  # type: ignore
         if len(result) != 1:
             raise Exception(f"Error deleting node {id}.")
         logging.info(f"Deleted node {id}.")
 
+    def delete_nodes(self, ids: List[str]):
+        """
+        Deletes multiple nodes and their edges in one query.
+        """
+        if len(ids) == 0:
+            return
+        ids_str = quote_ids(ids)
+        self.submit_query(f"g.V({ids_str}).drop()")  # type: ignore
+        logging.info(f"Deleted {len(ids)} nodes.")
+
     def check_if_node_exists(self, id: str) -> bool:
-        query = f"g.V('{id}')"
+        query = f"g.V('{escape(id)}')"
         result = self.submit_query(query)  # type: ignore
         if len(result) == 0:
             node_exists = False
@@ -67,7 +91,7 @@ class GraphConnection:
         return node_exists  # type: ignore
 
     def get_node_as_str(self, node_id: str) -> str:
-        query = f"g.V('{node_id}')"
+        query = f"g.V('{escape(node_id)}')"
         result = self.submit_query(query)  # type: ignore
         if len(result) != 1:
             raise Exception(f"Found {len(result)} nodes with ID {node_id}.")
@@ -98,6 +122,119 @@ class GraphConnection:
             nodes.append(node)  # type: ignore
         return nodes  # type: ignore
 
+    def get_nodes(self, ids: List[str], type: Type[GraphNodeVar]) -> List[GraphNodeVar]:
+        """
+        Gets multiple nodes in one query. Ids that don't exist are omitted from the result.
+        """
+        if len(ids) == 0:
+            return []
+        ids_str = quote_ids(ids)
+        query = f"g.V({ids_str})"
+        result = self.submit_query(query)  # type: ignore
+        nodes = []
+        for node_dict in result:  # type: ignore
+            nodes.append(self.str_to_object(json.dumps(node_dict), type))  # type: ignore
+        return nodes  # type: ignore
+
+    def get_existing_node_ids(self, ids: List[str]) -> List[str]:
+        """
+        Returns the subset of ids that exist in the graph.
+        """
+        if len(ids) == 0:
+            return []
+        ids_str = quote_ids(ids)
+        query = f"g.V({ids_str}).id()"
+        result = self.submit_query(query)  # type: ignore
+        return result  # type: ignore
+
+    def count_nodes(self, type: Type[GraphNode], properties: Dict[str, Any]) -> int:
+        """
+        Counts the nodes of a type with the given property values, e.g. {"completed": True}.
+        """
+        query = f"g.V().hasLabel('{type.__name__}')"
+        for key, value in properties.items():
+            if isinstance(value, bool):
+                query += f".has('{key}', {str(value).lower()})"
+            else:
+                query += f".has('{key}', '{escape(str(value))}')"
+        result = self.submit_query(query + ".count()")  # type: ignore
+        return int(result[0])  # type: ignore
+
+    def get_property_values(self, ids: List[str], key: str) -> Dict[str, Any]:
+        """
+        Gets one property of multiple nodes in one query. Nodes without the property are omitted.
+        """
+        if len(ids) == 0:
+            return {}
+        ids_str = quote_ids(ids)
+        query = f"g.V({ids_str}).has('{key}').project('id', 'value').by(id()).by(values('{key}'))"
+        result: List[Dict[str, Any]] = self.submit_query(query)  # type: ignore
+        return {row["id"]: row["value"] for row in result}
+
+    def get_neighbor_properties(
+        self, ids: List[str], edge_label: str, keys: List[str]
+    ) -> List[Dict[str, Any]]:
+        """
+        Gets properties of the nodes that multiple nodes have an edge_label edge to, in one query. Returns
+        one {"id": id of the node the edge is from, key: value, ...} dict per edge. Neighbors missing any
+        of the keys are omitted.
+        """
+        if len(ids) == 0:
+            return []
+        ids_str = quote_ids(ids)
+        has_keys = "".join(f".where(inV().has('{key}'))" for key in keys)
+        keys_str = ", ".join(f"'{key}'" for key in keys)
+        by_keys = "".join(f".by(inV().values('{key}'))" for key in keys)
+        query = f"g.V({ids_str}).outE('{edge_label}'){has_keys}.project('id', {keys_str}).by(outV().id()){by_keys}"
+        return self.submit_query(query)  # type: ignore
+
+    def get_neighbor_ids(self, ids: List[str], edge_label: str) -> List[List[str]]:
+        """
+        Gets [id, neighbor id] for every edge_label edge from multiple nodes, in one query.
+        """
+        if len(ids) == 0:
+            return []
+        ids_str = quote_ids(ids)
+        query = f"g.V({ids_str}).outE('{edge_label}').project('from', 'to').by(outV().id()).by(inV().id())"
+        result: List[Dict[str, str]] = self.submit_query(query)  # type: ignore
+        return [[row["from"], row["to"]] for row in result]
+
+    def get_ids_created_after(
+        self, type: Type[GraphNodeVar], created_at: float
+    ) -> List[str]:
+        query = f"g.V().hasLabel('{type.__name__}').has('created_at', gt({created_at})).id()"
+        return self.submit_query(query)  # type: ignore
+
+    def stream_node_ids(
+        self,
+        type: Type[GraphNodeVar],
+        page_size: int = 1000,
+        without_edge: Optional[str] = None,
+        created_before: Optional[float] = None,
+    ) -> Iterator[List[str]]:
+        """
+        Yields pages of node ids of a type in ascending id order. With without_edge, only nodes without an
+        outgoing edge of that label. With created_before, only nodes created before that time.
+
+        Uses keyset pagination (ids greater than the last one seen) so memory is bounded by the page size, and
+        the nodes of a page can be deleted before the next one is read.
+        """
+        filters = ""
+        if without_edge is not None:
+            filters = f".not(outE('{without_edge}'))"
+        if created_before is not None:
+            filters += f".has('created_at', lt({created_before}))"
+        last_id = ""
+        while True:
+            query = f"g.V().hasLabel('{type.__name__}').has('id', gt('{escape(last_id)}')){filters}.order().by('id').limit({page_size}).id()"
+            page: List[str] = self.submit_query(query)  # type: ignore
+            if len(page) == 0:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last_id = page[-1]
+
     def add_properties_to_query(
         self, query: str, node: GraphNode, updating: bool = False
     ) -> str:
@@ -108,9 +245,12 @@ class GraphConnection:
                 continue  # Don't update the ID
             if isinstance(value, Enum):
                 value = value.value  # Unpack the enum's value
-            if isinstance(value, str):
-                escaped_value = value.replace("'", "\\'")  # Escape single quotes
-                query += f".property('{key}', '{escaped_value}')"  # Quotes to indicate string
+            if value is None:
+                continue  # Unset optional properties are left out
+            if isinstance(value, bool):
+                query += f".property('{key}', {str(value).lower()})"
+            elif isinstance(value, str):
+                query += f".property('{key}', '{escape(value)}')"  # Quotes to indicate string
             elif isinstance(value, list):
                 escaped_value = value.__str__().replace(
                     "'", "\\'"
@@ -122,7 +262,7 @@ class GraphConnection:
 
         # Add Partition Key - We use the ID since it is a random UUID
         if not updating:
-            query += f".property('pk', '{model_dict['id']}')"
+            query += f".property('pk', '{escape(model_dict['id'])}')"
 
         return query
 
@@ -145,6 +285,21 @@ class GraphConnection:
 
         logging.info(f"Added {node.id} of type {label}.")
 
+    def try_add_node(self, node: GraphNode) -> bool:
+        """
+        Adds a node in one query, so of several callers adding the same id, only one succeeds. Returns False if
+        the node already exists.
+        """
+        query = self.add_properties_to_query(f"g.addV('{type(node).__name__}')", node)
+        try:
+            self.submit_query(query)  # type: ignore
+        except GremlinServerError as e:
+            attributes = getattr(e, "status_attributes", None) or {}
+            if attributes.get("x-ms-status-code") == 409:
+                return False
+            raise
+        return True
+
     def add_nodes(self, nodes: ListGraphNodes):
         for node in nodes:
             self.add_node(node)
@@ -166,6 +321,21 @@ class GraphConnection:
             for to_node in to_nodes:
                 self.add_edge(from_node, to_node, edge_label)
 
+    def copy_edges(
+        self, from_ids: List[str], to_id: str, out_label: str, in_label: str
+    ) -> int:
+        """
+        Gives the to_id node the outgoing out_label edges and incoming in_label edges of the from_ids nodes,
+        in one query per direction. Edges the to_id node already has are not duplicated. Returns the number of
+        edges added.
+        """
+        if len(from_ids) == 0:
+            return 0
+        ids_str = quote_ids(from_ids)
+        outgoing = f"g.V('{escape(to_id)}').as('target').V({ids_str}).out('{out_label}').dedup().not(__.in('{out_label}').hasId('{escape(to_id)}')).addE('{out_label}').from('target')"
+        incoming = f"g.V('{escape(to_id)}').as('target').V({ids_str}).in('{in_label}').dedup().not(__.out('{in_label}').hasId('{escape(to_id)}')).addE('{in_label}').to('target')"
+        return len(self.submit_query(outgoing)) + len(self.submit_query(incoming))  # type: ignore
+
     def add_edge(self, from_node: GraphNode, to_node: GraphNode, edge_label: str):
         """
         Add edge between two nodes. Assumes that the nodes already exist in the graph.
@@ -187,7 +357,7 @@ class GraphConnection:
 
         for attempt in range(MAX_RETRIES):
             try:
-                query = f"g.V('{from_node.id}').addE('{edge_label}').to(g.V('{to_node.id}'))"
+                query = f"g.V('{escape(from_node.id)}').addE('{edge_label}').to(g.V('{escape(to_node.id)}'))"
                 result = self.submit_query(query)  # type: ignore
                 if len(result) == 1:  # type: ignore
                     break  # successfully added this edge
@@ -204,7 +374,7 @@ class GraphConnection:
         if not self.check_if_node_exists(node.id):
             raise Exception(f"Node {node.id} does not exist.")
 
-        query = f"g.V('{node.id}')"
+        query = f"g.V('{escape(node.id)}')"
         query = self.add_properties_to_query(query, node, updating=True)
 
         result = self.submit_query(query)  # type: ignore
@@ -215,7 +385,7 @@ class GraphConnection:
             )
 
     def traverse(self, node: GraphNode, edge_label: str) -> List[Review]:
-        query = f"g.V('{node.id}').out('{edge_label}')"
+        query = f"g.V('{escape(node.id)}').out('{edge_label}')"
         list_of_node_dicts = self.submit_query(query)  # type: ignore
         list_of_nodes = []
         for node_dict in list_of_node_dicts:  # type: ignore
@@ -228,7 +398,7 @@ class GraphConnection:
     def check_if_edge_exists(
         self, from_node: GraphNode, to_node: GraphNode, edge_label: str
     ) -> bool:
-        query = f"g.V('{from_node.id}').outE('{edge_label}').where(inV().hasId('{to_node.id}'))"
+        query = f"g.V('{escape(from_node.id)}').outE('{edge_label}').where(inV().hasId('{escape(to_node.id)}'))"
         result = self.submit_query(query)  # type: ignore
         return len(result) > 0  # type: ignore
 
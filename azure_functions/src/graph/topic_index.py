@@ -0,0 +1,131 @@
+"""
+Index of topics by normalised text, so Storage.find_or_add_topic reuses an existing topic instead of adding
+a duplicate that then gets processed by HandleTopicChange for nothing.
+
+Keys ignore case, punctuation, stop words, word order and common suffixes, so "Speed of Service",
+"Service speed" and "Speeds of services" share one. Texts that differ in other ways are caught by
+Storage.find_similar_topic comparing embeddings against DUPLICATE_TOPIC_SIMILARITY.
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+from src.llm.prompts import normalize_for_deduplication
+
+TOPIC_INDEX_PATH = os.environ.get(
+    "TOPIC_INDEX_PATH",
+    os.path.join(tempfile.gettempdir(), "feedback-assistant-topic-index.sqlite3"),
+)
+
+# Cosine similarity above which a new topic is taken to be an existing one, for text-embedding-ada-002.
+# Stricter than src.jobs.consolidate_topics, since nobody reviews these merges.
+DUPLICATE_TOPIC_SIMILARITY = 0.97
+
+STOP_WORDS = set("a an and at by for in of on or the to with".split())
+
+# Checked in order. ies and ied become y.
+SUFFIXES = ["ings", "ing", "ies", "ied", "edly", "ed", "es", "s", "ly"]
+MIN_STEM_LENGTH = 4
+
+
+def stem(word: str) -> str:
+    """
+    Strips one common suffix and a trailing e or doubled consonant, e.g. "services" and "service" -> "servic".
+    """
+    for suffix in SUFFIXES:
+        if suffix == "s" and word.endswith("ss"):
+            break
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            word = word[: -len(suffix)]
+            if suffix in ("ies", "ied"):
+                word += "y"
+            break
+    if word.endswith("e") and len(word) > MIN_STEM_LENGTH:
+        word = word[:-1]
+    if len(word) > MIN_STEM_LENGTH and word[-1] == word[-2] and word[-1] not in "lsz":
+        word = word[:-1]
+    return word
+
+
+def topic_key(text: str) -> str:
+    words = normalize_for_deduplication(text).split()
+    stems = sorted({stem(word) for word in words if word not in STOP_WORDS})
+    if len(stems) == 0:
+        return " ".join(words)
+    return " ".join(stems)
+
+
+class TopicIndex:
+    """
+    Topic ids by topic_key. Kept in memory and in SQLite, so warm workers and redelivered messages find topics
+    already added.
+
+    Entries can point at topics deleted since, so callers check the topic still exists.
+    """
+
+    def __init__(self, path: Optional[str] = TOPIC_INDEX_PATH) -> None:
+        self._memory: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+        self._connection: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS topic_keys (key TEXT PRIMARY KEY, topic_id TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._connection.commit()
+
+    def lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+            if self._connection is None:
+                return None
+            row = self._connection.execute(
+                "SELECT topic_id FROM topic_keys WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._memory[key] = row[0]
+                return row[0]
+            return None
+
+    def record(self, key: str, topic_id: str) -> None:
+        with self._lock:
+            self._memory[key] = topic_id
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO topic_keys (key, topic_id, created_at) VALUES (?, ?, ?)",
+                    (key, topic_id, time.time()),
+                )
+                self._connection.commit()
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM topic_keys WHERE key = ?", (key,))
+                self._connection.commit()
+
+
+_index: Optional[TopicIndex] = None
+
+
+def get_topic_index() -> TopicIndex:
+    """
+    Gets the index shared by the worker process. Falls back to memory only if the SQLite file can't be opened.
+    """
+    global _index
+    if _index is None:
+        try:
+            _index = TopicIndex()
+        except sqlite3.Error as e:
+            logging.warning(
+                f"Could not open topic index at {TOPIC_INDEX_PATH}: {e}. Using memory only."
+            )
+            _index = TopicIndex(path=None)
+    return _index
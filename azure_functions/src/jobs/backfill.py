@@ -0,0 +1,766 @@
+"""
+Runs feedback items that have no observations yet through the LLM pipeline in offline batches.
+
+Meant for backfills, where cost and throughput matter more than latency. The work that
+HandleFeedbackItemChange and the other change handlers do is done in stages:
+
+1. observations: infers each feedback item's observations.
+2. scores: scores each feedback item's observations in one request.
+3. topics: generates new topics per feedback item.
+4. action_items: generates new action items for the observations that need action.
+5. connections: connects the new observations, topics and action items like the change handlers do.
+
+Each stage collects its requests into <dir>/<stage>.requests.jsonl, runs them through a batch executor
+(see src.llm.batch), and applies the results to Storage in bulk. Requests that failed in the batch are
+retried directly. The nodes a stage creates are checkpointed before they are written, and state.json
+records each step, so running the same command again resumes where it stopped, including waiting for a
+batch that hasn't finished. Writes are idempotent, so a stage interrupted while applying is simply
+applied again.
+
+Connection requests are collected by running the connection functions with their requests deferred (see
+src.llm.cache), so the similarity cascade, decision store and classifiers still decide what they can.
+The batch's responses are then primed into the response cache and the functions run again, still
+deferring, so a request without a cached response fails the stage instead of calling the API at full price.
+That happens if a response was evicted from the cache, or the cascade, decisions or classifiers route a
+candidate differently than when the requests were collected. Delete <dir>/connections.requests.jsonl and
+the connections step from state.json to collect them again.
+
+The change handlers would repeat this work for the nodes the backfill adds, so pause them during a backfill.
+
+Run with: python -m src.jobs.backfill --dir backfill/ [--limit 10000] [--executor local]
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from src.data import ActionItem, FeedbackItem, Observation, Topic
+from src.data.edges import determine_edge_label
+from src.data.scores import Score
+from src.graph.topic_index import get_topic_index, topic_key
+from src.storage import NEEDS_ACTION_FILTER, Storage
+from src.llm.action_items import (
+    generate_action_items_request,
+    unpack_action_items,
+)
+from src.llm.batch import (
+    BatchExecutor,
+    get_batch_executor,
+    make_custom_id,
+    read_jsonl,
+    read_results,
+    request_kwargs,
+    split_custom_id,
+    write_requests,
+)
+from src.llm.cache import (
+    CACHE_BYPASS,
+    RequestDeferred,
+    deferring_requests,
+    prime_response,
+)
+from src.llm.client import TOKEN_USAGE, Priority, create_chat_completion
+from src.llm.concurrency import map_concurrently
+from src.llm.connections import (
+    infer_action_item_to_observations_connections,
+    infer_action_item_to_topics_connections,
+    infer_observation_to_action_items_connections,
+    infer_observation_to_topics_connections,
+    infer_topic_to_action_items_connections,
+    infer_topic_to_observations_connections,
+)
+from src.llm.decisions import Relation
+from src.llm.observations import GENERATE_OBSERVATIONS_PROMPT, observations_request
+from src.llm.prompts import deduplicate, split_into_chunks
+from src.llm.scores import (
+    ScoreType,
+    score_observations_request,
+    unpack_batch_scores,
+)
+from src.llm.topics import generate_topics_request, unpack_topics
+from src.llm.utils import unpack_function_call_arguments
+
+SCORE_TYPES = [
+    ScoreType.SATISFACTION,
+    ScoreType.SPECIFICITY,
+    ScoreType.BUSINESS_IMPACT,
+]
+
+STAGES = ["observations", "scores", "topics", "action_items", "connections"]
+
+# (custom_id, create_chat_completion arguments) of a stage's requests
+Requests = Iterator[Tuple[str, Dict[str, Any]]]
+# (request line, response) of every request of a stage
+Responses = List[Tuple[Dict[str, Any], Dict[str, Any]]]
+
+# Nodes embedded per request and upsert
+EMBED_PAGE_SIZE = 100
+
+
+class StageState(BaseModel):
+    requests: Optional[int] = None  # None until the requests are collected
+    batch_id: Optional[str] = None
+    applied: bool = False
+
+
+class BackfillState(BaseModel):
+    feedback_item_ids: List[str] = []
+    stages: Dict[str, StageState] = {}
+
+
+class ConnectionTask(BaseModel):
+    """
+    One connection question and the candidates found for it, so it is asked the same way when applied.
+    """
+
+    relation: Relation
+    anchor_id: str
+    candidate_ids: List[str]
+    similarities: List[float]
+
+
+# (anchor type, candidate type, inference called with (anchor, candidates, similarities=...), edge adder)
+Connector = Tuple[
+    Type[Any],
+    Type[Any],
+    Callable[..., List[Any]],
+    Callable[[Storage, Any, List[Any]], None],
+]
+
+CONNECTORS: Dict[Relation, Connector] = {
+    Relation.OBSERVATION_TO_TOPICS: (
+        Observation,
+        Topic,
+        infer_observation_to_topics_connections,
+        Storage.add_observation_to_topics_edges,
+    ),
+    Relation.OBSERVATION_TO_ACTION_ITEMS: (
+        Observation,
+        ActionItem,
+        infer_observation_to_action_items_connections,
+        Storage.add_observation_to_action_items_edges,
+    ),
+    Relation.TOPIC_TO_OBSERVATIONS: (
+        Topic,
+        Observation,
+        infer_topic_to_observations_connections,
+        Storage.add_topic_to_observations_edges,
+    ),
+    Relation.TOPIC_TO_ACTION_ITEMS: (
+        Topic,
+        ActionItem,
+        infer_topic_to_action_items_connections,
+        Storage.add_topic_to_action_items_edges,
+    ),
+    Relation.ACTION_ITEM_TO_OBSERVATIONS: (
+        ActionItem,
+        Observation,
+        infer_action_item_to_observations_connections,
+        Storage.add_action_item_to_observations_edges,
+    ),
+    Relation.ACTION_ITEM_TO_TOPICS: (
+        ActionItem,
+        Topic,
+        infer_action_item_to_topics_connections,
+        Storage.add_action_item_to_topics_edges,
+    ),
+}
+
+
+def run_directly(line: Dict[str, Any]) -> Dict[str, Any]:
+    response = create_chat_completion(priority=Priority.LOW, **request_kwargs(line))
+    return json.loads(json.dumps(response))
+
+
+class Backfill:
+    """
+    A backfill's checkpoints and state, kept in directory.
+    """
+
+    def __init__(
+        self, storage: Storage, directory: str, executor: BatchExecutor
+    ) -> None:
+        self.storage = storage
+        self.directory = directory
+        self.executor = executor
+        os.makedirs(directory, exist_ok=True)
+
+        self.state = BackfillState()
+        if os.path.exists(self.path("state.json")):
+            self.state = BackfillState.model_validate(self.load_json("state.json"))
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load_json(self, name: str) -> Any:
+        with open(self.path(name)) as file:
+            return json.load(file)
+
+    def save_json(self, name: str, data: Any) -> None:
+        partial_path = self.path(name) + ".partial"
+        with open(partial_path, "w") as file:
+            json.dump(data, file)
+        os.replace(partial_path, self.path(name))
+
+    def save_state(self) -> None:
+        self.save_json("state.json", self.state.model_dump(mode="json"))
+
+    def checkpoint(
+        self, name: str, create: Callable[[], Dict[str, List[BaseModel]]]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Loads the nodes a stage created, or creates and saves them. Nodes are keyed by feedback item id.
+
+        Nodes get random ids, so they are saved before being written. Applying a stage again then writes the same nodes.
+        """
+        if not os.path.exists(self.path(name)):
+            self.save_json(
+                name,
+                {
+                    key: [node.model_dump(mode="json") for node in nodes]
+                    for key, nodes in create().items()
+                },
+            )
+        return self.load_json(name)
+
+    # Loaded from checkpoints
+
+    def feedback_items(self) -> List[FeedbackItem]:
+        return [FeedbackItem(**data) for data in self.load_json("feedback_items.json")]
+
+    def feedback_items_by_id(self) -> Dict[str, FeedbackItem]:
+        return {
+            feedback_item.id: feedback_item for feedback_item in self.feedback_items()
+        }
+
+    def observations(self) -> Dict[str, List[Observation]]:
+        return {
+            feedback_item_id: [Observation(**data) for data in observations]
+            for feedback_item_id, observations in self.load_json(
+                "observations.json"
+            ).items()
+        }
+
+    def needs_action(self) -> Dict[str, bool]:
+        return self.load_json("needs_action.json")
+
+    def created(self, name: str, type: Type[Any]) -> List[Any]:
+        """
+        The nodes in a checkpoint, once each even if listed under several feedback items.
+        """
+        nodes: Dict[str, Any] = {}
+        for listed in self.load_json(name).values():
+            for data in listed:
+                node = type(**data)
+                nodes.setdefault(node.id, node)
+        return list(nodes.values())
+
+    # Selection
+
+    def select(self, limit: Optional[int], page_size: int) -> int:
+        """
+        Picks the feedback items to backfill, once. Returns how many there are.
+        """
+        if os.path.exists(self.path("feedback_items.json")):
+            return len(self.state.feedback_item_ids)
+
+        feedback_items: List[FeedbackItem] = []
+        for page in self.storage.stream_node_ids(
+            FeedbackItem,
+            page_size,
+            without_edge=determine_edge_label(FeedbackItem, Observation),
+        ):
+            if limit is not None:
+                page = page[: limit - len(feedback_items)]
+            feedback_items.extend(self.storage.get_nodes(page, FeedbackItem))
+            if limit is not None and len(feedback_items) >= limit:
+                break
+
+        self.save_json(
+            "feedback_items.json",
+            [feedback_item.model_dump(mode="json") for feedback_item in feedback_items],
+        )
+        self.state.feedback_item_ids = [
+            feedback_item.id for feedback_item in feedback_items
+        ]
+        self.save_state()
+        return len(feedback_items)
+
+    # Running stages
+
+    def responses(self, stage: str) -> Responses:
+        """
+        Returns (request line, response) for every request of the stage, running failed ones directly.
+        """
+        lines = {
+            line["custom_id"]: line
+            for line in read_jsonl(self.path(f"{stage}.requests.jsonl"))
+        }
+        results: Dict[str, Optional[Dict[str, Any]]] = {}
+        if os.path.exists(self.path(f"{stage}.results.jsonl")):
+            results = dict(read_results(self.path(f"{stage}.results.jsonl")))
+
+        failed = [
+            line for custom_id, line in lines.items() if results.get(custom_id) is None
+        ]
+        if len(failed) > 0:
+            logging.warning(f"{stage}: running {len(failed)} failed requests directly.")
+            for line, response in zip(failed, map_concurrently(run_directly, failed)):
+                results[line["custom_id"]] = response
+
+        return [(line, results[custom_id]) for custom_id, line in lines.items()]  # type: ignore
+
+    def run(self) -> bool:
+        """
+        Runs every stage that hasn't been applied yet. Returns False if it stopped to wait for a batch.
+        """
+        stages: Dict[
+            str, Tuple[Callable[[], Requests], Callable[[Responses], None]]
+        ] = {
+            "observations": (self.collect_observations, self.apply_observations),
+            "scores": (self.collect_scores, self.apply_scores),
+            "topics": (self.collect_topics, self.apply_topics),
+            "action_items": (self.collect_action_items, self.apply_action_items),
+            "connections": (self.collect_connections, self.apply_connections),
+        }
+
+        for name in STAGES:
+            collect, apply = stages[name]
+            stage = self.state.stages.setdefault(name, StageState())
+            if stage.applied:
+                continue
+
+            requests_path = self.path(f"{name}.requests.jsonl")
+            results_path = self.path(f"{name}.results.jsonl")
+            if stage.requests is None:
+                stage.requests = write_requests(requests_path, collect())
+                self.save_state()
+                print(f"{name}: collected {stage.requests} requests.")
+
+            if stage.requests > 0:
+                if stage.batch_id is None:
+                    stage.batch_id = self.executor.submit(requests_path)
+                    self.save_state()
+                if not self.executor.is_complete(stage.batch_id):
+                    print(
+                        f"{name}: batch {stage.batch_id} is still running. Run again to resume."
+                    )
+                    return False
+                if not os.path.exists(results_path):
+                    self.executor.download(stage.batch_id, results_path)
+
+            apply(self.responses(name))
+            stage.applied = True
+            self.save_state()
+            print(f"{name}: applied.")
+
+        return True
+
+    def store_nodes(self, nodes: List[Any]) -> None:
+        """
+        Adds nodes of one type to the graph, and embeds them in pages.
+        """
+        self.storage.add_nodes(nodes)
+        for start in range(0, len(nodes), EMBED_PAGE_SIZE):
+            self.storage.embed_and_store_many(
+                nodes[start : start + EMBED_PAGE_SIZE], priority=Priority.LOW
+            )
+
+    # 1. Observations
+
+    def collect_observations(self) -> Requests:
+        for feedback_item in self.feedback_items():
+            for i, chunk in enumerate(split_into_chunks(feedback_item.text)):
+                yield make_custom_id(
+                    GENERATE_OBSERVATIONS_PROMPT.key, feedback_item.id, str(i)
+                ), observations_request(chunk)
+
+    def apply_observations(self, responses: Responses) -> None:
+        def create() -> Dict[str, List[BaseModel]]:
+            chunks: Dict[str, Dict[int, List[str]]] = {}
+            for line, response in responses:
+                _, feedback_item_id, chunk = split_custom_id(line["custom_id"])
+                try:
+                    texts = unpack_function_call_arguments(response)["observations"]
+                except (ValueError, KeyError):
+                    logging.warning(f"No observations in {line['custom_id']}.")
+                    texts = []
+                chunks.setdefault(feedback_item_id, {})[int(chunk)] = [
+                    str(text) for text in texts
+                ]
+            return {
+                feedback_item_id: [
+                    Observation(text=text)
+                    for text in deduplicate(
+                        [text for i in sorted(texts) for text in texts[i]]
+                    )
+                ]
+                for feedback_item_id, texts in chunks.items()
+            }
+
+        self.checkpoint("observations.json", create)
+
+        observations = self.observations()
+        for feedback_item in self.feedback_items():
+            self.storage.add_nodes(observations.get(feedback_item.id, []))  # type: ignore
+            self.storage.connect_nodes(
+                [feedback_item], observations.get(feedback_item.id, [])  # type: ignore
+            )
+        all_observations = [
+            observation for nodes in observations.values() for observation in nodes
+        ]
+        for start in range(0, len(all_observations), EMBED_PAGE_SIZE):
+            self.storage.embed_and_store_many(
+                all_observations[start : start + EMBED_PAGE_SIZE],
+                priority=Priority.LOW,
+            )
+        print(
+            f"observations: added {len(all_observations)} observations to {len(observations)} feedback items."
+        )
+
+    # 2. Scores
+
+    def collect_scores(self) -> Requests:
+        feedback_items = self.feedback_items_by_id()
+        for feedback_item_id, observations in self.observations().items():
+            if len(observations) == 0:
+                continue
+            kwargs = score_observations_request(
+                [observation.text for observation in observations],
+                feedback_items[feedback_item_id].text,
+                SCORE_TYPES,
+            )
+            yield make_custom_id(kwargs["label"], feedback_item_id), kwargs
+
+    def apply_scores(self, responses: Responses) -> None:
+        feedback_items = self.feedback_items_by_id()
+        observations = self.observations()
+
+        def create() -> Dict[str, List[BaseModel]]:
+            scores: Dict[str, List[BaseModel]] = {}
+            for line, response in responses:
+                _, feedback_item_id = split_custom_id(line["custom_id"])
+                texts = [
+                    observation.text for observation in observations[feedback_item_id]
+                ]
+                scores_per_observation = unpack_batch_scores(
+                    response, texts, feedback_items[feedback_item_id].text, SCORE_TYPES
+                )
+                for observation, observation_scores in zip(
+                    observations[feedback_item_id], scores_per_observation
+                ):
+                    scores[observation.id] = observation_scores  # type: ignore
+            return scores
+
+        scores = self.checkpoint("scores.json", create)
+
+        needs_action: Dict[str, bool] = {}
+        for nodes in observations.values():
+            for observation in nodes:
+                observation_scores = [
+                    Score(**data) for data in scores.get(observation.id, [])
+                ]
+                self.storage.set_observation_scores(observation, observation_scores)
+                needs_action[observation.id] = observation.needs_action  # type: ignore
+        self.save_json("needs_action.json", needs_action)
+        print(
+            f"scores: scored {len(scores)} observations, {sum(needs_action.values())} need action."
+        )
+
+    # 3. Topics
+
+    def collect_topics(self) -> Requests:
+        feedback_items = self.feedback_items_by_id()
+        observations = {
+            feedback_item_id: nodes
+            for feedback_item_id, nodes in self.observations().items()
+            if len(nodes) > 0
+        }
+
+        def search(feedback_item_id: str) -> List[Topic]:
+            existing_topics, _ = self.storage.search_semantically(
+                search_for=Topic,
+                from_text=feedback_items[feedback_item_id].text,
+                top_k=10,
+                min_score=0.0,
+            )
+            return existing_topics
+
+        ids = list(observations)
+        for feedback_item_id, existing_topics in zip(
+            ids, map_concurrently(search, ids)
+        ):
+            kwargs = generate_topics_request(
+                feedback_items[feedback_item_id].text,
+                observations[feedback_item_id],
+                existing_topics,
+            )
+            yield make_custom_id(kwargs["label"], feedback_item_id), kwargs
+
+    def apply_topics(self, responses: Responses) -> None:
+        def create() -> Dict[str, List[BaseModel]]:
+            # Topics generated for several feedback items are listed under each with the same id
+            generated: Dict[str, List[str]] = {}
+            by_key: Dict[str, Topic] = {}
+            for line, response in responses:
+                keys: List[str] = []
+                for topic in unpack_topics(response):  # type: ignore
+                    key = topic_key(topic.text)
+                    by_key.setdefault(key, topic)
+                    keys.append(key)
+                generated[split_custom_id(line["custom_id"])[1]] = list(
+                    dict.fromkeys(keys)
+                )
+
+            # Topics already stored are left out, as Storage.find_or_add_topic would
+            unmatched = [
+                topic
+                for topic in by_key.values()
+                if self.storage.find_existing_topic(topic.text) is None
+            ]
+            similar: List[Optional[Topic]] = []
+            for start in range(0, len(unmatched), EMBED_PAGE_SIZE):
+                similar.extend(
+                    self.storage.find_similar_topics(
+                        [
+                            topic.text
+                            for topic in unmatched[start : start + EMBED_PAGE_SIZE]
+                        ],
+                        priority=Priority.LOW,
+                    )
+                )
+            new = {
+                topic_key(topic.text)
+                for topic, existing in zip(unmatched, similar)
+                if existing is None
+            }
+            return {
+                feedback_item_id: [by_key[key] for key in keys if key in new]
+                for feedback_item_id, keys in generated.items()
+            }
+
+        self.checkpoint("topics.json", create)
+        topics: List[Topic] = self.created("topics.json", Topic)
+        self.store_nodes(topics)
+        index = get_topic_index()
+        for topic in topics:
+            index.record(topic_key(topic.text), topic.id)
+        print(f"topics: added {len(topics)} topics.")
+
+    # 4. Action items
+
+    def collect_action_items(self) -> Requests:
+        feedback_items = self.feedback_items_by_id()
+        needs_action = self.needs_action()
+        observations = {
+            feedback_item_id: [
+                observation for observation in nodes if needs_action[observation.id]
+            ]
+            for feedback_item_id, nodes in self.observations().items()
+        }
+        observations = {
+            feedback_item_id: nodes
+            for feedback_item_id, nodes in observations.items()
+            if len(nodes) > 0
+        }
+
+        def search(feedback_item_id: str) -> List[ActionItem]:
+            existing_action_items, _ = self.storage.search_semantically(
+                search_for=ActionItem,
+                from_text=feedback_items[feedback_item_id].text,
+                top_k=10,
+                min_score=0.0,
+            )
+            return existing_action_items
+
+        ids = list(observations)
+        for feedback_item_id, existing_action_items in zip(
+            ids, map_concurrently(search, ids)
+        ):
+            kwargs = generate_action_items_request(
+                feedback_items[feedback_item_id].text,
+                observations[feedback_item_id],
+                existing_action_items,
+            )
+            yield make_custom_id(kwargs["label"], feedback_item_id), kwargs
+
+    def apply_action_items(self, responses: Responses) -> None:
+        def create() -> Dict[str, List[BaseModel]]:
+            return {
+                split_custom_id(line["custom_id"])[1]: unpack_action_items(response)  # type: ignore
+                for line, response in responses
+            }
+
+        self.checkpoint("action_items.json", create)
+        action_items: List[ActionItem] = self.created("action_items.json", ActionItem)
+        self.store_nodes(action_items)
+        print(f"action_items: added {len(action_items)} action items.")
+
+    # 5. Connections
+
+    def connection_tasks(self) -> List[ConnectionTask]:
+        """
+        Finds the candidates of every connection question about the new nodes, once.
+        """
+        if os.path.exists(self.path("connections.json")):
+            return [
+                ConnectionTask.model_validate(data)
+                for data in self.load_json("connections.json")
+            ]
+
+        needs_action = self.needs_action()
+        anchors: List[Tuple[Relation, Any]] = []
+        for nodes in self.observations().values():
+            for observation in nodes:
+                anchors.append((Relation.OBSERVATION_TO_TOPICS, observation))
+                if needs_action[observation.id]:
+                    anchors.append((Relation.OBSERVATION_TO_ACTION_ITEMS, observation))
+        if os.path.exists(self.path("topics.json")):
+            for topic in self.created("topics.json", Topic):
+                anchors.append((Relation.TOPIC_TO_OBSERVATIONS, topic))
+                anchors.append((Relation.TOPIC_TO_ACTION_ITEMS, topic))
+        if os.path.exists(self.path("action_items.json")):
+            for action_item in self.created("action_items.json", ActionItem):
+                anchors.append((Relation.ACTION_ITEM_TO_OBSERVATIONS, action_item))
+                anchors.append((Relation.ACTION_ITEM_TO_TOPICS, action_item))
+
+        def find_candidates(anchor: Tuple[Relation, Any]) -> ConnectionTask:
+            relation, node = anchor
+            _, candidate_type, _, _ = CONNECTORS[relation]
+            candidates, similarities = self.storage.search_semantically(
+                search_for=candidate_type,
+                from_text=node.text,
+                top_k=10,
+                min_score=0.0,
+                adaptive=True,
+                # Only observations that need action can be addressed by an action item
+                filter=(
+                    NEEDS_ACTION_FILTER
+                    if relation == Relation.ACTION_ITEM_TO_OBSERVATIONS
+                    else None
+                ),
+            )
+            return ConnectionTask(
+                relation=relation,
+                anchor_id=node.id,
+                candidate_ids=[candidate.id for candidate in candidates],
+                similarities=similarities,
+            )
+
+        tasks = map_concurrently(find_candidates, anchors)
+        self.save_json(
+            "connections.json", [task.model_dump(mode="json") for task in tasks]
+        )
+        return tasks
+
+    def infer_connections(self, task: ConnectionTask) -> Tuple[Any, List[Any]]:
+        """
+        Returns the task's anchor and its related candidates.
+        """
+        anchor_type, candidate_type, infer, _ = CONNECTORS[task.relation]
+        anchor = self.storage.get_node(task.anchor_id, anchor_type)
+        candidates_by_id = {
+            candidate.id: candidate
+            for candidate in self.storage.get_nodes(task.candidate_ids, candidate_type)
+        }
+        candidates = [candidates_by_id[id] for id in task.candidate_ids]
+        return anchor, infer(
+            anchor,
+            candidates,
+            similarities=task.similarities,
+            embed=self.storage.embed_nodes,
+        )
+
+    def collect_connections(self) -> Requests:
+        tasks = self.connection_tasks()
+
+        def defer(task: ConnectionTask) -> Optional[Dict[str, Any]]:
+            with deferring_requests():
+                try:
+                    self.infer_connections(task)
+                except RequestDeferred as deferred:
+                    return deferred.kwargs
+            return None  # Decided without the LLM, or already cached
+
+        for i, kwargs in enumerate(map_concurrently(defer, tasks)):
+            if kwargs is not None:
+                yield make_custom_id(kwargs["label"], str(i)), kwargs
+
+    def apply_connections(self, responses: Responses) -> None:
+        for line, response in responses:
+            prime_response(request_kwargs(line), response)
+
+        def connect(task: ConnectionTask) -> Optional[int]:
+            _, _, _, add_edges = CONNECTORS[task.relation]
+            with deferring_requests():
+                try:
+                    anchor, related = self.infer_connections(task)
+                except RequestDeferred:
+                    return None
+            add_edges(self.storage, anchor, related)
+            return len(related)
+
+        tasks = self.connection_tasks()
+        connected = map_concurrently(connect, tasks)
+        unanswered = [
+            task.anchor_id for task, count in zip(tasks, connected) if count is None
+        ]
+        made = sum(count for count in connected if count is not None)
+        print(
+            f"connections: answered {len(tasks) - len(unanswered)} of {len(tasks)} questions, {len(responses)} by the batch, and made {made} connections."
+        )
+        if len(unanswered) > 0:
+            raise Exception(
+                f"{len(unanswered)} connection questions have no cached response, e.g. about {unanswered[:5]}. Collect the connections again."
+            )
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--dir",
+        required=True,
+        help="Where the backfill keeps its state and checkpoints. Reuse it to resume.",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Maximum number of feedback items to backfill.",
+    )
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument(
+        "--executor",
+        default=None,
+        help="Batch executor to run requests with. Defaults to LLM_BATCH_EXECUTOR, or local.",
+    )
+    args = parser.parse_args()
+
+    if CACHE_BYPASS:
+        parser.error(
+            "Connection requests are answered through the LLM cache. Unset LLM_CACHE_BYPASS."
+        )
+
+    executor = get_batch_executor(os.path.join(args.dir, "executor"), args.executor)
+    with Storage() as storage:
+        backfill = Backfill(storage, args.dir, executor)
+        count = backfill.select(args.limit, args.page_size)
+        print(f"Backfilling {count} feedback items in {args.dir}.")
+        finished = backfill.run()
+
+    for label, usage in sorted(TOKEN_USAGE.items()):
+        print(f"{label}: {usage}")
+    print("Done." if finished else "Waiting for a batch.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Builds the topic centroid snapshot that workers memory-map at start (see src.vector.centroids).
+
+Streams topic ids page by page, and for each page fetches the topic embeddings, the observations the topics
+contain, and those observations' embeddings. Rerun it periodically, so centroids include the edges added by
+every worker, and after src.jobs.consolidate_topics.
+
+    python -m src.jobs.build_topic_centroids --path /home/data/topic-centroids
+"""
+
+import argparse
+import logging
+import os
+import time
+from typing import Dict, List
+
+from src.data import Observation, Topic
+from src.storage import Storage
+from src.vector.centroids import CENTROIDS_PATH, TopicCentroidIndex
+
+
+def build_topic_centroids(storage: Storage, page_size: int = 200) -> TopicCentroidIndex:
+    started_at = time.time()
+    index = TopicCentroidIndex()
+    members = 0
+    for page in storage.stream_node_ids(Topic, page_size):
+        topic_embeddings = storage.fetch_embeddings(Topic, page)
+        index.add_topics(list(topic_embeddings), list(topic_embeddings.values()))
+
+        member_ids: Dict[str, List[str]] = {}
+        for topic_id, observation_id in storage.get_child_observation_ids_of_topics(
+            page
+        ):
+            member_ids.setdefault(topic_id, []).append(observation_id)
+        observation_embeddings = storage.fetch_embeddings(
+            Observation, sorted({id for ids in member_ids.values() for id in ids})
+        )
+        for topic_id, ids in member_ids.items():
+            ids = [id for id in ids if id in observation_embeddings]
+            index.add_members(topic_id, ids, [observation_embeddings[id] for id in ids])
+            members += len(ids)
+        logging.info(f"Indexed {len(index)} topics and {members} members.")
+
+    # Topics created while building are picked up by the workers' first refresh
+    index.refreshed_at = started_at
+    return index
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        default=CENTROIDS_PATH,
+        help="Snapshot directory. Defaults to TOPIC_CENTROIDS_PATH.",
+    )
+    parser.add_argument("--page-size", type=int, default=200)
+    args = parser.parse_args()
+    if args.path is None:
+        parser.error("Pass --path or set TOPIC_CENTROIDS_PATH.")
+
+    with Storage() as storage:
+        index = build_topic_centroids(storage, page_size=args.page_size)
+    os.makedirs(os.path.dirname(os.path.abspath(args.path)), exist_ok=True)
+    index.save(args.path)
+
+    print(f"Saved {len(index)} topic centroids to {args.path}.")
+
+
+if __name__ == "__main__":
+    main()
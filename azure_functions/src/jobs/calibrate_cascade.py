@@ -0,0 +1,105 @@
+"""
+Fits the similarity cascade's thresholds (see src.llm.cascade) from logged LLM decisions.
+
+For each relation and similarity source, reports how the current thresholds perform and the precision/recall trade-off at a
+range of target precisions, taking the LLM's decisions as ground truth. With --write, the thresholds
+fitted for --target-precision are saved where src.llm.cascade loads them from.
+
+Run with: python -m src.jobs.calibrate_cascade [--target-precision 0.97] [--write]
+"""
+
+import argparse
+import logging
+from typing import Dict, List
+
+from src.llm.cascade import (
+    CalibrationReport,
+    CascadeThresholds,
+    ThresholdsKey,
+    evaluate_thresholds,
+    fit_thresholds,
+    get_thresholds,
+    load_thresholds,
+    save_thresholds,
+)
+from src.llm.decisions import Relation, get_decision_store, similarity_key
+from src.vector.cutoff import SimilaritySource
+
+# Fewer logged decisions than this and a relation keeps its current thresholds
+MIN_SAMPLES = 100
+TRADE_OFF_PRECISIONS = [0.9, 0.95, 0.97, 0.99]
+
+
+def calibrate(
+    target_precision: float, min_samples: int = MIN_SAMPLES
+) -> Dict[ThresholdsKey, CascadeThresholds]:
+    """
+    Fits thresholds for every relation and similarity source with enough logged decisions, and prints
+    reports along the way.
+    """
+    store = get_decision_store()
+    thresholds = load_thresholds()
+
+    for relation in Relation:
+        for source in SimilaritySource:
+            key = similarity_key(relation, source)
+            samples = store.similarity_decisions(relation, source)
+            # Most relations are only ever scored by vectorstore searches
+            if len(samples) == 0 and source != SimilaritySource.VECTOR:
+                continue
+            current = evaluate_thresholds(
+                relation, samples, get_thresholds(relation, source), source
+            )
+            print(f"Current  {current.summary()}")
+            if len(samples) < min_samples:
+                print(
+                    f"Skipping {key}: {len(samples)} logged decisions, need {min_samples}."
+                )
+                continue
+
+            trade_off: List[CalibrationReport] = [
+                evaluate_thresholds(
+                    relation, samples, fit_thresholds(samples, precision), source
+                )
+                for precision in TRADE_OFF_PRECISIONS
+            ]
+            for precision, report in zip(TRADE_OFF_PRECISIONS, trade_off):
+                print(f"@{precision:.2f}    {report.summary()}")
+
+            thresholds[(relation, source)] = fit_thresholds(samples, target_precision)
+            fitted = evaluate_thresholds(
+                relation, samples, thresholds[(relation, source)], source
+            )
+            print(f"Fitted   {fitted.summary()}")
+
+    return thresholds
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--target-precision",
+        type=float,
+        default=0.97,
+        help="Minimum share of auto-accepted (and auto-rejected) candidates the LLM agrees with.",
+    )
+    parser.add_argument("--min-samples", type=int, default=MIN_SAMPLES)
+    parser.add_argument(
+        "--write",
+        action="store_true",
+        help="Save the fitted thresholds instead of only reporting them.",
+    )
+    args = parser.parse_args()
+
+    thresholds = calibrate(args.target_precision, args.min_samples)
+    if args.write:
+        save_thresholds(thresholds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Merges near-duplicate topics, e.g. "Speed of Service" and "Service Speed".
+
+generate_topics only sees the topics a search returns, so duplicates accumulate, inflating every topic
+search and the implicit edges added per topic. This job loads every Topic embedding, clusters them with
+HDBSCAN, and merges each cluster into its oldest topic: edges are moved in bulk (see
+Storage.merge_topics) and the merged nodes and vectors are deleted.
+
+HDBSCAN also groups topics that are only related, so a topic is only merged when it is at least
+--min-similarity similar to the cluster's canonical topic.
+
+Dry run by default:
+
+    python -m src.jobs.consolidate_topics
+    python -m src.jobs.consolidate_topics --apply
+"""
+
+import argparse
+import logging
+from typing import Dict, List, Tuple
+
+import hdbscan  # type: ignore
+import numpy as np
+from pydantic import BaseModel
+
+from src.data import Topic
+from src.storage import Storage
+
+# Cosine similarity above which topics are taken to be duplicates, for text-embedding-ada-002. Unrelated
+# feedback texts score around 0.70 to 0.75, rewordings of the same topic above 0.92.
+MIN_MERGE_SIMILARITY = 0.92
+
+# Smallest cluster HDBSCAN reports. Two topics are enough to be duplicates.
+MIN_CLUSTER_SIZE = 2
+
+
+class Merge(BaseModel):
+    canonical_id: str
+    canonical_text: str
+    duplicate_ids: List[str]
+    duplicate_texts: List[str]
+    similarities: List[float]
+    edges_moved: int = 0
+
+    def summary(self) -> str:
+        duplicates = ", ".join(
+            f"'{text}' ({similarity:.3f})"
+            for text, similarity in zip(self.duplicate_texts, self.similarities)
+        )
+        return f"'{self.canonical_text}' <- {duplicates}"
+
+
+class ConsolidationReport(BaseModel):
+    dry_run: bool
+    topics: int = 0
+    unembedded: int = 0
+    clusters: int = 0
+    merges: List[Merge] = []
+
+    def summary(self) -> str:
+        action = "Would merge" if self.dry_run else "Merged"
+        merged = sum(len(merge.duplicate_ids) for merge in self.merges)
+        lines = [
+            f"{self.topics} topics ({self.unembedded} without embeddings, skipped), {self.clusters} clusters. "
+            f"{action} {merged} topics into {len(self.merges)}, leaving {self.topics - merged}."
+        ]
+        lines.extend(f"  {merge.summary()}" for merge in self.merges)
+        return "\n".join(lines)
+
+
+def load_topics(
+    storage: Storage, page_size: int = 500
+) -> Tuple[List[Topic], np.ndarray, int]:
+    """
+    Every topic with an embedding, their unit length embeddings as rows, and the count of topics without one.
+    """
+    topics: List[Topic] = []
+    embeddings: List[List[float]] = []
+    unembedded = 0
+    for page in storage.stream_node_ids(Topic, page_size):
+        stored = storage.fetch_embeddings(Topic, page)
+        unembedded += len(page) - len(stored)
+        for topic in storage.get_nodes(list(stored), Topic):
+            topics.append(topic)
+            embeddings.append(stored[topic.id])
+    if len(embeddings) == 0:
+        return topics, np.empty((0, 0)), unembedded
+    matrix = np.array(embeddings, dtype=np.float64).reshape(len(embeddings), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return topics, matrix / np.where(norms == 0, 1, norms), unembedded
+
+
+def cluster_topics(embeddings: np.ndarray) -> np.ndarray:
+    """
+    A cluster label per row. -1 for topics in no cluster.
+
+    On unit vectors, euclidean distance is monotonic in cosine similarity. Leaf clusters keep groups of
+    duplicates apart instead of merging them into broad themes.
+    """
+    if len(embeddings) < MIN_CLUSTER_SIZE:
+        return np.full(len(embeddings), -1)
+    clusterer = hdbscan.HDBSCAN(
+        min_cluster_size=MIN_CLUSTER_SIZE,
+        min_samples=1,
+        metric="euclidean",
+        cluster_selection_method="leaf",
+    )
+    return clusterer.fit_predict(embeddings)
+
+
+def plan_merges(
+    topics: List[Topic],
+    embeddings: np.ndarray,
+    labels: np.ndarray,
+    min_similarity: float = MIN_MERGE_SIMILARITY,
+) -> List[Merge]:
+    """
+    Picks the oldest topic of each cluster as canonical, and the members similar enough to it as duplicates.
+    """
+    members: Dict[int, List[int]] = {}
+    for row, label in enumerate(labels):
+        if label != -1:
+            members.setdefault(int(label), []).append(row)
+
+    merges: List[Merge] = []
+    for rows in members.values():
+        rows = sorted(rows, key=lambda row: (topics[row].created_at, topics[row].id))
+        canonical, others = rows[0], rows[1:]
+        similarities = embeddings[others] @ embeddings[canonical]
+        duplicates = [
+            (row, float(similarity))
+            for row, similarity in zip(others, similarities)
+            if similarity >= min_similarity
+        ]
+        if len(duplicates) == 0:
+            continue
+        merges.append(
+            Merge(
+                canonical_id=topics[canonical].id,
+                canonical_text=topics[canonical].text,
+                duplicate_ids=[topics[row].id for row, _ in duplicates],
+                duplicate_texts=[topics[row].text for row, _ in duplicates],
+                similarities=[similarity for _, similarity in duplicates],
+            )
+        )
+    return merges
+
+
+def consolidate_topics(
+    storage: Storage,
+    dry_run: bool = True,
+    min_similarity: float = MIN_MERGE_SIMILARITY,
+    page_size: int = 500,
+) -> ConsolidationReport:
+    report = ConsolidationReport(dry_run=dry_run)
+    topics, embeddings, report.unembedded = load_topics(storage, page_size)
+    report.topics = len(topics) + report.unembedded
+
+    labels = cluster_topics(embeddings)
+    report.clusters = len(set(labels.tolist()) - {-1})
+    report.merges = plan_merges(topics, embeddings, labels, min_similarity)
+
+    if not dry_run:
+        topics_by_id = {topic.id: topic for topic in topics}
+        for merge in report.merges:
+            merge.edges_moved = storage.merge_topics(
+                topics_by_id[merge.canonical_id],
+                [topics_by_id[id] for id in merge.duplicate_ids],
+            )
+            logging.info(
+                f"Merged {len(merge.duplicate_ids)} topics into {merge.canonical_id}, moving {merge.edges_moved} edges."
+            )
+
+    logging.info(report.summary())
+    return report
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Merge the duplicates instead of reporting them.",
+    )
+    parser.add_argument("--min-similarity", type=float, default=MIN_MERGE_SIMILARITY)
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+
+    with Storage() as storage:
+        report = consolidate_topics(
+            storage,
+            dry_run=not args.apply,
+            min_similarity=args.min_similarity,
+            page_size=args.page_size,
+        )
+
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
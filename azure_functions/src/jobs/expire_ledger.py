@@ -0,0 +1,99 @@
+"""
+Deletes ledger entries (see Storage.open_ledger_entry) older than any message that could still be delivered
+for them.
+
+Every version of every node a change handler processes adds an entry, so the ledger grows with the graph's
+write history. Service Bus stops redelivering a message once it expires or is dead-lettered, after which its
+entry only takes up space. A handler that finds no entry processes the message as new, and a change handler
+that finds no entry for the run that stored a node does the work itself (see src.pipeline), so keep entries
+longer than the queues' message time to live.
+
+Streams the ids of entries created before the cut-off page by page, and deletes each page in one query.
+
+Dry run by default:
+
+    python -m src.jobs.expire_ledger
+    python -m src.jobs.expire_ledger --apply --max-age-days 30
+"""
+
+import argparse
+import logging
+import time
+from typing import List
+
+from pydantic import BaseModel
+
+from src.data import LedgerEntry
+from src.storage import Storage
+
+# Longer than the Service Bus default message time to live of 14 days
+MAX_AGE_DAYS = 30.0
+
+# Number of ids kept in the report as examples
+SAMPLE_SIZE = 10
+
+
+class ExpiryReport(BaseModel):
+    dry_run: bool
+    max_age_days: float
+    expired: int = 0
+    sample_expired: List[str] = []
+
+    def summary(self) -> str:
+        action = "Would delete" if self.dry_run else "Deleted"
+        return f"{action} {self.expired} ledger entries older than {self.max_age_days:g} days {self.sample_expired}."
+
+
+def expire_ledger(
+    storage: Storage,
+    max_age_days: float = MAX_AGE_DAYS,
+    dry_run: bool = True,
+    page_size: int = 1000,
+) -> ExpiryReport:
+    """
+    Deletes every ledger entry created more than max_age_days ago. Only one page of ids is held at a time.
+    """
+    report = ExpiryReport(dry_run=dry_run, max_age_days=max_age_days)
+    created_before = time.time() - max_age_days * 24 * 60 * 60
+    for page_index, page in enumerate(
+        storage.stream_node_ids(LedgerEntry, page_size, created_before=created_before)
+    ):
+        report.expired += len(page)
+        report.sample_expired.extend(page[: SAMPLE_SIZE - len(report.sample_expired)])
+        if not dry_run:
+            storage.delete_ledger_entries(page)
+        logging.info(f"Page {page_index}: {len(page)} expired entries.")
+
+    logging.info(report.summary())
+    return report
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Delete the expired entries instead of reporting them.",
+    )
+    parser.add_argument("--max-age-days", type=float, default=MAX_AGE_DAYS)
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with Storage() as storage:
+        report = expire_ledger(
+            storage,
+            max_age_days=args.max_age_days,
+            dry_run=not args.apply,
+            page_size=args.page_size,
+        )
+
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Flags observations stored before they carried their needs_action flag and raw score values.
+
+Searches for observations needing action filter on the vectorstore's metadata, so an observation without
+the flag in its metadata is never found by them. This job streams observation ids page by page, reads the
+scores of the observations without a flag, and writes the flag and score values to the graph and the
+vectorstore.
+
+Dry run by default:
+
+    python -m src.jobs.flag_observations
+    python -m src.jobs.flag_observations --apply
+"""
+
+import argparse
+import logging
+from typing import List
+
+from pydantic import BaseModel
+
+from src.data import Observation
+from src.storage import Storage
+from src.llm.action_items import check_needs_action, flag_needs_action
+from src.llm.concurrency import map_concurrently
+
+# Number of ids kept in the report as examples
+SAMPLE_SIZE = 10
+
+
+class FlaggingReport(BaseModel):
+    dry_run: bool
+    observations: int = 0
+    unflagged: int = 0
+    need_action: int = 0
+    sample_unflagged: List[str] = []
+
+    def summary(self) -> str:
+        action = "Would flag" if self.dry_run else "Flagged"
+        return (
+            f"{self.observations} observations. {action} {self.unflagged} {self.sample_unflagged}, "
+            f"{self.need_action} of which need action."
+        )
+
+
+def flag_observation(storage: Storage, observation: Observation, dry_run: bool) -> bool:
+    """
+    Sets the flag of one observation from its scores. Returns the flag.
+    """
+    scores = storage.get_observation_scores(observation)
+    if dry_run:
+        return check_needs_action(scores)
+    needs_action = flag_needs_action(observation, scores)
+    storage.update_observation_flags(observation)
+    return needs_action
+
+
+def flag_observations(
+    storage: Storage, dry_run: bool = True, page_size: int = 500
+) -> FlaggingReport:
+    """
+    Flags every observation without a flag. Only one page of observations is held at a time.
+    """
+    report = FlaggingReport(dry_run=dry_run)
+    for page_index, page in enumerate(storage.stream_node_ids(Observation, page_size)):
+        report.observations += len(page)
+        unflagged = [
+            observation
+            for observation in storage.get_nodes(page, Observation)
+            if observation.needs_action is None
+        ]
+        report.unflagged += len(unflagged)
+        report.sample_unflagged.extend(
+            observation.id
+            for observation in unflagged[: SAMPLE_SIZE - len(report.sample_unflagged)]
+        )
+        flags = map_concurrently(
+            lambda observation: flag_observation(storage, observation, dry_run),
+            unflagged,
+        )
+        report.need_action += sum(flags)
+        logging.info(
+            f"Page {page_index}: {len(unflagged)} of {len(page)} observations unflagged."
+        )
+
+    logging.info(report.summary())
+    return report
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Write the flags instead of reporting them.",
+    )
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+
+    with Storage() as storage:
+        report = flag_observations(
+            storage, dry_run=not args.apply, page_size=args.page_size
+        )
+
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
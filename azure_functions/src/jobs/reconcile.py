@@ -0,0 +1,162 @@
+"""
+Reconciles the graph with the vectorstore.
+
+Storage writes a node to the graph and then embeds it, so a failure in between leaves nodes that
+semantic search can't find, and deleted nodes can leave vectors behind. This job streams ids page by
+page from both stores, takes set differences per page, and repairs them with batched embeds and deletes.
+
+Dry run by default:
+
+    python -m src.jobs.reconcile
+    python -m src.jobs.reconcile --apply
+"""
+
+import argparse
+import logging
+from typing import Iterator, List, Tuple, Type
+
+from pydantic import BaseModel
+
+from src.data import ActionItem, Observation, Topic, EmbeddableGraphNode
+from src.storage import Storage
+from src.llm.client import Priority
+
+# Node types that Storage embeds when it adds them
+RECONCILED_CLASSES: List[Type[EmbeddableGraphNode]] = [Observation, ActionItem, Topic]
+
+# Number of ids per kind of problem kept in the report as examples
+SAMPLE_SIZE = 10
+
+
+class ReconciliationReport(BaseModel):
+    label: str
+    dry_run: bool
+    graph_nodes: int = 0
+    stored_embeddings: int = 0
+    missing_embeddings: int = 0
+    orphaned_embeddings: int = 0
+    orphans_listed: bool = True
+    sample_missing: List[str] = []
+    sample_orphaned: List[str] = []
+
+    def summary(self) -> str:
+        action = "Would repair" if self.dry_run else "Repaired"
+        orphans = str(self.orphaned_embeddings)
+        if not self.orphans_listed:
+            orphans = f"~{self.orphaned_embeddings} (estimated from counts)"
+        return (
+            f"{self.label}: {self.graph_nodes} nodes, {self.stored_embeddings} embeddings. "
+            f"{action} {self.missing_embeddings} missing embeddings {self.sample_missing} "
+            f"and {orphans} orphaned embeddings {self.sample_orphaned}."
+        )
+
+
+def find_missing_embeddings(
+    storage: Storage, node_type: Type[EmbeddableGraphNode], page_size: int
+) -> Iterator[Tuple[List[str], List[str]]]:
+    """
+    Yields each page of graph node ids together with the ids in it that have no embedding.
+    """
+    for page in storage.stream_node_ids(node_type, page_size):
+        stored_ids = storage.fetch_embeddings(node_type, page).keys()  # type: ignore
+        yield page, sorted(set(page) - set(stored_ids))
+
+
+def find_orphaned_embeddings(
+    storage: Storage, node_type: Type[EmbeddableGraphNode], page_size: int
+) -> Iterator[List[str]]:
+    """
+    Yields, per page of embedding ids, the ids that have no node in the graph.
+    """
+    for page in storage.stream_embedding_ids(node_type, page_size):  # type: ignore
+        existing_ids = storage.get_existing_node_ids(page, node_type)
+        yield sorted(set(page) - set(existing_ids))
+
+
+def reconcile_type(
+    storage: Storage,
+    node_type: Type[EmbeddableGraphNode],
+    dry_run: bool = True,
+    page_size: int = 500,
+) -> ReconciliationReport:
+    """
+    Reconciles one node type. Only one page of ids from each store is held at a time.
+    """
+    report = ReconciliationReport(label=node_type.__name__, dry_run=dry_run)
+    report.stored_embeddings = storage.count_embeddings(node_type)  # type: ignore
+
+    for page_index, (page, missing_ids) in enumerate(
+        find_missing_embeddings(storage, node_type, page_size)
+    ):
+        report.graph_nodes += len(page)
+        report.missing_embeddings += len(missing_ids)
+        report.sample_missing.extend(
+            missing_ids[: SAMPLE_SIZE - len(report.sample_missing)]
+        )
+        if not dry_run and len(missing_ids) > 0:
+            nodes = storage.get_nodes(missing_ids, node_type)
+            storage.embed_and_store_many(nodes, priority=Priority.LOW)  # type: ignore
+            logging.info(
+                f"Embedded {len(nodes)} {node_type.__name__} nodes from page {page_index}."
+            )
+
+    if storage.can_stream_embedding_ids():
+        for orphaned_ids in find_orphaned_embeddings(storage, node_type, page_size):
+            report.orphaned_embeddings += len(orphaned_ids)
+            report.sample_orphaned.extend(
+                orphaned_ids[: SAMPLE_SIZE - len(report.sample_orphaned)]
+            )
+            if not dry_run and len(orphaned_ids) > 0:
+                storage.delete_embeddings(node_type, orphaned_ids)  # type: ignore
+                logging.info(
+                    f"Deleted {len(orphaned_ids)} orphaned {node_type.__name__} embeddings."
+                )
+    else:
+        # Without id listing, orphans can only be counted, not identified or repaired
+        logging.warning(
+            f"Vectorstore can't list ids. Estimating orphaned {node_type.__name__} embeddings from counts."
+        )
+        report.orphans_listed = False
+        embedded_nodes = report.graph_nodes - report.missing_embeddings
+        report.orphaned_embeddings = max(0, report.stored_embeddings - embedded_nodes)
+
+    logging.info(report.summary())
+    return report
+
+
+def reconcile(
+    storage: Storage, dry_run: bool = True, page_size: int = 500
+) -> List[ReconciliationReport]:
+    """
+    Reconciles every embeddable node type.
+    """
+    return [
+        reconcile_type(storage, node_type, dry_run, page_size)
+        for node_type in RECONCILED_CLASSES
+    ]
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Repair differences instead of reporting them.",
+    )
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+
+    with Storage() as storage:
+        reports = reconcile(storage, dry_run=not args.apply, page_size=args.page_size)
+
+    for report in reports:
+        print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
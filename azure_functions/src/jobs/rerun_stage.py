@@ -0,0 +1,171 @@
+"""
+Runs one stage of src.pipeline again for a batch of feedback items, e.g. after changing the topics prompt.
+
+Each feedback item's observations are loaded from the graph, so action_items and topics generate against
+what the feedback item already has, observations only adds observations whose text it doesn't have
+yet, and connections connects them to the action items and topics a search for the feedback item finds.
+Feedback items are run one at a time, since each stage already spreads its LLM calls over the shared
+pool.
+
+Dry run by default:
+
+    python -m src.jobs.rerun_stage --stage topics --ids FeedbackItem_1 FeedbackItem_2
+    python -m src.jobs.rerun_stage --stage action_items --limit 100 --apply
+"""
+
+import argparse
+import logging
+from typing import Iterator, List, Optional
+
+from pydantic import BaseModel
+
+from src.data import FeedbackItem, Observation
+from src.storage import Storage
+from src.pipeline import (
+    ACTION_ITEMS,
+    CONNECTIONS,
+    OBSERVATIONS,
+    STAGES,
+    TOPICS,
+    FeedbackItemCheckpoint,
+    FeedbackItemPipeline,
+)
+
+
+class RerunReport(BaseModel):
+    stage: str
+    dry_run: bool
+    feedback_items: int = 0
+    observations: int = 0
+    added: int = 0
+    failed: List[str] = []
+
+    def summary(self) -> str:
+        action = "Would rerun" if self.dry_run else "Reran"
+        outcome = (
+            f"Connected {self.added} observations"
+            if self.stage == CONNECTIONS
+            else f"Added {self.added} nodes"
+        )
+        lines = [
+            f"{action} {self.stage} for {self.feedback_items} feedback items with {self.observations} observations. "
+            f"{outcome}. {len(self.failed)} failed."
+        ]
+        lines.extend(f"  {id}" for id in self.failed)
+        return "\n".join(lines)
+
+
+def select_feedback_items(
+    storage: Storage,
+    ids: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    page_size: int = 200,
+) -> Iterator[FeedbackItem]:
+    """
+    The feedback items with the given ids, or every feedback item, up to limit.
+    """
+    pages = (
+        [ids] if ids is not None else storage.stream_node_ids(FeedbackItem, page_size)
+    )
+    count = 0
+    for page in pages:
+        for feedback_item in storage.get_nodes(page, FeedbackItem):
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield feedback_item
+
+
+def rerun_stage(
+    storage: Storage,
+    feedback_item: FeedbackItem,
+    observations: List[Observation],
+    stage: str,
+) -> int:
+    """
+    Runs a stage for one feedback item. Returns the number of nodes it added, or for connections, the number
+    of observations it connected.
+    """
+    pipeline = FeedbackItemPipeline(
+        storage,
+        feedback_item,
+        checkpoint=FeedbackItemCheckpoint(
+            observations=observations,
+            stored_observation_ids=[observation.id for observation in observations],
+        ),
+    )
+    if stage == OBSERVATIONS:
+        return len(pipeline.add_observations())
+    if stage == ACTION_ITEMS:
+        return len(pipeline.add_action_items())
+    if stage == TOPICS:
+        return len(pipeline.add_topics())
+    if stage == CONNECTIONS:
+        return pipeline.connect_observations()
+    raise ValueError(f"Unknown stage {stage}. Expected one of {STAGES}.")
+
+
+def rerun(
+    storage: Storage,
+    stage: str,
+    ids: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    dry_run: bool = True,
+    page_size: int = 200,
+) -> RerunReport:
+    report = RerunReport(stage=stage, dry_run=dry_run)
+    for feedback_item in select_feedback_items(storage, ids, limit, page_size):
+        observations = storage.get_feedback_item_observations(feedback_item)
+        report.feedback_items += 1
+        report.observations += len(observations)
+        if dry_run:
+            continue
+        try:
+            report.added += rerun_stage(storage, feedback_item, observations, stage)
+        except Exception as e:
+            logging.exception(f"Rerunning {stage} failed for {feedback_item.id}: {e}")
+            report.failed.append(feedback_item.id)
+        else:
+            logging.info(f"Reran {stage} for {feedback_item.id}.")
+
+    logging.info(report.summary())
+    return report
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stage", required=True, choices=STAGES)
+    parser.add_argument(
+        "--ids",
+        nargs="+",
+        help="Feedback item ids. Defaults to every feedback item.",
+    )
+    parser.add_argument("--limit", type=int)
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Run the stage instead of listing the feedback items it would run for.",
+    )
+    parser.add_argument("--page-size", type=int, default=200)
+    args = parser.parse_args()
+
+    with Storage() as storage:
+        report = rerun(
+            storage,
+            args.stage,
+            ids=args.ids,
+            limit=args.limit,
+            dry_run=not args.apply,
+            page_size=args.page_size,
+        )
+
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Re-evaluates the needs_action flag of every observation after ACTION_THRESHOLDS change.
+
+Streams every Observation→Score triple from the graph, page by page, into NumPy arrays, evaluates the
+thresholds over all of them in one vectorized pass, and writes back only the flags that changed, in
+batches, to the graph and the vectorstore (see src.jobs.flag_observations). Makes no LLM calls, and the
+writes are flag updates, so the change handlers only connect the observations whose flag turned True to
+action items (see src.pipeline.is_flag_update).
+
+A score without a threshold, or a threshold without a score, never blocks an observation, as in
+check_needs_action.
+
+Dry run by default:
+
+    python -m src.jobs.rethreshold
+    python -m src.jobs.rethreshold --apply
+"""
+
+import argparse
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from src.data import Observation
+from src.data.observations import SCORE_FIELDS
+from src.data.scores import ScoreNames
+from src.storage import Storage
+from src.llm.action_items import ACTION_THRESHOLDS
+from src.llm.concurrency import map_concurrently
+
+# Column of each score name in the score arrays
+SCORE_NAMES: List[ScoreNames] = list(ScoreNames)
+SCORE_INDEX: Dict[ScoreNames, int] = {name: i for i, name in enumerate(SCORE_NAMES)}
+
+# Number of ids kept in the report as examples
+SAMPLE_SIZE = 10
+
+
+class ScoreArrays:
+    """
+    Every observation's id and current flag, and every Observation→Score triple as parallel arrays:
+    the observation's row, the score's column in SCORE_NAMES, and its value.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        flags: List[Optional[bool]],
+        observations: np.ndarray,
+        names: np.ndarray,
+        values: np.ndarray,
+    ) -> None:
+        self.ids = ids
+        self.flags = flags
+        self.observations = observations
+        self.names = names
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def score_matrix(self) -> np.ndarray:
+        """
+        One row per observation and one column per score name. NaN where an observation has no score.
+        """
+        matrix = np.full((len(self.ids), len(SCORE_NAMES)), np.nan)
+        matrix[self.observations, self.names] = self.values
+        return matrix
+
+
+def load_score_arrays(storage: Storage, page_size: int = 1000) -> ScoreArrays:
+    """
+    Reads the flag and scores of every observation, two queries per page of ids.
+    """
+    ids: List[str] = []
+    flags: List[Optional[bool]] = []
+    observations: List[int] = []
+    names: List[int] = []
+    values: List[float] = []
+    for page in storage.stream_node_ids(Observation, page_size):
+        rows = {id: len(ids) + i for i, id in enumerate(page)}
+        page_flags = storage.get_observation_flags(page)
+        ids.extend(page)
+        flags.extend(page_flags[id] for id in page)
+        for id, name, value in storage.get_observation_score_values(page):
+            observations.append(rows[id])
+            names.append(SCORE_INDEX[name])
+            values.append(value)
+    return ScoreArrays(
+        ids,
+        flags,
+        np.array(observations, dtype=np.int64),
+        np.array(names, dtype=np.int64),
+        np.array(values, dtype=np.float64),
+    )
+
+
+def threshold_arrays(
+    thresholds: Dict[ScoreNames, Dict[str, float]],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The min and max allowed for each column of SCORE_NAMES. Scores without a threshold are unbounded.
+    """
+    mins = np.full(len(SCORE_NAMES), -np.inf)
+    maxs = np.full(len(SCORE_NAMES), np.inf)
+    for name, bounds in thresholds.items():
+        mins[SCORE_INDEX[name]] = bounds["min"]
+        maxs[SCORE_INDEX[name]] = bounds["max"]
+    return mins, maxs
+
+
+def evaluate_thresholds(
+    arrays: ScoreArrays, thresholds: Dict[ScoreNames, Dict[str, float]]
+) -> np.ndarray:
+    """
+    Whether each observation needs action: none of its scores is outside its threshold.
+    """
+    mins, maxs = threshold_arrays(thresholds)
+    outside = (arrays.values < mins[arrays.names]) | (
+        arrays.values > maxs[arrays.names]
+    )
+    blocked = np.zeros(len(arrays), dtype=bool)
+    np.logical_or.at(blocked, arrays.observations, outside)
+    return ~blocked
+
+
+class RethresholdReport(BaseModel):
+    dry_run: bool
+    observations: int = 0
+    scores: int = 0
+    need_action: int = 0
+    flagged: int = 0
+    unflagged: int = 0
+    first_flags: int = 0
+    seconds: float = 0
+    sample_changed: List[str] = []
+
+    def summary(self) -> str:
+        action = "Would change" if self.dry_run else "Changed"
+        return (
+            f"{self.observations} observations with {self.scores} scores, {self.need_action} need action. "
+            f"{action} {self.flagged} flags to True and {self.unflagged} to False, and set "
+            f"{self.first_flags} for the first time {self.sample_changed}. Took {self.seconds:.1f}s."
+        )
+
+
+def write_flags(
+    storage: Storage,
+    arrays: ScoreArrays,
+    needs_action: np.ndarray,
+    rows: np.ndarray,
+    batch_size: int,
+) -> None:
+    """
+    Writes the flags and raw score values of the observations in rows, one batch of nodes at a time, with the
+    flags they replace.
+    """
+    matrix = arrays.score_matrix()
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start : start + batch_size]
+        row_by_id = {arrays.ids[row]: row for row in batch}
+        observations = storage.get_nodes(list(row_by_id), Observation)
+        previous = {
+            observation.id: observation.needs_action for observation in observations
+        }
+        for observation in observations:
+            row = row_by_id[observation.id]
+            observation.needs_action = bool(needs_action[row])
+            # A missing score leaves its field as stored, since writes can't clear a property
+            for name, field in SCORE_FIELDS.items():
+                value = matrix[row, SCORE_INDEX[name]]
+                if not np.isnan(value):
+                    setattr(observation, field, float(value))
+        map_concurrently(
+            lambda observation: storage.update_observation_flags(
+                observation, previous[observation.id]
+            ),
+            observations,
+        )
+        logging.info(f"Wrote {len(observations)} flags.")
+
+
+def rethreshold(
+    storage: Storage,
+    thresholds: Dict[ScoreNames, Dict[str, float]] = ACTION_THRESHOLDS,
+    dry_run: bool = True,
+    page_size: int = 1000,
+    batch_size: int = 100,
+) -> RethresholdReport:
+    start = time.monotonic()
+    report = RethresholdReport(dry_run=dry_run)
+    arrays = load_score_arrays(storage, page_size)
+    needs_action = evaluate_thresholds(arrays, thresholds)
+
+    # None (never flagged) is stored as -1, so it differs from both flags
+    current = np.array(
+        [-1 if flag is None else int(flag) for flag in arrays.flags], dtype=np.int8
+    )
+    changed = np.flatnonzero(current != needs_action)
+
+    report.observations = len(arrays)
+    report.scores = len(arrays.values)
+    report.need_action = int(needs_action.sum())
+    first = current[changed] == -1
+    report.first_flags = int(first.sum())
+    report.flagged = int((needs_action[changed] & ~first).sum())
+    report.unflagged = int((~needs_action[changed] & ~first).sum())
+    report.sample_changed = [arrays.ids[row] for row in changed[:SAMPLE_SIZE]]
+
+    if not dry_run:
+        write_flags(storage, arrays, needs_action, changed, batch_size)
+
+    report.seconds = time.monotonic() - start
+    logging.info(report.summary())
+    return report
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Write the changed flags instead of reporting them.",
+    )
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    with Storage() as storage:
+        report = rethreshold(
+            storage,
+            dry_run=not args.apply,
+            page_size=args.page_size,
+            batch_size=args.batch_size,
+        )
+
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Trains the local connection classifiers (see src.llm.distill) from logged LLM decisions.
+
+For each relation with enough logged decisions, embeds the texts that don't have an embedding yet, fits
+a logistic regression on most of the decisions and reports its agreement with the LLM on the rest. With
+--write, classifiers are saved where src.llm.distill loads them from. They are only used once their
+agreement reaches LLM_CLASSIFIER_MIN_AGREEMENT.
+
+Run with: python -m src.jobs.train_classifiers [--target-precision 0.97] [--write]
+"""
+
+import argparse
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from src.llm.cascade import fit_thresholds
+from src.llm.client import Priority
+from src.llm.decisions import Relation
+from src.llm.distill import (
+    CLASSIFIERS_DIR,
+    MIN_AGREEMENT,
+    ConnectionClassifier,
+    ExampleLog,
+    classifier_path,
+    pair_features,
+    sigmoid,
+    train_logistic_regression,
+)
+from src.llm.utils import generate_embeddings
+
+# Fewer logged decisions than this and a relation gets no classifier
+MIN_EXAMPLES = 500
+HOLDOUT_SHARE = 0.2
+
+
+def embed_missing(example_log: ExampleLog, texts: List[str]) -> None:
+    known = example_log.embeddings(texts)
+    missing = [text for text in set(texts) if text not in known]
+    if len(missing) == 0:
+        return
+    logging.info(f"Embedding {len(missing)} texts")
+    embeddings = generate_embeddings(missing, priority=Priority.LOW)
+    example_log.store_embeddings(dict(zip(missing, embeddings)))
+
+
+def train(
+    example_log: ExampleLog,
+    relation: Relation,
+    target_precision: float,
+    min_examples: int = MIN_EXAMPLES,
+) -> Optional[ConnectionClassifier]:
+    """
+    Trains and validates a classifier for the relation. Returns None if there are too few examples.
+    """
+    examples = example_log.examples(relation)
+    if len(examples) < min_examples:
+        print(
+            f"Skipping {relation.value}: {len(examples)} logged decisions, need {min_examples}."
+        )
+        return None
+
+    texts = [text for anchor, candidate, _ in examples for text in (anchor, candidate)]
+    embed_missing(example_log, texts)
+    embeddings = example_log.embeddings(texts)
+
+    anchors = np.stack([embeddings[anchor] for anchor, _, _ in examples])
+    candidates = np.stack([embeddings[candidate] for _, candidate, _ in examples])
+    features = pair_features(anchors, candidates)
+    labels = np.array([decision for _, _, decision in examples], dtype=np.float32)
+
+    order = np.random.default_rng(0).permutation(len(examples))
+    holdout_size = max(1, int(len(examples) * HOLDOUT_SHARE))
+    holdout, training = order[:holdout_size], order[holdout_size:]
+
+    weights, bias, mean, std = train_logistic_regression(
+        features[training], labels[training]
+    )
+    probabilities = sigmoid(((features[holdout] - mean) / std) @ weights + bias)
+    classifier = ConnectionClassifier(
+        weights=weights,
+        bias=bias,
+        mean=mean,
+        std=std,
+        agreement=float(np.mean((probabilities >= 0.5) == (labels[holdout] == 1))),
+        thresholds=fit_thresholds(
+            [
+                (float(probability), bool(label))
+                for probability, label in zip(probabilities, labels[holdout])
+            ],
+            target_precision,
+        ),
+        examples=len(training),
+    )
+    prescreened = np.mean(
+        [
+            classifier.thresholds.decide(float(probability)) is not None
+            for probability in probabilities
+        ]
+    )
+
+    print(
+        f"{relation.value}: trained on {len(training)}, held out {len(holdout)} ({int(labels.sum())} related overall). "
+        f"agreement={classifier.agreement:.3f} (needs {MIN_AGREEMENT}) "
+        f"prescreen low={classifier.thresholds.low:.3f} high={classifier.thresholds.high:.3f} decides {prescreened:.1%} locally"
+    )
+    return classifier
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--target-precision",
+        type=float,
+        default=0.97,
+        help="Minimum share of prescreened candidates the LLM agrees with.",
+    )
+    parser.add_argument("--min-examples", type=int, default=MIN_EXAMPLES)
+    parser.add_argument(
+        "--write",
+        action="store_true",
+        help="Save the trained classifiers instead of only reporting on them.",
+    )
+    args = parser.parse_args()
+
+    example_log = ExampleLog()
+    for relation in Relation:
+        classifier = train(
+            example_log, relation, args.target_precision, args.min_examples
+        )
+        if classifier is not None and args.write:
+            os.makedirs(CLASSIFIERS_DIR, exist_ok=True)
+            classifier.save(classifier_path(relation))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
-from typing import List
-import openai
-from src.data.observations import Observation
+from typing import Any, Dict, List
+from src.llm.client import create_chat_completion
+from src.data.observations import Observation, SCORE_FIELDS
 from src.data.actionItems import ActionItem
 from src.llm.scores import Score, ScoreNames
 
 from src.llm.utils import unpack_function_call_arguments
+from src.llm.prompts import feedback_context, numbered_list
+from src.llm.registry import PromptTemplate, register
 
 # Used to filter observations that indicate satisfaction, lack specificity, or have no impact on business outcomes.
 ACTION_THRESHOLDS = {
@@ -23,6 +25,31 @@ ACTION_THRESHOLDS = {
 }
 
 
+GENERATE_ACTION_ITEMS_PROMPT = register(
+    PromptTemplate(
+        name="generate_action_items",
+        version=1,
+        system="You are an expert in customer service. Your task is to interpret customer feedback to infer action items we can take to improve customer experience. ",
+        user="FEEDBACK FROM CUSTOMER:\n\n{feedback}\n\n---\nFROM THIS FEEDBACK, WE HAVE MADE THE FOLLOWING OBSERVATIONS WHICH MIGHT REQUIRE ACTION TO BE TAKEN:\n\n{numbered_observations}\n\n---\nHERE ARE THE EXISTING ACTION ITEMS WE HAVE IN OUR BACKLOG:\n\n{numbered_existing_action_items}\n\n---\nWHAT ACTION ITEMS DO WE NEED TO ADD TO OUR BACKLOG FOR THOSE OBSERVATIONS IF ANY? DON'T ADD ACTION ITEMS IF THE ONES IN THE BACKLOG ALREADY ADDRESS THE ISSUE.",
+        function={
+            "name": "report_action_items",
+            "description": "This function is used to add more action items.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "action_items": {
+                        "type": "array",
+                        "description": "A list of action items. For example: ['Evaluate the presentation of the gyro dish, particularly the white sweet potato gyro, to make it easier to eat. The customer found it hard to consume in its current form.', 'Maintain the quality of the fries, as they received high praise from the customer.']",
+                        "items": {"type": "string"},
+                    }
+                },
+                "required": ["action_items"],
+            },
+        },
+    )
+)
+
+
 def check_needs_action(scores: List[Score]) -> bool:
     """
     Given a list of scores for an observation, check if the scores meet the thresholds for action items.
@@ -36,62 +63,45 @@ def check_needs_action(scores: List[Score]) -> bool:
     return True
 
 
-def generate_action_items(
+def flag_needs_action(observation: Observation, scores: List[Score]) -> bool:
+    """
+    Stores the result of check_needs_action and the raw score values on the observation. Returns the flag.
+    """
+    for score in scores:
+        if score.name in SCORE_FIELDS:
+            setattr(observation, SCORE_FIELDS[score.name], score.score)
+    observation.needs_action = check_needs_action(scores)
+    return observation.needs_action
+
+
+def generate_action_items_request(
     feedback_item: str,
     observations: List[Observation],
     existing_action_items: List[ActionItem],
-) -> List[ActionItem]:
+) -> Dict[str, Any]:
     """
-    Given a feedback item, a list of observations requiring actions, and a list of existing action items, return a list of new action items to add.
+    The chat completion arguments for generate_action_items.
     """
-
-    if len(observations) == 0:
-        return []
-
-    numbered_observations = ""
-    for i, observation in enumerate(observations):
-        numbered_observations += f"{i}. {observation.text}\n"
+    numbered_observations = numbered_list(
+        [observation.text for observation in observations]
+    )
 
     # Create a numbered list of existing action items
     if len(existing_action_items) == 0:
         numbered_existing_action_items = "[]"
     else:
-        numbered_existing_action_items = ""
-        for i, action_item_text in enumerate(existing_action_items):
-            numbered_existing_action_items += f"{i}. {action_item_text.text}\n"
-
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service. Your task is to interpret customer feedback to infer action items we can take to improve customer experience. ",
-            },
-            {
-                "role": "user",
-                "content": f"FEEDBACK FROM CUSTOMER:\n\n{feedback_item}\n\n---\nFROM THIS FEEDBACK, WE HAVE MADE THE FOLLOWING OBSERVATIONS WHICH MIGHT REQUIRE ACTION TO BE TAKEN:\n\n{numbered_observations}\n\n---\nHERE ARE THE EXISTING ACTION ITEMS WE HAVE IN OUR BACKLOG:\n\n{numbered_existing_action_items}\n\n---\nWHAT ACTION ITEMS DO WE NEED TO ADD TO OUR BACKLOG FOR THOSE OBSERVATIONS IF ANY? DON'T ADD ACTION ITEMS IF THE ONES IN THE BACKLOG ALREADY ADDRESS THE ISSUE.",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_action_items",
-                "description": "This function is used to add more action items.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "action_items": {
-                            "type": "array",
-                            "description": "A list of action items. For example: ['Evaluate the presentation of the gyro dish, particularly the white sweet potato gyro, to make it easier to eat. The customer found it hard to consume in its current form.', 'Maintain the quality of the fries, as they received high praise from the customer.']",
-                            "items": {"type": "string"},
-                        }
-                    },
-                    "required": ["action_items"],
-                },
-            },
-        ],
-        function_call={"name": "report_action_items"},
+        numbered_existing_action_items = numbered_list(
+            [action_item_text.text for action_item_text in existing_action_items]
+        )
+
+    return GENERATE_ACTION_ITEMS_PROMPT.render(
+        feedback=feedback_context(feedback_item),
+        numbered_observations=numbered_observations,
+        numbered_existing_action_items=numbered_existing_action_items,
     )
 
+
+def unpack_action_items(response: Any) -> List[ActionItem]:
     new_action_items_text: List[str] = unpack_function_call_arguments(response)["action_items"]  # type: ignore
 
     new_action_items: List[ActionItem] = []
@@ -100,3 +110,23 @@ def generate_action_items(
         new_action_items.append(action_item)
 
     return new_action_items  # type: ignore
+
+
+def generate_action_items(
+    feedback_item: str,
+    observations: List[Observation],
+    existing_action_items: List[ActionItem],
+) -> List[ActionItem]:
+    """
+    Given a feedback item, a list of observations requiring actions, and a list of existing action items, return a list of new action items to add.
+    """
+
+    if len(observations) == 0:
+        return []
+
+    response = create_chat_completion(
+        **generate_action_items_request(
+            feedback_item, observations, existing_action_items
+        )
+    )
+    return unpack_action_items(response)
@@ -0,0 +1,177 @@
+"""
+Offline batches of chat completion requests.
+
+Requests are written to a JSONL file, one {"custom_id", "method", "url", "body"} object per line, in the
+layout batch APIs accept. A BatchExecutor runs the file and produces a JSONL file of
+{"custom_id", "response": {"status_code", "body"}, "error"} lines, in any order. custom_id starts with
+the request's label (see src.llm.registry), so token usage is still attributed to its template.
+
+LocalBatchExecutor runs the requests itself through src.llm.client at low priority, so batches work
+offline with LLM_PROVIDER=stub and in tests. Add executors for hosted batch APIs to BATCH_EXECUTORS, and
+pick one with LLM_BATCH_EXECUTOR.
+"""
+
+import json
+import logging
+import os
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from src.llm.client import DEFAULT_CHAT_MODEL, Priority, create_chat_completion
+from src.llm.concurrency import map_concurrently
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+
+def make_custom_id(label: str, *parts: str) -> str:
+    return "/".join((label,) + parts)
+
+
+def split_custom_id(custom_id: str) -> Tuple[str, ...]:
+    """
+    The label and the parts a custom_id was made from.
+    """
+    return tuple(custom_id.split("/"))
+
+
+def request_line(custom_id: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    body = {key: value for key, value in kwargs.items() if key != "label"}
+    body.setdefault("model", DEFAULT_CHAT_MODEL)
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_URL,
+        "body": body,
+    }
+
+
+def request_kwargs(line: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The create_chat_completion arguments a request line was made from, label included.
+    """
+    return dict(line["body"], label=split_custom_id(line["custom_id"])[0])
+
+
+def write_requests(path: str, requests: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+    """
+    Writes (custom_id, create_chat_completion arguments) pairs as a JSONL request file. Returns the count.
+    """
+    count = 0
+    with open(path, "w") as file:
+        for custom_id, kwargs in requests:
+            file.write(json.dumps(request_line(custom_id, kwargs)) + "\n")
+            count += 1
+    return count
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path) as file:
+        for line in file:
+            if line.strip() != "":
+                yield json.loads(line)
+
+
+def read_results(path: str) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    Yields (custom_id, response) for every result line. response is None for failed requests.
+    """
+    for line in read_jsonl(path):
+        response = (line.get("response") or {}).get("body")
+        if line.get("error") is not None or response is None:
+            logging.warning(
+                f"Batch request {line['custom_id']} failed: {line.get('error')}"
+            )
+            response = None
+        yield line["custom_id"], response
+
+
+class BatchExecutor:
+    """
+    Runs JSONL request files. submit may return before the batch has finished.
+    """
+
+    def submit(self, requests_path: str) -> str:
+        """
+        Starts running the requests and returns the batch's id.
+        """
+        raise NotImplementedError
+
+    def is_complete(self, batch_id: str) -> bool:
+        raise NotImplementedError
+
+    def download(self, batch_id: str, results_path: str) -> None:
+        """
+        Writes the results of a complete batch to results_path.
+        """
+        raise NotImplementedError
+
+
+class LocalBatchExecutor(BatchExecutor):
+    """
+    Runs batches in this process, at low priority, and keeps their results in directory.
+
+    submit only returns once every request has finished. A request that fails is reported in its result
+    line instead of failing the batch.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _results_path(self, batch_id: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.results.jsonl")
+
+    def _run(self, line: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = create_chat_completion(
+                priority=Priority.LOW, **request_kwargs(line)
+            )
+        except Exception as e:
+            return {
+                "custom_id": line["custom_id"],
+                "response": None,
+                "error": {"type": type(e).__name__, "message": str(e)},
+            }
+        return {
+            "custom_id": line["custom_id"],
+            "response": {"status_code": 200, "body": json.loads(json.dumps(response))},
+            "error": None,
+        }
+
+    def submit(self, requests_path: str) -> str:
+        batch_id = f"local_{uuid.uuid4().hex}"
+        results = map_concurrently(self._run, read_jsonl(requests_path))
+        os.makedirs(self.directory, exist_ok=True)
+        partial_path = self._results_path(batch_id) + ".partial"
+        with open(partial_path, "w") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+        os.replace(partial_path, self._results_path(batch_id))
+        logging.info(f"Ran {len(results)} requests from {requests_path} as {batch_id}.")
+        return batch_id
+
+    def is_complete(self, batch_id: str) -> bool:
+        return os.path.exists(self._results_path(batch_id))
+
+    def download(self, batch_id: str, results_path: str) -> None:
+        if os.path.abspath(self._results_path(batch_id)) != os.path.abspath(
+            results_path
+        ):
+            with open(self._results_path(batch_id)) as source, open(
+                results_path, "w"
+            ) as destination:
+                destination.write(source.read())
+
+
+# Executor factories by name. Each gets a directory it may keep its own files in.
+BATCH_EXECUTORS: Dict[str, Callable[[str], BatchExecutor]] = {
+    "local": LocalBatchExecutor,
+}
+
+
+def get_batch_executor(directory: str, name: Optional[str] = None) -> BatchExecutor:
+    name = name or os.environ.get("LLM_BATCH_EXECUTOR", "local")
+    if name not in BATCH_EXECUTORS:
+        raise ValueError(
+            f"Unknown batch executor {name}. Choose from {sorted(BATCH_EXECUTORS)}."
+        )
+    return BATCH_EXECUTORS[name](directory)
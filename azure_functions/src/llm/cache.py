@@ -0,0 +1,261 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from src.llm.client import create_chat_completion
+from src.llm.registry import get_template
+
+# Set LLM_CACHE_BYPASS=1 to always call the API, e.g. while iterating on prompts
+CACHE_BYPASS = os.environ.get("LLM_CACHE_BYPASS", "0") == "1"
+CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "feedback-assistant-llm-cache.sqlite3"),
+)
+CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_MAX_MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_MEMORY_ENTRIES", "1024"))
+CACHE_MAX_DISK_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_DISK_ENTRIES", "100000"))
+
+# Size based eviction on disk runs once every this many writes
+EVICTION_INTERVAL = 100
+
+
+def make_cache_key(
+    model: str,
+    messages: Any,
+    functions: Any = None,
+    function_call: Any = None,
+    temperature: Optional[float] = None,
+    label: Optional[str] = None,
+) -> str:
+    """
+    Hashes everything that determines a chat completion's response.
+
+    Requests rendered from a registered template are keyed on the template's fingerprint instead of
+    serialising its function schema again, unless the schema has filled in fields.
+    """
+    template = get_template(label)
+    if template is not None and not template.dynamic_function:
+        functions = template.fingerprint
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "functions": functions,
+            "function_call": function_call,
+            "temperature": temperature,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two tier cache of chat completion responses.
+
+    An in-memory LRU tier serves repeated calls within a warm worker. A persistent SQLite tier serves
+    retries and redeliveries across invocations. Entries expire after ttl_seconds, and the SQLite tier
+    is trimmed to max_disk_entries by evicting the least recently used entries.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = CACHE_PATH,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+        max_memory_entries: int = CACHE_MAX_MEMORY_ENTRIES,
+        max_disk_entries: int = CACHE_MAX_DISK_ENTRIES,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self._connection: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+            )
+            self._connection.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                created_at, response = self._memory[key]
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    return response
+                del self._memory[key]
+
+            if self._connection is None:
+                return None
+
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+
+            self._connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+            response = json.loads(row[0])
+            self._remember(key, row[1], response)
+            return response
+
+    def set(self, key: str, response: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+
+            if self._connection is None:
+                return
+
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response), now, now),
+            )
+            self._writes += 1
+            if self._writes % EVICTION_INTERVAL == 0:
+                self._evict(now)
+            self._connection.commit()
+
+    def _remember(self, key: str, created_at: float, response: Dict[str, Any]) -> None:
+        self._memory[key] = (created_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        """
+        Drops expired entries, then the least recently used ones beyond max_disk_entries.
+        """
+        assert self._connection is not None
+        self._connection.execute(
+            "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)
+        )
+        self._connection.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM responses")
+                self._connection.commit()
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Gets the cache shared by the worker process. Falls back to memory only if the SQLite file can't be opened.
+    """
+    global _cache
+    if _cache is None:
+        try:
+            _cache = ResponseCache()
+        except sqlite3.Error as e:
+            logging.warning(
+                f"Could not open LLM cache at {CACHE_PATH}: {e}. Using memory only."
+            )
+            _cache = ResponseCache(path=None)
+    return _cache
+
+
+class RequestDeferred(Exception):
+    """
+    Raised by cached_chat_completion instead of calling the API, while requests are being deferred.
+    """
+
+    def __init__(self, kwargs: Dict[str, Any]) -> None:
+        super().__init__(f"Deferred {kwargs.get('label') or kwargs['model']}")
+        self.kwargs = kwargs
+
+
+_deferring = threading.local()
+
+
+@contextmanager
+def deferring_requests() -> Iterator[None]:
+    """
+    Within this block, on this thread, requests that aren't cached raise RequestDeferred instead of calling the API.
+
+    Used to collect requests for a batch (see src.llm.batch). Once their responses are primed with
+    prime_response, running the same code again is answered from the cache.
+    """
+    previous = getattr(_deferring, "active", False)
+    _deferring.active = True
+    try:
+        yield
+    finally:
+        _deferring.active = previous
+
+
+def request_cache_key(kwargs: Dict[str, Any]) -> str:
+    return make_cache_key(
+        model=kwargs["model"],
+        messages=kwargs["messages"],
+        functions=kwargs.get("functions"),
+        function_call=kwargs.get("function_call"),
+        temperature=kwargs.get("temperature"),
+        label=kwargs.get("label"),
+    )
+
+
+def prime_response(kwargs: Dict[str, Any], response: Dict[str, Any]) -> None:
+    """
+    Stores a response obtained elsewhere, e.g. from a batch, as the cached response to the request.
+    """
+    get_response_cache().set(request_cache_key(kwargs), response)
+
+
+def cached_chat_completion(use_cache: bool = True, **kwargs: Any) -> Dict[str, Any]:
+    """
+    Same arguments as create_chat_completion. Returns the cached response for identical requests.
+
+    use_cache=False, or LLM_CACHE_BYPASS=1, always calls the API and doesn't store the response.
+    """
+    if not use_cache or CACHE_BYPASS:
+        return create_chat_completion(**kwargs)
+
+    key = request_cache_key(kwargs)
+    cache = get_response_cache()
+    response = cache.get(key)
+    if response is not None:
+        logging.info(
+            f"LLM cache hit for {kwargs.get('label') or kwargs.get('function_call', kwargs['model'])}."
+        )
+        return response
+
+    if getattr(_deferring, "active", False):
+        raise RequestDeferred(kwargs)
+
+    response = create_chat_completion(**kwargs)
+    # Store and return plain dicts, as they come back from the cache
+    response = json.loads(json.dumps(response))
+    cache.set(key, response)
+    return response
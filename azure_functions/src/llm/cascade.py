@@ -0,0 +1,281 @@
+"""
+Similarity cascade in front of the connection inference functions.
+
+A candidate whose embedding similarity to the anchor is at or above the relation's high threshold is
+accepted without asking the LLM, and one below the low threshold is rejected. Only the uncertain band in
+between is sent to the LLM. Those LLM decisions are logged with their similarity, and
+src.jobs.calibrate_cascade fits the thresholds from that log. A small audit sample of the candidates the
+cascade could decide is still sent to the LLM, so the log keeps covering the whole similarity range.
+The sample is picked by hashing the pair, so the same request is rendered every time it's retried.
+
+Similarities from vectorstore searches, topic centroids and ranked candidates are on different scales (see
+src.vector.cutoff.SimilaritySource), so thresholds and the log are kept per relation and source.
+"""
+
+import json
+import logging
+import os
+from typing import AbstractSet, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from pydantic import BaseModel
+
+from src.data import EmbeddableGraphNode
+from src.llm.decisions import (
+    Relation,
+    get_decision_store,
+    hash_texts,
+    parse_similarity_key,
+    similarity_key,
+)
+from src.vector.cutoff import SimilaritySource
+
+Candidate = TypeVar("Candidate", bound=EmbeddableGraphNode)
+
+# Set LLM_CASCADE_ENABLED=0 to send every candidate to the LLM
+CASCADE_ENABLED = os.environ.get("LLM_CASCADE_ENABLED", "1") == "1"
+# Share of candidates decidable on similarity that are sent to the LLM anyway, for calibration
+AUDIT_RATE = float(os.environ.get("LLM_CASCADE_AUDIT_RATE", "0.05"))
+THRESHOLDS_PATH = os.environ.get(
+    "LLM_CASCADE_THRESHOLDS_PATH",
+    os.path.join(os.path.dirname(__file__), "cascade_thresholds.json"),
+)
+
+
+class CascadeThresholds(BaseModel):
+    """
+    Candidates with similarity >= high are accepted, < low are rejected, and the rest go to the LLM.
+    """
+
+    low: float
+    high: float
+
+    def decide(self, similarity: float) -> Optional[bool]:
+        if similarity >= self.high:
+            return True
+        if similarity < self.low:
+            return False
+        return None
+
+
+# Out of range of cosine similarity, so nothing is decided on that side
+NEVER_ACCEPT = 1.01
+NEVER_REJECT = -1.01
+
+# Used until thresholds are calibrated, for text-embedding-ada-002. Deliberately wide: adaptive search
+# already cuts candidates below about 0.76 (see src.vector.cutoff), and near duplicates score above 0.95.
+# Centroid similarities have no defaults on their scale, so every candidate is sent to the LLM, and logged,
+# until thresholds are fitted for them.
+DEFAULT_THRESHOLDS: Dict[SimilaritySource, CascadeThresholds] = {
+    SimilaritySource.VECTOR: CascadeThresholds(low=0.78, high=0.95),
+    SimilaritySource.CENTROID: CascadeThresholds(low=NEVER_REJECT, high=NEVER_ACCEPT),
+    SimilaritySource.RANKED: CascadeThresholds(low=0.78, high=0.95),
+}
+
+ThresholdsKey = Tuple[Relation, SimilaritySource]
+
+_thresholds: Optional[Dict[ThresholdsKey, CascadeThresholds]] = None
+
+
+def load_thresholds(
+    path: str = THRESHOLDS_PATH,
+) -> Dict[ThresholdsKey, CascadeThresholds]:
+    """
+    Reads calibrated thresholds, by relation and similarity source. Pairs missing from the file use the
+    source's DEFAULT_THRESHOLDS.
+    """
+    thresholds = {
+        (relation, source): DEFAULT_THRESHOLDS[source]
+        for relation in Relation
+        for source in SimilaritySource
+    }
+    if os.path.exists(path):
+        with open(path) as f:
+            for key, values in json.load(f).items():
+                thresholds[parse_similarity_key(key)] = (
+                    CascadeThresholds.model_validate(values)
+                )
+    return thresholds
+
+
+def save_thresholds(
+    thresholds: Dict[ThresholdsKey, CascadeThresholds], path: str = THRESHOLDS_PATH
+) -> None:
+    with open(path, "w") as f:
+        json.dump(
+            {
+                similarity_key(relation, source): relation_thresholds.model_dump()
+                for (relation, source), relation_thresholds in thresholds.items()
+            },
+            f,
+            indent=2,
+        )
+
+
+def get_thresholds(
+    relation: Relation, source: SimilaritySource = SimilaritySource.VECTOR
+) -> CascadeThresholds:
+    global _thresholds
+    if _thresholds is None:
+        _thresholds = load_thresholds()
+    return _thresholds[(relation, source)]
+
+
+def is_audited(
+    relation: Relation, anchor: EmbeddableGraphNode, candidate: EmbeddableGraphNode
+) -> bool:
+    """
+    Whether the pair is in the audit sample. Stable for a pair, unlike a random draw.
+    """
+    digest = hash_texts(f"{relation.value}:{anchor.id}", candidate.id)
+    return int(digest[:8], 16) / 0xFFFFFFFF < AUDIT_RATE
+
+
+def infer_with_cascade(
+    relation: Relation,
+    anchor: EmbeddableGraphNode,
+    candidates: List[Candidate],
+    similarities: List[float],
+    infer: Callable[[List[Candidate]], List[Candidate]],
+    llm_decided: Optional[AbstractSet[str]] = None,
+    source: SimilaritySource = SimilaritySource.VECTOR,
+) -> List[Candidate]:
+    """
+    Accepts and rejects candidates on similarity alone where the thresholds allow, and only sends the
+    uncertain ones to infer. similarities are the anchor's similarity to each candidate, in order, from
+    source, whose thresholds are used.
+
+    infer receives the uncertain candidates and returns the related subset. Its decisions are logged
+    with their similarity for calibration. If infer doesn't ask the LLM about every candidate, e.g. when a
+    classifier decides some, llm_decided holds the ids it asked about once it returns, and only those are
+    logged. Returns the related candidates in their original order.
+    """
+    if not CASCADE_ENABLED:
+        return infer(candidates)
+
+    thresholds = get_thresholds(relation, source)
+    decided: Dict[str, bool] = {}
+    uncertain: List[Tuple[Candidate, float]] = []
+    for candidate, similarity in zip(candidates, similarities):
+        decision = thresholds.decide(similarity)
+        if decision is None or is_audited(relation, anchor, candidate):
+            uncertain.append((candidate, similarity))
+        else:
+            decided[candidate.id] = decision
+
+    logging.info(
+        f"{relation.value}: cascade accepted {sum(decided.values())} and rejected {len(decided) - sum(decided.values())} of {len(candidates)} candidates on similarity."
+    )
+
+    if len(uncertain) > 0:
+        related_ids = {
+            candidate.id
+            for candidate in infer([candidate for candidate, _ in uncertain])
+        }
+        get_decision_store().record_similarities(
+            relation,
+            anchor,
+            [
+                (candidate, similarity, candidate.id in related_ids)
+                for candidate, similarity in uncertain
+                if llm_decided is None or candidate.id in llm_decided
+            ],
+            source=source,
+        )
+        for candidate, _ in uncertain:
+            decided[candidate.id] = candidate.id in related_ids
+
+    return [candidate for candidate in candidates if decided[candidate.id]]
+
+
+class CalibrationReport(BaseModel):
+    """
+    How a pair of thresholds performs on logged LLM decisions, taking the LLM's answers as ground truth.
+    """
+
+    relation: str
+    samples: int
+    positives: int
+    thresholds: CascadeThresholds
+    # Of the candidates accepted on similarity, the share the LLM also accepted
+    accept_precision: float
+    # Of the candidates rejected on similarity, the share the LLM also rejected
+    reject_precision: float
+    # Of the candidates the LLM accepted, the share the cascade still accepts
+    recall: float
+    # Share of candidates that would still be sent to the LLM
+    llm_share: float
+
+    def summary(self) -> str:
+        return (
+            f"{self.relation}: {self.samples} samples ({self.positives} related). "
+            f"low={self.thresholds.low:.3f} high={self.thresholds.high:.3f} "
+            f"accept precision={self.accept_precision:.3f} reject precision={self.reject_precision:.3f} "
+            f"recall={self.recall:.3f} sent to LLM={self.llm_share:.1%}"
+        )
+
+
+def evaluate_thresholds(
+    relation: Relation,
+    samples: List[Tuple[float, bool]],
+    thresholds: CascadeThresholds,
+    source: SimilaritySource = SimilaritySource.VECTOR,
+) -> CalibrationReport:
+    accepted = [
+        decision for similarity, decision in samples if similarity >= thresholds.high
+    ]
+    rejected = [
+        decision for similarity, decision in samples if similarity < thresholds.low
+    ]
+    positives = sum(decision for _, decision in samples)
+    # Positives are still found if they are accepted, or land in the band the LLM decides
+    missed = sum(rejected)
+
+    return CalibrationReport(
+        relation=similarity_key(relation, source),
+        samples=len(samples),
+        positives=positives,
+        thresholds=thresholds,
+        accept_precision=sum(accepted) / len(accepted) if len(accepted) > 0 else 1.0,
+        reject_precision=1 - missed / len(rejected) if len(rejected) > 0 else 1.0,
+        recall=1 - missed / positives if positives > 0 else 1.0,
+        llm_share=(
+            1 - (len(accepted) + len(rejected)) / len(samples)
+            if len(samples) > 0
+            else 1.0
+        ),
+    )
+
+
+def fit_thresholds(
+    samples: List[Tuple[float, bool]], target_precision: float
+) -> CascadeThresholds:
+    """
+    Picks the widest accept and reject bands whose precision on the samples is at least target_precision.
+
+    high is the lowest similarity such that at least target_precision of the samples at or above it are
+    related. low is the highest similarity such that at least target_precision of the samples below it are
+    unrelated. If no band qualifies, its threshold is set so nothing is decided on that side.
+    """
+    ordered = sorted(samples, key=lambda sample: sample[0], reverse=True)
+
+    high = NEVER_ACCEPT
+    related = 0
+    for i, (similarity, decision) in enumerate(ordered):
+        related += decision
+        # Only cut between distinct similarities
+        if i + 1 < len(ordered) and ordered[i + 1][0] == similarity:
+            continue
+        if related / (i + 1) >= target_precision:
+            high = similarity
+
+    low = NEVER_REJECT
+    unrelated = 0
+    for i, (similarity, decision) in enumerate(reversed(ordered)):
+        unrelated += not decision
+        if i + 1 < len(ordered) and ordered[-(i + 2)][0] == similarity:
+            continue
+        if unrelated / (i + 1) >= target_precision:
+            # Samples below low are rejected, so low sits just above this one
+            low = ordered[-(i + 2)][0] if i + 1 < len(ordered) else NEVER_ACCEPT
+
+    return CascadeThresholds(low=min(low, high), high=high)
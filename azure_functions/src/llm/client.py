@@ -0,0 +1,437 @@
+"""
+Central wrapper around the OpenAI API that every src.llm call goes through.
+
+Each model has a requests-per-minute and a tokens-per-minute token bucket. Calls are admitted once both
+buckets allow them, with tokens estimated before sending and corrected from the reported usage. Throttled
+and transient failures are retried, honouring Retry-After. The number of calls in flight adapts to
+throttling, and higher priority lanes are admitted before lower ones.
+
+Requests are sent to the provider from src.llm.providers, so LLM_PROVIDER=stub runs everything offline.
+Providers that aren't rate limited are called directly. The stub is rate limited unless
+STUB_LLM_RATE_LIMITED=false.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import openai.error
+from pydantic import BaseModel
+
+from src.llm.prompts import context_window, count_request_tokens
+from src.llm.providers import get_provider
+
+DEFAULT_CHAT_MODEL = "gpt-3.5-turbo-0613"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# (requests per minute, tokens per minute) per model. Override with OPENAI_RATE_LIMITS='{"model": [rpm, tpm]}'.
+RATE_LIMITS: Dict[str, Tuple[int, int]] = {
+    DEFAULT_CHAT_MODEL: (3500, 90000),
+    DEFAULT_EMBEDDING_MODEL: (3000, 1000000),
+}
+RATE_LIMITS.update(
+    {
+        model: (int(limits[0]), int(limits[1]))
+        for model, limits in json.loads(
+            os.environ.get("OPENAI_RATE_LIMITS", "{}")
+        ).items()
+    }
+)
+FALLBACK_RATE_LIMIT = (500, 60000)
+
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("OPENAI_MAX_CONCURRENT_REQUESTS", "16"))
+MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "6"))
+MAX_BACKOFF_SECONDS = 60.0
+
+# Completion tokens assumed when a request doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.TryAgain,
+)
+
+
+class Priority(Enum):
+    """
+    Admission lanes. A waiting call is only admitted when no call in a higher lane is waiting.
+    """
+
+    HIGH = 0  # Someone is waiting on the result
+    NORMAL = 1  # Change handlers
+    LOW = 2  # Backfills and maintenance jobs
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens and refills continuously at refill_per_second. Not thread safe on its own.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated_at) * self.refill_per_second,
+        )
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """
+        Seconds until amount tokens are available. 0 if they are available now.
+        """
+        self._refill()
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Admits calls against a requests-per-minute and a tokens-per-minute bucket, highest priority lane first.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int) -> None:
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._waiting: Dict[Priority, int] = {priority: 0 for priority in Priority}
+
+    def _higher_priority_waiting(self, priority: Priority) -> bool:
+        return any(
+            count > 0
+            for lane, count in self._waiting.items()
+            if lane.value < priority.value
+        )
+
+    def acquire(self, tokens: int, priority: Priority = Priority.NORMAL) -> None:
+        """
+        Blocks until the call can be sent, then takes one request and the estimated tokens.
+        """
+        tokens = min(tokens, int(self.tokens.capacity))  # Would never fit otherwise
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    wait = self._paused_until - time.monotonic()
+                    if wait <= 0 and not self._higher_priority_waiting(priority):
+                        wait = max(
+                            self.requests.time_until(1), self.tokens.time_until(tokens)
+                        )
+                        if wait <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            return
+                    self._condition.wait(timeout=max(wait, 0.01))
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+    def correct(self, estimated_tokens: int, used_tokens: int) -> None:
+        """
+        Gives back over-estimated tokens, or takes under-estimated ones.
+        """
+        with self._condition:
+            if used_tokens < estimated_tokens:
+                self.tokens.give_back(estimated_tokens - used_tokens)
+            else:
+                self.tokens.take(used_tokens - estimated_tokens)
+            self._condition.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Holds back every call to this model, e.g. after the API asked us to retry later.
+        """
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Caps calls in flight. Halves the cap when throttled and raises it by one after a cap's worth of successes.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1) -> None:
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = max_limit
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def on_throttled(self) -> None:
+        with self._condition:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._successes = 0
+            logging.warning(f"OpenAI throttled. Concurrency limit is now {self.limit}.")
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+concurrency_limit = AdaptiveConcurrencyLimit(MAX_CONCURRENT_REQUESTS)
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    with _rate_limiters_lock:
+        if model not in _rate_limiters:
+            requests_per_minute, tokens_per_minute = RATE_LIMITS.get(
+                model, FALLBACK_RATE_LIMIT
+            )
+            _rate_limiters[model] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return _rate_limiters[model]
+
+
+def estimate_chat_tokens(kwargs: Dict[str, Any]) -> int:
+    """
+    Token estimate for a chat completion: the counted prompt tokens plus the expected completion.
+    """
+    completion_tokens = kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return count_request_tokens(kwargs) + completion_tokens
+
+
+class TokenUsage(BaseModel):
+    """
+    Running token totals of one kind of request, for capacity planning.
+    """
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    max_prompt_tokens: int = 0
+
+    def record(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+
+
+# Per prompt template (or function called, or model, for other requests and embeddings), for the lifetime of the worker
+TOKEN_USAGE: Dict[str, TokenUsage] = {}
+_token_usage_lock = threading.Lock()
+
+
+def request_label(kwargs: Dict[str, Any]) -> str:
+    function_call = kwargs.get("function_call")
+    if isinstance(function_call, dict):
+        return function_call["name"]
+    return kwargs["model"]
+
+
+def record_token_usage(label: str, prompt_tokens: int, completion_tokens: int) -> None:
+    logging.info(
+        f"{label}: {prompt_tokens} prompt and {completion_tokens} completion tokens."
+    )
+    with _token_usage_lock:
+        TOKEN_USAGE.setdefault(label, TokenUsage()).record(
+            prompt_tokens, completion_tokens
+        )
+
+
+def check_context_window(
+    label: str, kwargs: Dict[str, Any], prompt_tokens: int
+) -> None:
+    """
+    Warns when a request may not fit the model's context window with room for its completion.
+    """
+    completion_tokens = kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    window = context_window(kwargs["model"])
+    if prompt_tokens + completion_tokens > window:
+        logging.warning(
+            f"{label}: {prompt_tokens} prompt tokens leave less than {completion_tokens} of the {window} token context window for the completion."
+        )
+
+
+def estimate_embedding_tokens(kwargs: Dict[str, Any]) -> int:
+    texts = kwargs.get("input", "")
+    if isinstance(texts, str):
+        texts = [texts]
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Seconds the API asked us to wait, if it did.
+    """
+    headers = getattr(error, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        for key in (header, header.title()):
+            if key in headers:
+                try:
+                    return float(headers[key]) * scale
+                except ValueError:
+                    pass
+    return None
+
+
+def call_with_limits(
+    create: Callable[..., Any],
+    model: str,
+    estimated_tokens: int,
+    priority: Priority,
+    kwargs: Dict[str, Any],
+) -> Any:
+    """
+    Sends a request through the model's rate limiter and the concurrency limit, retrying retryable errors.
+    """
+    rate_limiter = get_rate_limiter(model)
+
+    for attempt in range(MAX_RETRIES + 1):
+        rate_limiter.acquire(estimated_tokens, priority)
+        try:
+            with concurrency_limit.slot():
+                response = create(**kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = get_retry_after(e)
+            if delay is None:
+                delay = min(MAX_BACKOFF_SECONDS, 2**attempt) * random.uniform(0.5, 1.5)
+            if isinstance(e, openai.error.RateLimitError):
+                rate_limiter.pause(delay)
+                concurrency_limit.on_throttled()
+            logging.warning(
+                f"OpenAI call to {model} failed ({type(e).__name__}: {e}). Retrying in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})."
+            )
+            time.sleep(delay)
+            continue
+
+        concurrency_limit.on_success()
+        # Streamed responses are generators without usage
+        usage = response.get("usage") if isinstance(response, dict) else None
+        usage = usage or {}
+        if "total_tokens" in usage:
+            rate_limiter.correct(estimated_tokens, usage["total_tokens"])
+        return response
+
+
+def create_chat_completion(
+    priority: Priority = Priority.NORMAL, label: Optional[str] = None, **kwargs: Any
+) -> Any:
+    """
+    Same arguments as openai.ChatCompletion.create.
+
+    label names the request in token usage, e.g. the key of the src.llm.registry template it was rendered from.
+    """
+    kwargs.setdefault("model", DEFAULT_CHAT_MODEL)
+    label = label or request_label(kwargs)
+    prompt_tokens = count_request_tokens(kwargs)
+    check_context_window(label, kwargs, prompt_tokens)
+
+    provider = get_provider()
+    if not provider.rate_limited:
+        response = provider.chat_completion(**kwargs)
+    else:
+        response = call_with_limits(
+            provider.chat_completion,
+            kwargs["model"],
+            estimate_chat_tokens(kwargs),
+            priority,
+            kwargs,
+        )
+
+    usage = response.get("usage") or {}
+    record_token_usage(
+        label,
+        usage.get("prompt_tokens", prompt_tokens),
+        usage.get("completion_tokens", 0),
+    )
+    return response
+
+
+def stream_chat_completion(
+    priority: Priority = Priority.NORMAL, label: Optional[str] = None, **kwargs: Any
+) -> Iterator[Dict[str, Any]]:
+    """
+    Same arguments as openai.ChatCompletion.create. Yields the response's chunks as they arrive.
+
+    Only opening the stream is retried. Tokens are not corrected from usage, which streams don't report,
+    so only the counted prompt tokens are recorded.
+    """
+    kwargs.setdefault("model", DEFAULT_CHAT_MODEL)
+    label = label or request_label(kwargs)
+    prompt_tokens = count_request_tokens(kwargs)
+    check_context_window(label, kwargs, prompt_tokens)
+    record_token_usage(label, prompt_tokens, 0)
+
+    provider = get_provider()
+    if not provider.rate_limited:
+        return provider.chat_completion_stream(**kwargs)
+    return call_with_limits(
+        provider.chat_completion_stream,
+        kwargs["model"],
+        estimate_chat_tokens(kwargs),
+        priority,
+        kwargs,
+    )
+
+
+def create_embedding(priority: Priority = Priority.NORMAL, **kwargs: Any) -> Any:
+    """
+    Same arguments as openai.Embedding.create.
+    """
+    kwargs.setdefault("model", DEFAULT_EMBEDDING_MODEL)
+    provider = get_provider()
+    if not provider.rate_limited:
+        response = provider.embedding(**kwargs)
+    else:
+        response = call_with_limits(
+            provider.embedding,
+            kwargs["model"],
+            estimate_embedding_tokens(kwargs),
+            priority,
+            kwargs,
+        )
+
+    usage = response.get("usage") or {}
+    record_token_usage(
+        request_label(kwargs),
+        usage.get("total_tokens", estimate_embedding_tokens(kwargs)),
+        0,
+    )
+    return response
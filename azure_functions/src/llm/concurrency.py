@@ -0,0 +1,93 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Upper bound on LLM (and other network bound) calls in flight per worker process
+MAX_CONCURRENT_LLM_CALLS = int(os.environ.get("MAX_CONCURRENT_LLM_CALLS", "6"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+# The worker runs sync invocations on several threads, which may all make their first call at once
+_executor_lock = threading.Lock()
+
+
+def get_llm_executor() -> ThreadPoolExecutor:
+    """
+    Gets the thread pool shared by every handler in this worker process.
+
+    It is created on first use and kept for the life of the process, so warm invocations reuse its threads.
+    Tasks submitted to it should not wait on other tasks in it, since the pool is bounded.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=MAX_CONCURRENT_LLM_CALLS, thread_name_prefix="llm"
+                )
+    return _executor
+
+
+def submit(fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+    """
+    Runs fn in the shared pool and returns its future.
+    """
+    return get_llm_executor().submit(fn, *args, **kwargs)
+
+
+def map_concurrently(fn: Callable[[Any], T], items: Iterable[Any]) -> List[T]:
+    """
+    Applies fn to every item in the shared pool and returns the results in input order.
+
+    Waits for every call to finish, then re-raises the exception of the first failed item in input order,
+    so no call is still running when the caller handles it.
+    """
+    futures = [submit(fn, item) for item in items]
+    wait(futures)
+    return [future.result() for future in futures]
+
+
+def iter_batches_in_background(*sources: Iterable[T]) -> Iterator[List[T]]:
+    """
+    Consumes every source (e.g. a streamed LLM response) in the shared pool, each in its own task, and yields
+    everything that has arrived from any of them since the last batch, waiting for at least one item.
+
+    The first batch is yielded as soon as the first item arrives, and later batches grow while the consumer
+    is busy with the previous one. Re-raises the first failed producer's exception once every producer is
+    done. The producers don't wait on other tasks, but the consumer does, so it must not run in the pool.
+    """
+    arrived: "queue.Queue[Any]" = queue.Queue()
+    done = object()
+
+    def produce(items: Iterable[T]) -> None:
+        try:
+            for item in items:
+                arrived.put(item)
+        finally:
+            arrived.put(done)
+
+    producers = [submit(produce, items) for items in sources]
+
+    running = len(producers)
+    while running > 0:
+        batch: List[T] = []
+        item = arrived.get()
+        while True:
+            if item is done:
+                running -= 1
+                if running == 0:
+                    break
+            else:
+                batch.append(item)
+            try:
+                item = arrived.get_nowait()
+            except queue.Empty:
+                break
+        if len(batch) > 0:
+            yield batch
+
+    for producer in producers:
+        producer.result()
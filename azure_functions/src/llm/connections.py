@@ -1,13 +1,118 @@
-from typing import Dict, List
-import openai
+from typing import Any, Callable, Dict, List, Optional, Set
 from src.data import Observation, ActionItem, Topic
 from src.llm.utils import unpack_function_call_arguments
+from src.llm.cache import cached_chat_completion
+from src.llm.decisions import Relation, infer_with_decisions
+from src.llm.cascade import infer_with_cascade
+from src.llm.distill import infer_with_classifier
+from src.llm.prompts import feedback_context, numbered_list
+from src.llm.registry import PromptTemplate, register
+from src.vector.cutoff import SimilaritySource
+
+# Gets the embeddings of nodes of one type, e.g. Storage.embed_nodes, for the classifier
+Embed = Callable[[List[Any]], List[List[float]]]
+
+
+def decide_connections(
+    relation: Relation,
+    anchor: Any,
+    candidates: List[Any],
+    ask: Callable[[List[Any]], List[Any]],
+    similarities: Optional[List[float]] = None,
+    use_decisions: bool = True,
+    use_classifier: bool = True,
+    embed: Optional[Embed] = None,
+    source: SimilaritySource = SimilaritySource.VECTOR,
+) -> List[Any]:
+    """
+    Decides which candidates are connected to the anchor, with the cheapest deciders first. Each one passes
+    what it can't decide on to the next:
+    1. the similarity cascade accepts and rejects candidates where similarity is reliable enough;
+    2. decisions already made for the anchor are reused;
+    3. a trained classifier decides what it reliably can;
+    4. ask, the LLM prompt of the relation, decides the rest.
+
+    Only the LLM's answers are logged for calibration and training, and kept as decisions. source is where
+    similarities come from, which picks the cascade's thresholds.
+    """
+    if len(candidates) == 0:
+        return []
+
+    asked: Set[str] = set()
+
+    def ask_llm(remaining: List[Any]) -> List[Any]:
+        asked.update(candidate.id for candidate in remaining)
+        return ask(remaining)
+
+    def classify(remaining: List[Any]) -> List[Any]:
+        if not use_classifier:
+            return ask_llm(remaining)
+        return infer_with_classifier(relation, anchor, remaining, ask_llm, embed=embed)
+
+    def reuse_decisions(remaining: List[Any]) -> List[Any]:
+        if not use_decisions:
+            return classify(remaining)
+        return infer_with_decisions(
+            relation, anchor, remaining, classify, llm_decided=asked
+        )
+
+    if similarities is None:
+        return reuse_decisions(candidates)
+    return infer_with_cascade(
+        relation,
+        anchor,
+        candidates,
+        similarities,
+        reuse_decisions,
+        llm_decided=asked,
+        source=source,
+    )
+
+
+ACTION_ITEMS_TO_OBSERVATIONS_PROMPT = register(
+    PromptTemplate(
+        name="action_items_to_observations",
+        version=1,
+        system="You are an expert in customer service. Your task is to interpret customer's reviews, feedback, and conversations with us to infer which action items will help us address observations taken from a customer's feedback. ",
+        user="Here is a customer's feedback:\n\n{feedback}\n\nFrom this feedback, we have the following observations:\n\n{numbered_observations}\n\nHere are the action items we have in our backlog:\n\n{numbered_action_items}\n\nFor each action item, report which observation(s) the action item helps to address.",
+        function={
+            "name": "report_action_item_relationships",
+            "description": "This function is used report which action items address which observation. It accepts an array of action item objects.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "relationships": {
+                        "type": "array",
+                        "description": "A list of relationships.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "action_item_id": {
+                                    "type": "integer",
+                                    "description": "The id of the action item. For example: 0",
+                                },
+                                "observation_ids": {
+                                    "type": "array",
+                                    "description": "A list of observation ids. For example: [0, 1]",
+                                    "items": {"type": "integer"},
+                                },
+                            },
+                            "required": ["action_item_id", "observation_ids"],
+                        },
+                    }
+                },
+                "required": ["relationships"],
+            },
+        },
+    )
+)
 
 
 def infer_action_items_to_observations_connections(
     feedback_item: str,
     observations: List[Observation],
     action_items: List[ActionItem],
+    use_cache: bool = True,
 ) -> Dict[int, List[int]]:
     """
     Given a feedback item as context, a list of observations, and a list of action items, infer which action items address which observations.
@@ -20,58 +125,21 @@ def infer_action_items_to_observations_connections(
         return {}
 
     # Create a numbered list of observations and action items
-    numbered_observations = ""
-    for i, observation in enumerate(observations):
-        numbered_observations += f"{i}. {observation.text}\n"
-
-    numbered_action_items = ""
-    for i, action_item in enumerate(action_items):
-        numbered_action_items += f"{i}. {action_item.text}\n"
-
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service. Your task is to interpret customer's reviews, feedback, and conversations with us to infer which action items will help us address observations taken from a customer's feedback. ",
-            },
-            {
-                "role": "user",
-                "content": f"Here is a customer's feedback:\n\n{feedback_item}\n\nFrom this feedback, we have the following observations:\n\n{numbered_observations}\n\nHere are the action items we have in our backlog:\n\n{numbered_action_items}\n\nFor each action item, report which observation(s) the action item helps to address.",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_action_item_relationships",
-                "description": "This function is used report which action items address which observation. It accepts an array of action item objects.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "relationships": {
-                            "type": "array",
-                            "description": "A list of relationships.",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "action_item_id": {
-                                        "type": "integer",
-                                        "description": "The id of the action item. For example: 0",
-                                    },
-                                    "observation_ids": {
-                                        "type": "array",
-                                        "description": "A list of observation ids. For example: [0, 1]",
-                                        "items": {"type": "integer"},
-                                    },
-                                },
-                                "required": ["action_item_id", "observation_ids"],
-                            },
-                        }
-                    },
-                    "required": ["relationships"],
-                },
-            },
-        ],
-        function_call={"name": "report_action_item_relationships"},
+    numbered_observations = numbered_list(
+        [observation.text for observation in observations]
+    )
+
+    numbered_action_items = numbered_list(
+        [action_item.text for action_item in action_items]
+    )
+
+    response = cached_chat_completion(
+        use_cache=use_cache,
+        **ACTION_ITEMS_TO_OBSERVATIONS_PROMPT.render(
+            feedback=feedback_context(feedback_item),
+            numbered_action_items=numbered_action_items,
+            numbered_observations=numbered_observations,
+        )
     )
 
     relationships = unpack_function_call_arguments(response)["relationships"]  # type: ignore
@@ -86,56 +154,78 @@ def infer_action_items_to_observations_connections(
     return action_item_to_observations  # type: ignore
 
 
+OBSERVATION_TO_ACTION_ITEMS_PROMPT = register(
+    PromptTemplate(
+        name="observation_to_action_items",
+        version=1,
+        temperature=0.0,
+        system="You are an expert in customer service.",
+        user="We have the following observation from a customer review:\n\n{observation}\n\nFor each of the following action items, report if the action item directly addresses the observation above:\n\n{numbered_action_items}",
+        function={
+            "name": "report_action_item",
+            "description": "This function is used report whether each action item directly addresses the observation.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "addresses": {
+                        "type": "array",
+                        "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
+                        "items": {
+                            "type": "boolean",
+                            "description": "Whether the action item directly addresses the observation.",
+                        },
+                    }
+                },
+                "required": ["addresses"],
+            },
+        },
+    )
+)
+
+
 def infer_observation_to_action_items_connections(
     observation: Observation,
     action_items: List[ActionItem],
+    similarities: Optional[List[float]] = None,
+    use_cache: bool = True,
+    use_decisions: bool = True,
+    use_classifier: bool = True,
+    embed: Optional[Embed] = None,
+    source: SimilaritySource = SimilaritySource.VECTOR,
 ) -> List[ActionItem]:
     """
     Given a single observation, and a list of action items, infer which subset of action items address the observation.
     """
+    return decide_connections(
+        Relation.OBSERVATION_TO_ACTION_ITEMS,
+        observation,
+        action_items,
+        lambda remaining: ask_observation_to_action_items(
+            observation, remaining, use_cache=use_cache
+        ),
+        similarities=similarities,
+        source=source,
+        use_decisions=use_decisions,
+        use_classifier=use_classifier,
+        embed=embed,
+    )
 
-    # Exit if there are no action items
-    if len(action_items) == 0:
-        return []
 
-    numbered_action_items = ""
-    for i, action_item in enumerate(action_items):
-        numbered_action_items += f"{i}. {action_item.text}\n"
+def ask_observation_to_action_items(
+    observation: Observation, action_items: List[ActionItem], use_cache: bool = True
+) -> List[ActionItem]:
+    """
+    The LLM step of infer_observation_to_action_items_connections, asking about every candidate.
+    """
+    numbered_action_items = numbered_list(
+        [action_item.text for action_item in action_items]
+    )
 
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        temperature=0.0,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service.",
-            },
-            {
-                "role": "user",
-                "content": f"We have the following observation from a customer review:\n\n{observation.text}\n\nFor each of the following action items, report if the action item directly addresses the observation above:\n\n{numbered_action_items}",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_action_item",
-                "description": "This function is used report whether each action item directly addresses the observation.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "addresses": {
-                            "type": "array",
-                            "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
-                            "items": {
-                                "type": "boolean",
-                                "description": "Whether the action item directly addresses the observation.",
-                            },
-                        }
-                    },
-                    "required": ["addresses"],
-                },
-            },
-        ],
-        function_call={"name": "report_action_item"},
+    response = cached_chat_completion(
+        use_cache=use_cache,
+        **OBSERVATION_TO_ACTION_ITEMS_PROMPT.render(
+            numbered_action_items=numbered_action_items, observation=observation.text
+        )
     )
 
     booleans = unpack_function_call_arguments(response)["addresses"]  # type: ignore
@@ -149,55 +239,75 @@ def infer_observation_to_action_items_connections(
     return related_action_items  # type: ignore
 
 
+OBSERVATION_TO_TOPICS_PROMPT = register(
+    PromptTemplate(
+        name="observation_to_topics",
+        version=1,
+        system="You are an expert in customer service.",
+        user="We have the following observation from a customer review:\n\n{observation}\n\nFor each of the following topics, report if the observation above belongs to the topic:\n\n{numbered_topics}",
+        function={
+            "name": "report_topic",
+            "description": "This function is used report whether the observation belongs to each topic.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "belongs_to": {
+                        "type": "array",
+                        "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
+                        "items": {
+                            "type": "boolean",
+                            "description": "Whether the observation belongs to the topic.",
+                        },
+                    }
+                },
+                "required": ["belongs_to"],
+            },
+        },
+    )
+)
+
+
 def infer_observation_to_topics_connections(
     observation: Observation,
     topics: List[Topic],
+    similarities: Optional[List[float]] = None,
+    use_cache: bool = True,
+    use_decisions: bool = True,
+    use_classifier: bool = True,
+    embed: Optional[Embed] = None,
+    source: SimilaritySource = SimilaritySource.VECTOR,
 ) -> List[Topic]:
     """
     Given a single observation, and a list of topics, infer which subset of topics the observation belongs to.
     """
+    return decide_connections(
+        Relation.OBSERVATION_TO_TOPICS,
+        observation,
+        topics,
+        lambda remaining: ask_observation_to_topics(
+            observation, remaining, use_cache=use_cache
+        ),
+        similarities=similarities,
+        source=source,
+        use_decisions=use_decisions,
+        use_classifier=use_classifier,
+        embed=embed,
+    )
 
-    # Exit if there are no topics
-    if len(topics) == 0:
-        return []
 
-    numbered_topics = ""
-    for i, topic in enumerate(topics):
-        numbered_topics += f"{i}. {topic.text}\n"
+def ask_observation_to_topics(
+    observation: Observation, topics: List[Topic], use_cache: bool = True
+) -> List[Topic]:
+    """
+    The LLM step of infer_observation_to_topics_connections, asking about every candidate.
+    """
+    numbered_topics = numbered_list([topic.text for topic in topics])
 
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service.",
-            },
-            {
-                "role": "user",
-                "content": f"We have the following observation from a customer review:\n\n{observation.text}\n\nFor each of the following topics, report if the observation above belongs to the topic:\n\n{numbered_topics}",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_topic",
-                "description": "This function is used report whether the observation belongs to each topic.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "belongs_to": {
-                            "type": "array",
-                            "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
-                            "items": {
-                                "type": "boolean",
-                                "description": "Whether the observation belongs to the topic.",
-                            },
-                        }
-                    },
-                    "required": ["belongs_to"],
-                },
-            },
-        ],
-        function_call={"name": "report_topic"},
+    response = cached_chat_completion(
+        use_cache=use_cache,
+        **OBSERVATION_TO_TOPICS_PROMPT.render(
+            numbered_topics=numbered_topics, observation=observation.text
+        )
     )
 
     booleans = unpack_function_call_arguments(response)["belongs_to"]  # type: ignore
@@ -211,56 +321,78 @@ def infer_observation_to_topics_connections(
     return related_topics  # type: ignore
 
 
+TOPIC_TO_OBSERVATIONS_PROMPT = register(
+    PromptTemplate(
+        name="topic_to_observations",
+        version=1,
+        temperature=0.0,
+        system="You are an expert in customer service. Your task is to discern if a given observation directly discusses the specified topic. Ensure you look for clear, explicit, and literal mentions or indications of the topic within each observation. Avoid making indirect or tangential associations. For example, if the topic is 'Ambiance', and one observation is 'The lights were too bright.', that's a direct mention. But if another observation is 'The apple pie was delicious.', that does not explicitly discuss 'Ambiance' even if ambiance might influence the dining experience.",
+        user="For each of the following observations, report if the observation is talking about the topic '{topic}':\n\n{numbered_observations}",
+        function={
+            "name": "report_observations",
+            "description": "Use this to report whether each observation is talking about the topic '{topic}'.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "belongs_to": {
+                        "type": "array",
+                        "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
+                        "items": {
+                            "type": "boolean",
+                            "description": "Indicates whether the observation is talking about the topic of '{topic}'.",
+                        },
+                    }
+                },
+                "required": ["belongs_to"],
+            },
+        },
+    )
+)
+
+
 def infer_topic_to_observations_connections(
     topic: Topic,
     observations: List[Observation],
+    similarities: Optional[List[float]] = None,
+    use_cache: bool = True,
+    use_decisions: bool = True,
+    use_classifier: bool = True,
+    embed: Optional[Embed] = None,
+    source: SimilaritySource = SimilaritySource.VECTOR,
 ) -> List[Observation]:
     """
     Given a single topic, and a list of observations, infer which subset of observations belong to the topic.
     """
+    return decide_connections(
+        Relation.TOPIC_TO_OBSERVATIONS,
+        topic,
+        observations,
+        lambda remaining: ask_topic_to_observations(
+            topic, remaining, use_cache=use_cache
+        ),
+        similarities=similarities,
+        source=source,
+        use_decisions=use_decisions,
+        use_classifier=use_classifier,
+        embed=embed,
+    )
 
-    # Exit if there are no observations
-    if len(observations) == 0:
-        return []
 
-    numbered_observations = ""
-    for i, observation in enumerate(observations):
-        numbered_observations += f"{i}. {observation.text}\n"
+def ask_topic_to_observations(
+    topic: Topic, observations: List[Observation], use_cache: bool = True
+) -> List[Observation]:
+    """
+    The LLM step of infer_topic_to_observations_connections, asking about every candidate.
+    """
+    numbered_observations = numbered_list(
+        [observation.text for observation in observations]
+    )
 
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        temperature=0.0,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service. Your task is to discern if a given observation directly discusses the specified topic. Ensure you look for clear, explicit, and literal mentions or indications of the topic within each observation. Avoid making indirect or tangential associations. For example, if the topic is 'Ambiance', and one observation is 'The lights were too bright.', that's a direct mention. But if another observation is 'The apple pie was delicious.', that does not explicitly discuss 'Ambiance' even if ambiance might influence the dining experience.",
-            },
-            {
-                "role": "user",
-                "content": f"For each of the following observations, report if the observation is talking about the topic '{topic.text}':\n\n{numbered_observations}",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_observations",
-                "description": f"Use this to report whether each observation is talking about the topic '{topic.text}'.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "belongs_to": {
-                            "type": "array",
-                            "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
-                            "items": {
-                                "type": "boolean",
-                                "description": f"Indicates whether the observation is talking about the topic of '{topic.text}'.",
-                            },
-                        }
-                    },
-                    "required": ["belongs_to"],
-                },
-            },
-        ],
-        function_call={"name": "report_observations"},
+    response = cached_chat_completion(
+        use_cache=use_cache,
+        **TOPIC_TO_OBSERVATIONS_PROMPT.render(
+            numbered_observations=numbered_observations, topic=topic.text
+        )
     )
 
     booleans = unpack_function_call_arguments(response)["belongs_to"]  # type: ignore
@@ -274,56 +406,78 @@ def infer_topic_to_observations_connections(
     return related_observations  # type: ignore
 
 
+TOPIC_TO_ACTION_ITEMS_PROMPT = register(
+    PromptTemplate(
+        name="topic_to_action_items",
+        version=1,
+        temperature=0.0,
+        system="You are an expert in customer service. Your task is to discern if a given action item directly discusses the specified topic. Ensure you look for clear, explicit, and literal mentions or indications of the topic within each action item. Avoid making indirect or tangential associations. For example, if the topic is 'Ambiance', and one action item is 'Adjust the lights so they are not too bright.', that's a direct mention. But if another action item is 'Lower the sweetness of the apple pie.', that does not explicitly discuss 'Ambiance' even if ambiance might influence the dining experience.",
+        user="For each of the following action items, report if the action item is talking about the topic '{topic}':\n\n{numbered_action_items}",
+        function={
+            "name": "report_action_items",
+            "description": "Use this to report whether each action item is talking about the topic '{topic}'.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "belongs_to": {
+                        "type": "array",
+                        "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
+                        "items": {
+                            "type": "boolean",
+                            "description": "Indicates whether the action item is talking about the topic of '{topic}'.",
+                        },
+                    }
+                },
+                "required": ["belongs_to"],
+            },
+        },
+    )
+)
+
+
 def infer_topic_to_action_items_connections(
     topic: Topic,
     action_items: List[ActionItem],
+    similarities: Optional[List[float]] = None,
+    use_cache: bool = True,
+    use_decisions: bool = True,
+    use_classifier: bool = True,
+    embed: Optional[Embed] = None,
+    source: SimilaritySource = SimilaritySource.VECTOR,
 ) -> List[ActionItem]:
     """
     Given a single topic, and a list of action items, infer which subset of action items belong to the topic.
     """
+    return decide_connections(
+        Relation.TOPIC_TO_ACTION_ITEMS,
+        topic,
+        action_items,
+        lambda remaining: ask_topic_to_action_items(
+            topic, remaining, use_cache=use_cache
+        ),
+        similarities=similarities,
+        source=source,
+        use_decisions=use_decisions,
+        use_classifier=use_classifier,
+        embed=embed,
+    )
 
-    # Exit if there are no observations
-    if len(action_items) == 0:
-        return []
 
-    numbered_action_items = ""
-    for i, action_item in enumerate(action_items):
-        numbered_action_items += f"{i}. {action_item.text}\n"
+def ask_topic_to_action_items(
+    topic: Topic, action_items: List[ActionItem], use_cache: bool = True
+) -> List[ActionItem]:
+    """
+    The LLM step of infer_topic_to_action_items_connections, asking about every candidate.
+    """
+    numbered_action_items = numbered_list(
+        [action_item.text for action_item in action_items]
+    )
 
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        temperature=0.0,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service. Your task is to discern if a given action item directly discusses the specified topic. Ensure you look for clear, explicit, and literal mentions or indications of the topic within each action item. Avoid making indirect or tangential associations. For example, if the topic is 'Ambiance', and one action item is 'Adjust the lights so they are not too bright.', that's a direct mention. But if another action item is 'Lower the sweetness of the apple pie.', that does not explicitly discuss 'Ambiance' even if ambiance might influence the dining experience.",
-            },
-            {
-                "role": "user",
-                "content": f"For each of the following action items, report if the action item is talking about the topic '{topic.text}':\n\n{numbered_action_items}",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_action_items",
-                "description": f"Use this to report whether each action item is talking about the topic '{topic.text}'.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "belongs_to": {
-                            "type": "array",
-                            "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
-                            "items": {
-                                "type": "boolean",
-                                "description": f"Indicates whether the action item is talking about the topic of '{topic.text}'.",
-                            },
-                        }
-                    },
-                    "required": ["belongs_to"],
-                },
-            },
-        ],
-        function_call={"name": "report_action_items"},
+    response = cached_chat_completion(
+        use_cache=use_cache,
+        **TOPIC_TO_ACTION_ITEMS_PROMPT.render(
+            numbered_action_items=numbered_action_items, topic=topic.text
+        )
     )
 
     booleans = unpack_function_call_arguments(response)["belongs_to"]  # type: ignore
@@ -337,56 +491,78 @@ def infer_topic_to_action_items_connections(
     return related_action_items  # type: ignore
 
 
+ACTION_ITEM_TO_OBSERVATIONS_PROMPT = register(
+    PromptTemplate(
+        name="action_item_to_observations",
+        version=1,
+        temperature=0.0,
+        system="You are an expert in customer service. Your task is to discern if a given observation drawn from customers' feedback can be directly addressed by a provided action item.",
+        user="For each of the following observations, report if the observation can be directly addressed by this action item: '{action_item}':\n\nobservationS:\n{numbered_observations}",
+        function={
+            "name": "report_observations",
+            "description": "Use this to report whether each observation can be directly addressed by this action item: '{action_item}'.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "addressed": {
+                        "type": "array",
+                        "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
+                        "items": {
+                            "type": "boolean",
+                            "description": "Indicates whether the observation can be directly addressed by the action item: '{action_item}'.",
+                        },
+                    }
+                },
+                "required": ["addressed"],
+            },
+        },
+    )
+)
+
+
 def infer_action_item_to_observations_connections(
     action_item: ActionItem,
     observations: List[Observation],
+    similarities: Optional[List[float]] = None,
+    use_cache: bool = True,
+    use_decisions: bool = True,
+    use_classifier: bool = True,
+    embed: Optional[Embed] = None,
+    source: SimilaritySource = SimilaritySource.VECTOR,
 ) -> List[Observation]:
     """
     Given a single action_item, and a list of observations, infer which subset of observations are addressed by the action item.
     """
+    return decide_connections(
+        Relation.ACTION_ITEM_TO_OBSERVATIONS,
+        action_item,
+        observations,
+        lambda remaining: ask_action_item_to_observations(
+            action_item, remaining, use_cache=use_cache
+        ),
+        similarities=similarities,
+        source=source,
+        use_decisions=use_decisions,
+        use_classifier=use_classifier,
+        embed=embed,
+    )
 
-    # Exit if there are no observations
-    if len(observations) == 0:
-        return []
 
-    numbered_observations = ""
-    for i, observation in enumerate(observations):
-        numbered_observations += f"{i}. {observation.text}\n"
+def ask_action_item_to_observations(
+    action_item: ActionItem, observations: List[Observation], use_cache: bool = True
+) -> List[Observation]:
+    """
+    The LLM step of infer_action_item_to_observations_connections, asking about every candidate.
+    """
+    numbered_observations = numbered_list(
+        [observation.text for observation in observations]
+    )
 
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        temperature=0.0,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service. Your task is to discern if a given observation drawn from customers' feedback can be directly addressed by a provided action item.",
-            },
-            {
-                "role": "user",
-                "content": f"For each of the following observations, report if the observation can be directly addressed by this action item: '{action_item.text}':\n\nobservationS:\n{numbered_observations}",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_observations",
-                "description": f"Use this to report whether each observation can be directly addressed by this action item: '{action_item.text}'.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "addressed": {
-                            "type": "array",
-                            "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
-                            "items": {
-                                "type": "boolean",
-                                "description": f"Indicates whether the observation can be directly addressed by the action item: '{action_item.text}'.",
-                            },
-                        }
-                    },
-                    "required": ["addressed"],
-                },
-            },
-        ],
-        function_call={"name": "report_observations"},
+    response = cached_chat_completion(
+        use_cache=use_cache,
+        **ACTION_ITEM_TO_OBSERVATIONS_PROMPT.render(
+            action_item=action_item.text, numbered_observations=numbered_observations
+        )
     )
 
     booleans = unpack_function_call_arguments(response)["addressed"]  # type: ignore
@@ -400,56 +576,76 @@ def infer_action_item_to_observations_connections(
     return related_observations  # type: ignore
 
 
+ACTION_ITEM_TO_TOPICS_PROMPT = register(
+    PromptTemplate(
+        name="action_item_to_topics",
+        version=1,
+        temperature=0.0,
+        system="You are an expert in customer service. Your task is to discern if a given topic drawn from customers' feedback can be directly addressed by a provided action item.",
+        user="For each of the following topics, report if the topic can be directly addressed by this action item: '{action_item}':\n\nTOPICS:\n{numbered_topics}",
+        function={
+            "name": "report_topics",
+            "description": "Use this to report whether each topic can be directly addressed by this action item: '{action_item}'.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "addressed": {
+                        "type": "array",
+                        "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
+                        "items": {
+                            "type": "boolean",
+                            "description": "Indicates whether the topic can be directly addressed by the action item: '{action_item}'.",
+                        },
+                    }
+                },
+                "required": ["addressed"],
+            },
+        },
+    )
+)
+
+
 def infer_action_item_to_topics_connections(
     action_item: ActionItem,
     topics: List[Topic],
+    similarities: Optional[List[float]] = None,
+    use_cache: bool = True,
+    use_decisions: bool = True,
+    use_classifier: bool = True,
+    embed: Optional[Embed] = None,
+    source: SimilaritySource = SimilaritySource.VECTOR,
 ) -> List[Topic]:
     """
     Given a single action item, and a list of topics, infer which subset of topics are addressed by the action item.
     """
+    return decide_connections(
+        Relation.ACTION_ITEM_TO_TOPICS,
+        action_item,
+        topics,
+        lambda remaining: ask_action_item_to_topics(
+            action_item, remaining, use_cache=use_cache
+        ),
+        similarities=similarities,
+        source=source,
+        use_decisions=use_decisions,
+        use_classifier=use_classifier,
+        embed=embed,
+    )
 
-    # Exit if there are no topics
-    if len(topics) == 0:
-        return []
 
-    numbered_topics = ""
-    for i, topic in enumerate(topics):
-        numbered_topics += f"{i}. {topic.text}\n"
+def ask_action_item_to_topics(
+    action_item: ActionItem, topics: List[Topic], use_cache: bool = True
+) -> List[Topic]:
+    """
+    The LLM step of infer_action_item_to_topics_connections, asking about every candidate.
+    """
+    numbered_topics = numbered_list([topic.text for topic in topics])
 
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        temperature=0.0,
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service. Your task is to discern if a given topic drawn from customers' feedback can be directly addressed by a provided action item.",
-            },
-            {
-                "role": "user",
-                "content": f"For each of the following topics, report if the topic can be directly addressed by this action item: '{action_item.text}':\n\nTOPICS:\n{numbered_topics}",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_topics",
-                "description": f"Use this to report whether each topic can be directly addressed by this action item: '{action_item.text}'.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "addressed": {
-                            "type": "array",
-                            "description": "A list of booleans. Do not add any comentary. Only report with booleans. For example, [true, false, true].",
-                            "items": {
-                                "type": "boolean",
-                                "description": f"Indicates whether the topic can be directly addressed by the action item: '{action_item.text}'.",
-                            },
-                        }
-                    },
-                    "required": ["addressed"],
-                },
-            },
-        ],
-        function_call={"name": "report_topics"},
+    response = cached_chat_completion(
+        use_cache=use_cache,
+        **ACTION_ITEM_TO_TOPICS_PROMPT.render(
+            action_item=action_item.text, numbered_topics=numbered_topics
+        )
     )
 
     booleans = unpack_function_call_arguments(response)["addressed"]  # type: ignore
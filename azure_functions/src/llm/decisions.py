@@ -0,0 +1,259 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from enum import Enum
+from typing import (
+    AbstractSet,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from src.data import EmbeddableGraphNode
+from src.vector.cutoff import SimilaritySource
+
+Candidate = TypeVar("Candidate", bound=EmbeddableGraphNode)
+
+DECISIONS_PATH = os.environ.get(
+    "LLM_DECISIONS_PATH",
+    os.path.join(tempfile.gettempdir(), "feedback-assistant-llm-decisions.sqlite3"),
+)
+
+
+class Relation(Enum):
+    """
+    The connection questions we ask the LLM. Each is asked from the anchor's point of view about its candidates.
+    """
+
+    OBSERVATION_TO_ACTION_ITEMS = "observation_to_action_items"
+    OBSERVATION_TO_TOPICS = "observation_to_topics"
+    TOPIC_TO_OBSERVATIONS = "topic_to_observations"
+    TOPIC_TO_ACTION_ITEMS = "topic_to_action_items"
+    ACTION_ITEM_TO_OBSERVATIONS = "action_item_to_observations"
+    ACTION_ITEM_TO_TOPICS = "action_item_to_topics"
+
+
+def similarity_key(relation: Relation, source: SimilaritySource) -> str:
+    """
+    The name a relation's similarities from a source are logged and calibrated under. Vectorstore
+    similarities keep the relation's name, so the logs and thresholds from before sources were told apart
+    still apply to them.
+    """
+    if source == SimilaritySource.VECTOR:
+        return relation.value
+    return f"{relation.value}:{source.value}"
+
+
+def parse_similarity_key(key: str) -> Tuple[Relation, SimilaritySource]:
+    relation, _, source = key.partition(":")
+    return Relation(relation), SimilaritySource(source or SimilaritySource.VECTOR.value)
+
+
+def hash_texts(anchor_text: str, candidate_text: str) -> str:
+    """
+    Hashes the texts a decision was made on, so a decision is not reused once either text changes.
+    """
+    return hashlib.sha256(
+        f"{anchor_text}\x00{candidate_text}".encode("utf-8")
+    ).hexdigest()
+
+
+DecisionKey = Tuple[str, str, str, str]
+
+
+class DecisionStore:
+    """
+    Pairwise connection decisions keyed by (relation, anchor id, candidate id, text hash).
+
+    Kept in memory and in SQLite, so warm workers and redelivered messages reuse decisions already made.
+    """
+
+    def __init__(self, path: Optional[str] = DECISIONS_PATH) -> None:
+        self._memory: Dict[DecisionKey, bool] = {}
+        self._similarities: Dict[Tuple[str, str, str], Tuple[float, bool]] = {}
+        self._lock = threading.Lock()
+
+        self._connection: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS decisions (relation TEXT NOT NULL, anchor_id TEXT NOT NULL, candidate_id TEXT NOT NULL, text_hash TEXT NOT NULL, decision INTEGER NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (relation, anchor_id, candidate_id, text_hash))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS similarity_decisions (relation TEXT NOT NULL, anchor_id TEXT NOT NULL, candidate_id TEXT NOT NULL, similarity REAL NOT NULL, decision INTEGER NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (relation, anchor_id, candidate_id))"
+            )
+            self._connection.commit()
+
+    def _key(
+        self,
+        relation: Relation,
+        anchor: EmbeddableGraphNode,
+        candidate: EmbeddableGraphNode,
+    ) -> DecisionKey:
+        return (
+            relation.value,
+            anchor.id,
+            candidate.id,
+            hash_texts(anchor.text, candidate.text),
+        )
+
+    def lookup(
+        self,
+        relation: Relation,
+        anchor: EmbeddableGraphNode,
+        candidates: Sequence[EmbeddableGraphNode],
+    ) -> Dict[str, bool]:
+        """
+        Returns the known decisions for the candidates, by candidate id.
+        """
+        decisions: Dict[str, bool] = {}
+        with self._lock:
+            for candidate in candidates:
+                key = self._key(relation, anchor, candidate)
+                if key in self._memory:
+                    decisions[candidate.id] = self._memory[key]
+                    continue
+                if self._connection is None:
+                    continue
+                row = self._connection.execute(
+                    "SELECT decision FROM decisions WHERE relation = ? AND anchor_id = ? AND candidate_id = ? AND text_hash = ?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    self._memory[key] = bool(row[0])
+                    decisions[candidate.id] = bool(row[0])
+        return decisions
+
+    def record(
+        self,
+        relation: Relation,
+        anchor: EmbeddableGraphNode,
+        decisions: Sequence[Tuple[EmbeddableGraphNode, bool]],
+    ) -> None:
+        now = time.time()
+        with self._lock:
+            rows = []
+            for candidate, decision in decisions:
+                key = self._key(relation, anchor, candidate)
+                self._memory[key] = decision
+                rows.append(key + (int(decision), now))
+            if self._connection is not None and len(rows) > 0:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO decisions (relation, anchor_id, candidate_id, text_hash, decision, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._connection.commit()
+
+    def record_similarities(
+        self,
+        relation: Relation,
+        anchor: EmbeddableGraphNode,
+        decisions: Sequence[Tuple[EmbeddableGraphNode, float, bool]],
+        source: SimilaritySource = SimilaritySource.VECTOR,
+    ) -> None:
+        """
+        Logs LLM decisions next to the embedding similarity of the pair, to calibrate src.llm.cascade on.
+        """
+        now = time.time()
+        with self._lock:
+            rows = []
+            for candidate, similarity, decision in decisions:
+                key = (similarity_key(relation, source), anchor.id, candidate.id)
+                self._similarities[key] = (similarity, decision)
+                rows.append(key + (similarity, int(decision), now))
+            if self._connection is not None and len(rows) > 0:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO similarity_decisions (relation, anchor_id, candidate_id, similarity, decision, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._connection.commit()
+
+    def similarity_decisions(
+        self, relation: Relation, source: SimilaritySource = SimilaritySource.VECTOR
+    ) -> List[Tuple[float, bool]]:
+        """
+        Returns (similarity, decision) for every logged LLM decision of the relation on similarities from
+        the source.
+        """
+        key = similarity_key(relation, source)
+        with self._lock:
+            if self._connection is None:
+                return [
+                    value
+                    for logged_key, value in self._similarities.items()
+                    if logged_key[0] == key
+                ]
+            rows = self._connection.execute(
+                "SELECT similarity, decision FROM similarity_decisions WHERE relation = ?",
+                (key,),
+            ).fetchall()
+            return [(row[0], bool(row[1])) for row in rows]
+
+
+_store: Optional[DecisionStore] = None
+
+
+def get_decision_store() -> DecisionStore:
+    """
+    Gets the store shared by the worker process. Falls back to memory only if the SQLite file can't be opened.
+    """
+    global _store
+    if _store is None:
+        try:
+            _store = DecisionStore()
+        except sqlite3.Error as e:
+            logging.warning(
+                f"Could not open decision store at {DECISIONS_PATH}: {e}. Using memory only."
+            )
+            _store = DecisionStore(path=None)
+    return _store
+
+
+def infer_with_decisions(
+    relation: Relation,
+    anchor: EmbeddableGraphNode,
+    candidates: List[Candidate],
+    infer: Callable[[List[Candidate]], List[Candidate]],
+    llm_decided: Optional[AbstractSet[str]] = None,
+) -> List[Candidate]:
+    """
+    Answers the candidates already decided for this anchor from the store, and only sends the rest to infer.
+
+    infer receives the undecided candidates and returns the related subset. Its decisions are recorded,
+    or, with llm_decided, only those of the candidates whose ids it holds once infer returns (see
+    src.llm.cascade.infer_with_cascade). Returns the related candidates in their original order.
+    """
+    store = get_decision_store()
+    known = store.lookup(relation, anchor, candidates)
+    unknown = [candidate for candidate in candidates if candidate.id not in known]
+
+    logging.info(
+        f"{relation.value}: {len(known)} of {len(candidates)} candidates already decided."
+    )
+
+    related_ids = set()
+    if len(unknown) > 0:
+        related_ids = {candidate.id for candidate in infer(unknown)}
+        store.record(
+            relation,
+            anchor,
+            [
+                (candidate, candidate.id in related_ids)
+                for candidate in unknown
+                if llm_decided is None or candidate.id in llm_decided
+            ],
+        )
+
+    return [
+        candidate
+        for candidate in candidates
+        if known.get(candidate.id, candidate.id in related_ids)
+    ]
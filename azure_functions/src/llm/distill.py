@@ -0,0 +1,377 @@
+"""
+Local connection classifiers distilled from the LLM's decisions.
+
+Every pairwise decision the LLM makes is logged with the texts it was made on and their embeddings.
+src.jobs.train_classifiers embeds the logged texts that have no embedding yet and fits a logistic regression per relation over features of the embedding pair,
+and saves it with its agreement with the LLM on held out decisions. Once a relation's classifier agrees
+often enough, it runs in front of the LLM:
+
+- prescreen: candidates the classifier is confident about are decided locally, the rest go to the LLM.
+- replace: the classifier decides every candidate.
+
+Set the mode per relation with LLM_CLASSIFIER_MODES='{"observation_to_topics": "replace"}'.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+from src.data import EmbeddableGraphNode
+from src.llm.cascade import CascadeThresholds
+from src.llm.decisions import DECISIONS_PATH, Relation, hash_texts
+
+Candidate = TypeVar("Candidate", bound=EmbeddableGraphNode)
+
+CLASSIFIERS_DIR = os.environ.get(
+    "LLM_CLASSIFIERS_DIR", os.path.join(os.path.dirname(__file__), "classifiers")
+)
+MIN_AGREEMENT = float(os.environ.get("LLM_CLASSIFIER_MIN_AGREEMENT", "0.95"))
+
+
+class ClassifierMode(Enum):
+    OFF = "off"
+    PRESCREEN = "prescreen"
+    REPLACE = "replace"
+
+
+CLASSIFIER_MODES: Dict[Relation, ClassifierMode] = {
+    relation: ClassifierMode.PRESCREEN for relation in Relation
+}
+CLASSIFIER_MODES.update(
+    {
+        Relation(relation): ClassifierMode(mode)
+        for relation, mode in json.loads(
+            os.environ.get("LLM_CLASSIFIER_MODES", "{}")
+        ).items()
+    }
+)
+
+
+class ExampleLog:
+    """
+    LLM decisions with the texts they were made on, and the embeddings of those texts.
+
+    Lives in the decision store's SQLite file. Embeddings are stored as float16, with the decision when the
+    caller has them, and otherwise by the training job.
+    """
+
+    def __init__(self, path: str = DECISIONS_PATH) -> None:
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS examples (relation TEXT NOT NULL, anchor_id TEXT NOT NULL, candidate_id TEXT NOT NULL, anchor_text TEXT NOT NULL, candidate_text TEXT NOT NULL, decision INTEGER NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (relation, anchor_id, candidate_id))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS example_embeddings (text_hash TEXT PRIMARY KEY, embedding BLOB NOT NULL)"
+        )
+        self._connection.commit()
+
+    def record(
+        self,
+        relation: Relation,
+        anchor: EmbeddableGraphNode,
+        decisions: Sequence[Tuple[EmbeddableGraphNode, bool]],
+        embeddings: Optional[Dict[str, List[float]]] = None,
+    ) -> None:
+        """
+        embeddings are the embeddings of the anchor and candidate texts, by text.
+        """
+        now = time.time()
+        rows = [
+            (
+                relation.value,
+                anchor.id,
+                candidate.id,
+                anchor.text,
+                candidate.text,
+                int(decision),
+                now,
+            )
+            for candidate, decision in decisions
+        ]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO examples (relation, anchor_id, candidate_id, anchor_text, candidate_text, decision, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._connection.commit()
+        if embeddings is not None:
+            self.store_embeddings(embeddings)
+
+    def examples(self, relation: Relation) -> List[Tuple[str, str, bool]]:
+        """
+        Returns (anchor text, candidate text, decision) for every logged decision of the relation.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT anchor_text, candidate_text, decision FROM examples WHERE relation = ? ORDER BY created_at",
+                (relation.value,),
+            ).fetchall()
+        return [(row[0], row[1], bool(row[2])) for row in rows]
+
+    def embeddings(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns the stored embeddings of the texts that have one, by text.
+        """
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for text in set(texts):
+                row = self._connection.execute(
+                    "SELECT embedding FROM example_embeddings WHERE text_hash = ?",
+                    (hash_texts(text, ""),),
+                ).fetchone()
+                if row is not None:
+                    found[text] = np.frombuffer(row[0], dtype=np.float16).astype(
+                        np.float32
+                    )
+        return found
+
+    def store_embeddings(self, embeddings: Dict[str, List[float]]) -> None:
+        rows = [
+            (hash_texts(text, ""), np.asarray(embedding, dtype=np.float16).tobytes())
+            for text, embedding in embeddings.items()
+        ]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO example_embeddings (text_hash, embedding) VALUES (?, ?)",
+                rows,
+            )
+            self._connection.commit()
+
+
+_example_log: Optional[ExampleLog] = None
+
+
+def get_example_log() -> Optional[ExampleLog]:
+    """
+    Gets the log shared by the worker process, or None if the SQLite file can't be opened.
+    """
+    global _example_log
+    if _example_log is None:
+        try:
+            _example_log = ExampleLog()
+        except sqlite3.Error as e:
+            logging.warning(
+                f"Could not open example log at {DECISIONS_PATH}: {e}. Not logging examples."
+            )
+            return None
+    return _example_log
+
+
+def pair_features(anchor: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    Features of (anchor, candidate) embedding pairs: elementwise product, absolute difference, and cosine.
+
+    anchor has shape (dimension,) or (n, dimension), candidates (n, dimension). Returns (n, 2 * dimension + 1).
+    """
+    product = anchor * candidates
+    return np.hstack(
+        [
+            product,
+            np.abs(anchor - candidates),
+            product.sum(axis=1, keepdims=True),
+        ]
+    ).astype(np.float32)
+
+
+def sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+
+class ConnectionClassifier:
+    """
+    Logistic regression over pair_features, with the statistics it was validated on.
+
+    agreement is the share of held out LLM decisions it reproduced at a 0.5 cut-off. thresholds are the
+    probabilities above and below which prescreen mode decides locally.
+    """
+
+    def __init__(
+        self,
+        weights: np.ndarray,
+        bias: float,
+        mean: np.ndarray,
+        std: np.ndarray,
+        agreement: float,
+        thresholds: CascadeThresholds,
+        examples: int,
+    ) -> None:
+        self.weights = weights
+        self.bias = bias
+        self.mean = mean
+        self.std = std
+        self.agreement = agreement
+        self.thresholds = thresholds
+        self.examples = examples
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        return sigmoid(((features - self.mean) / self.std) @ self.weights + self.bias)
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            mean=self.mean,
+            std=self.std,
+            agreement=self.agreement,
+            low=self.thresholds.low,
+            high=self.thresholds.high,
+            examples=self.examples,
+        )
+
+    @staticmethod
+    def load(path: str) -> "ConnectionClassifier":
+        with np.load(path) as data:
+            return ConnectionClassifier(
+                weights=data["weights"],
+                bias=float(data["bias"]),
+                mean=data["mean"],
+                std=data["std"],
+                agreement=float(data["agreement"]),
+                thresholds=CascadeThresholds(
+                    low=float(data["low"]), high=float(data["high"])
+                ),
+                examples=int(data["examples"]),
+            )
+
+
+def train_logistic_regression(
+    features: np.ndarray,
+    labels: np.ndarray,
+    l2: float = 1e-2,
+    learning_rate: float = 0.5,
+    epochs: int = 300,
+) -> Tuple[np.ndarray, float, np.ndarray, np.ndarray]:
+    """
+    Fits L2 regularised logistic regression with full batch gradient descent on standardised features.
+
+    Returns (weights, bias, mean, std).
+    """
+    mean = features.mean(axis=0)
+    std = features.std(axis=0) + 1e-6
+    standardised = (features - mean) / std
+    weights = np.zeros(features.shape[1], dtype=np.float32)
+    bias = 0.0
+    for _ in range(epochs):
+        error = sigmoid(standardised @ weights + bias) - labels
+        weights -= learning_rate * (standardised.T @ error / len(labels) + l2 * weights)
+        bias -= learning_rate * float(error.mean())
+    return weights, bias, mean, std
+
+
+def classifier_path(relation: Relation) -> str:
+    return os.path.join(CLASSIFIERS_DIR, f"{relation.value}.npz")
+
+
+_classifiers: Dict[Relation, Optional[ConnectionClassifier]] = {}
+_classifiers_lock = threading.Lock()
+
+
+def get_classifier(relation: Relation) -> Optional[ConnectionClassifier]:
+    """
+    Gets the relation's classifier if one was trained and it agrees with the LLM often enough.
+    """
+    with _classifiers_lock:
+        if relation not in _classifiers:
+            classifier = None
+            path = classifier_path(relation)
+            if os.path.exists(path):
+                classifier = ConnectionClassifier.load(path)
+                if classifier.agreement < MIN_AGREEMENT:
+                    logging.info(
+                        f"{relation.value}: classifier agreement {classifier.agreement:.3f} is below {MIN_AGREEMENT}. Not using it."
+                    )
+                    classifier = None
+            _classifiers[relation] = classifier
+        return _classifiers[relation]
+
+
+def infer_with_classifier(
+    relation: Relation,
+    anchor: EmbeddableGraphNode,
+    candidates: List[Candidate],
+    infer: Callable[[List[Candidate]], List[Candidate]],
+    embed: Optional[Callable[[List[Any]], List[List[float]]]] = None,
+) -> List[Candidate]:
+    """
+    Decides candidates with the relation's classifier where its mode allows, and sends the rest to infer.
+
+    embed gets the embeddings of nodes of one type, e.g. Storage.embed_nodes, which reads the stored ones.
+    Without it the classifier isn't used, and examples are logged without embeddings.
+
+    infer receives the remaining candidates and returns the related subset. Its decisions are logged as
+    training examples. Returns the related candidates in their original order.
+    """
+    mode = CLASSIFIER_MODES[relation]
+    classifier = (
+        get_classifier(relation)
+        if mode != ClassifierMode.OFF and embed is not None
+        else None
+    )
+
+    embeddings: Dict[str, List[float]] = {}
+
+    def embed_pairs(nodes: List[Candidate]) -> None:
+        if embed is None:
+            return
+        if anchor.id not in embeddings:
+            embeddings[anchor.id] = embed([anchor])[0]
+        missing = [node for node in nodes if node.id not in embeddings]
+        if len(missing) > 0:
+            embeddings.update(zip([node.id for node in missing], embed(missing)))
+
+    decided: Dict[str, bool] = {}
+    if classifier is not None:
+        embed_pairs(candidates)
+        probabilities = classifier.predict_proba(
+            pair_features(
+                np.asarray(embeddings[anchor.id], dtype=np.float32),
+                np.asarray(
+                    [embeddings[candidate.id] for candidate in candidates],
+                    dtype=np.float32,
+                ),
+            )
+        )
+        for candidate, probability in zip(candidates, probabilities):
+            if mode == ClassifierMode.REPLACE:
+                decided[candidate.id] = bool(probability >= 0.5)
+            else:
+                decision = classifier.thresholds.decide(float(probability))
+                if decision is not None:
+                    decided[candidate.id] = decision
+        logging.info(
+            f"{relation.value}: classifier decided {len(decided)} of {len(candidates)} candidates."
+        )
+
+    remaining = [candidate for candidate in candidates if candidate.id not in decided]
+    if len(remaining) > 0:
+        related_ids = {candidate.id for candidate in infer(remaining)}
+        for candidate in remaining:
+            decided[candidate.id] = candidate.id in related_ids
+        example_log = get_example_log()
+        if example_log is not None:
+            embed_pairs(remaining)
+            example_log.record(
+                relation,
+                anchor,
+                [(candidate, decided[candidate.id]) for candidate in remaining],
+                embeddings=(
+                    {
+                        node.text: embeddings[node.id]
+                        for node in [anchor, *remaining]
+                        if node.id in embeddings
+                    }
+                    if embed is not None
+                    else None
+                ),
+            )
+
+    return [candidate for candidate in candidates if decided[candidate.id]]
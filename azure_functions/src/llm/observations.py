@@ -1,16 +1,21 @@
-from typing import List
-import openai
-from src.llm.utils import unpack_function_call_arguments
+import logging
+from typing import Any, Dict, Iterator, List
+from src.llm.client import create_chat_completion, stream_chat_completion
+from src.llm.utils import unpack_function_call_arguments, stream_function_call_array
+from src.llm.concurrency import iter_batches_in_background, map_concurrently
+from src.llm.prompts import (
+    deduplicate,
+    normalize_for_deduplication,
+    split_into_chunks,
+)
+from src.llm.registry import PromptTemplate, register
 from src.data.observations import Observation
 
-
-def generate_observations(text: str) -> list[Observation]:
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        messages=[
-            {
-                "role": "system",
-                "content": """
+GENERATE_OBSERVATIONS_PROMPT = register(
+    PromptTemplate(
+        name="generate_observations",
+        version=1,
+        system="""
                 You are an expert in customer service. Your task is to interpret customer's reviews, feedback, and conversations with us to infer facts about their experience. 
                 
                 For example, if a customer says "A fun Greek spot for a quick bite -- located right on Divisadero, it looks a bit hole-in-the-wall but has a lovely back patio with heaters. You order at the front and they give you a number, so it's a fast-casual vibe. The staff are very sweet and helpful, too. There aren't large tables, so would recommend going with a smaller group. The food is fresh and healthy, with a selection of salads and gyros! The real star of the show is dessert. The gryo is a little hard to eat IMHO -- I got the white sweet potato and ended up just using a fork and knife, and I didn't think the flavor was anything too memorable. The fries are SO good -- crispy on the outside, soft on the inside. My absolute favorite thing was the Baklava Crumbles on the frozen Greek yoghurt -- literally... FIRE. The yoghurt is tart and the baklava is sweet and I am obsessed. I'd come back for that alone.",
@@ -18,34 +23,91 @@ def generate_observations(text: str) -> list[Observation]:
                 You would identify: ["The customer visited our location on Divisadero.", "The exterior of the restaurant may seem modest or unassuming, as described as 'hole-in-the-wall'.", "The restaurant has a back patio equipped with heaters.", "The ordering system is more casual, with customers placing orders at the front and given a number to wait for their food.", "The staff of the restaurant made a positive impression on the customer, being described as 'sweet' and 'helpful'.", "The restaurant is not suitable for larger groups due to the lack of large tables.", "The food offered is fresh and healthy, including options like salads and gyros.", "The customer found the gyro hard to eat and not particularly flavorful, specifically mentioning a white sweet potato gyro.", "The restaurant serves high-quality fries that are crispy on the outside and soft on the inside.", "The restaurant offers a dessert option that involves Baklava Crumbles on frozen Greek yogurt.", "The customer was highly impressed with the Baklava Crumbles on frozen Greek yogurt, describing it as 'FIRE' and expressing an eagerness to revisit the restaurant for this dessert.", "The customer found the combination of tart yogurt and sweet baklava to be very satisfying."]
 
                 The goal is to infer observations from customers' experiences.""",
-            },
-            {
-                "role": "user",
-                "content": f"What can we infer here: {text}",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_interpretation",
-                "description": "Used to report interpretations to the system.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "observations": {
-                            "type": "array",
-                            "description": "A list of interpretations.",
-                            "items": {"type": "string"},
-                        },
+        user="What can we infer here: {text}",
+        function={
+            "name": "report_interpretation",
+            "description": "Used to report interpretations to the system.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "observations": {
+                        "type": "array",
+                        "description": "A list of interpretations.",
+                        "items": {"type": "string"},
                     },
                 },
-                "required": ["observations"],
-            }
-        ],
-        function_call={"name": "report_interpretation"},
+            },
+            "required": ["observations"],
+        },
     )
+)
+
+
+def observations_request(text: str) -> Dict[str, Any]:
+    """
+    The chat completion arguments for inferring observations from a feedback item's text.
+    """
+    return GENERATE_OBSERVATIONS_PROMPT.render(text=text)
+
+
+def generate_observations(text: str) -> list[Observation]:
+    """
+    Infers observations from a feedback item's text.
+
+    Feedback too long for one request is split into chunks that are processed in parallel. Their
+    observations are merged, dropping duplicates.
+    """
+    chunks = split_into_chunks(text)
+    if len(chunks) > 1:
+        logging.info(
+            f"Feedback is too long for one request. Inferring observations from {len(chunks)} chunks."
+        )
+        texts = [
+            observation.text
+            for observations in map_concurrently(generate_observations, chunks)
+            for observation in observations
+        ]
+        return [Observation(text=text) for text in deduplicate(texts)]
+
+    response = create_chat_completion(**observations_request(text))
 
     list_of_observation_texts: List[str] = unpack_function_call_arguments(response)["observations"]  # type: ignore
     list_of_observations: List[Observation] = []
     for observation_text in list_of_observation_texts:
         list_of_observations.append(Observation(text=observation_text))
     return list_of_observations
+
+
+def stream_chunk_observations(chunk: str) -> Iterator[Observation]:
+    """
+    Yields each observation inferred from one chunk of a feedback item's text as soon as the model has
+    finished writing it.
+    """
+    response_chunks = stream_chat_completion(**observations_request(chunk))
+    for observation_text in stream_function_call_array(response_chunks, "observations"):
+        yield Observation(text=str(observation_text))
+
+
+def observation_streams(text: str) -> List[Iterator[Observation]]:
+    """
+    One observation stream per chunk of a feedback item's text, for consuming them side by side (see
+    iter_batches_in_background). Observations of different chunks may be duplicates.
+    """
+    return [stream_chunk_observations(chunk) for chunk in split_into_chunks(text)]
+
+
+def generate_observations_stream(text: str) -> Iterator[Observation]:
+    """
+    Same as generate_observations, but yields each observation as soon as the model has finished writing it.
+
+    Chunks of long feedback are streamed in parallel in the shared pool, so this must not be consumed from a
+    task in the pool.
+    """
+    seen = set()
+    for batch in iter_batches_in_background(*observation_streams(text)):
+        for observation in batch:
+            key = normalize_for_deduplication(observation.text)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield observation
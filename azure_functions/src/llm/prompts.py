@@ -0,0 +1,178 @@
+"""
+Helpers for building prompts within a token budget.
+
+Tokens are counted with tiktoken when it is installed, and estimated at about 4 characters per token
+otherwise. Numbered candidate lists are kept within a budget by shortening the longest items, so every
+candidate keeps its index. Feedback quoted as context is truncated, and feedback too long to extract
+observations from in one request is split into chunks.
+"""
+
+import logging
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+# Context window per chat model, in tokens
+CONTEXT_WINDOWS: Dict[str, int] = {
+    "gpt-3.5-turbo-0613": 4096,
+    "gpt-3.5-turbo-16k-0613": 16384,
+}
+FALLBACK_CONTEXT_WINDOW = 4096
+
+# Budgets, in tokens
+FEEDBACK_CONTEXT_TOKENS = 1200  # A feedback item quoted as context
+LIST_TOKENS = 1000  # One numbered list of candidates or observations
+MIN_ITEM_TOKENS = 24  # Items are never shortened below this
+FEEDBACK_CHUNK_TOKENS = 1500  # Longer feedback is split before extracting observations
+
+CHARS_PER_TOKEN = 4
+# Tokens the chat format adds per message
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATION_MARKER = "..."
+
+_encoding: Optional[Any] = None
+
+
+def get_encoding() -> Optional[Any]:
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text))
+
+
+def count_request_tokens(kwargs: Dict[str, Any]) -> int:
+    """
+    Prompt tokens of a chat completion request: its messages and function definitions.
+    """
+    tokens = 0
+    for message in kwargs.get("messages", []):
+        tokens += MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content") or "")
+    if kwargs.get("functions"):
+        tokens += count_tokens(str(kwargs["functions"]))
+    return tokens
+
+
+def context_window(model: str) -> int:
+    return CONTEXT_WINDOWS.get(model, FALLBACK_CONTEXT_WINDOW)
+
+
+def head(text: str, tokens: int) -> str:
+    """
+    The first tokens tokens of text.
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return text[: tokens * CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text)[:tokens])
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cuts text down to at most max_tokens, marking the cut.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(max_tokens - count_tokens(TRUNCATION_MARKER), 0)
+    return head(text, keep).rstrip() + TRUNCATION_MARKER
+
+
+def item_token_limit(lengths: Sequence[int], budget: int) -> Optional[int]:
+    """
+    The largest per item limit that keeps the items within budget, or None if they already fit.
+
+    Items shorter than the limit keep their length, so the budget they don't use goes to the longer ones.
+    """
+    if sum(lengths) <= budget:
+        return None
+    remaining_budget = budget
+    remaining_items = len(lengths)
+    for length in sorted(lengths):
+        share = remaining_budget // remaining_items
+        if length > share:
+            return max(share, MIN_ITEM_TOKENS)
+        remaining_budget -= length
+        remaining_items -= 1
+    return None
+
+
+def numbered_list(texts: Sequence[str], max_tokens: int = LIST_TOKENS) -> str:
+    """
+    Formats texts as "0. text" lines, shortening the longest ones so the list fits in max_tokens.
+
+    Every text keeps its index, so responses can refer to items by position.
+    """
+    limit = item_token_limit([count_tokens(text) for text in texts], max_tokens)
+    if limit is not None:
+        logging.info(
+            f"Shortening list items to {limit} tokens to fit {len(texts)} items in {max_tokens} tokens."
+        )
+        texts = [truncate_to_tokens(text, limit) for text in texts]
+    return "".join(f"{i}. {text}\n" for i, text in enumerate(texts))
+
+
+def feedback_context(text: str) -> str:
+    """
+    A feedback item's text, cut down to the budget for quoting it as context.
+    """
+    return truncate_to_tokens(text, FEEDBACK_CONTEXT_TOKENS)
+
+
+def split_into_chunks(text: str, max_tokens: int = FEEDBACK_CHUNK_TOKENS) -> List[str]:
+    """
+    Splits text into chunks of at most max_tokens, between sentences where possible.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for sentence in re.split(r"(?<=[.!?])\s+|\n+", text):
+        if sentence.strip() == "":
+            continue
+        sentence_tokens = count_tokens(sentence)
+        # A single sentence over the limit is cut into pieces
+        while sentence_tokens > max_tokens:
+            piece = head(sentence, max_tokens)
+            chunks.append(piece)
+            sentence = sentence[len(piece) :]
+            sentence_tokens = count_tokens(sentence)
+        if sentence_tokens == 0:
+            continue
+        if current_tokens + sentence_tokens > max_tokens and len(current) > 0:
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += sentence_tokens + 1
+    if len(current) > 0:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def normalize_for_deduplication(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def deduplicate(texts: Sequence[str]) -> List[str]:
+    """
+    Drops texts that only differ from an earlier one in case, punctuation or whitespace.
+    """
+    seen = set()
+    unique: List[str] = []
+    for text in texts:
+        key = normalize_for_deduplication(text)
+        if key not in seen:
+            seen.add(key)
+            unique.append(text)
+    return unique
@@ -0,0 +1,292 @@
+"""
+LLM providers that src.llm.client sends requests to.
+
+OpenAIProvider calls the API. StubProvider answers offline and deterministically with schema-valid
+function calls and hash-based pseudo-embeddings, with configurable simulated latency. It lets us profile
+storage, vector, and concurrency behaviour without network access, cost, or model latency. Its requests go
+through the client's rate limits and concurrency limit like real ones, unless STUB_LLM_RATE_LIMITED=false.
+
+Select one with LLM_PROVIDER=openai (default) or LLM_PROVIDER=stub, or call set_provider.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import openai
+
+
+class LLMProvider:
+    """
+    Interface for chat completions and embeddings, with the request and response shapes of the OpenAI API.
+    """
+
+    # Whether requests go through the client's rate limits and retries
+    rate_limited = True
+
+    def chat_completion(self, **kwargs: Any) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def chat_completion_stream(self, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the chunks of a streamed chat completion, each with a "delta" instead of a "message".
+        """
+        raise NotImplementedError
+
+    def embedding(self, **kwargs: Any) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class OpenAIProvider(LLMProvider):
+    def chat_completion(self, **kwargs: Any) -> Dict[str, Any]:
+        return openai.ChatCompletion.create(**kwargs)  # type: ignore
+
+    def chat_completion_stream(self, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        return openai.ChatCompletion.create(stream=True, **kwargs)  # type: ignore
+
+    def embedding(self, **kwargs: Any) -> Dict[str, Any]:
+        return openai.Embedding.create(**kwargs)  # type: ignore
+
+
+def seeded_random(*parts: Any) -> random.Random:
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def numbered_list_lengths(text: str) -> List[int]:
+    """
+    Lengths of the "0. ..." style numbered lists in a prompt, which is how src.llm lists candidates.
+    """
+    lengths: List[int] = []
+    for number in re.findall(r"^\s*(\d+)\. ", text, flags=re.M):
+        if number == "0" or len(lengths) == 0:
+            lengths.append(0)
+        lengths[-1] += 1
+    return lengths
+
+
+# Characters of content or function call arguments per streamed chunk from the stub
+STREAM_CHUNK_CHARS = 8
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic offline provider.
+
+    Chat completions call the requested function with arguments generated from its JSON schema. The outer
+    array gets one element per item of the prompt's last numbered list, so answers line up with the candidates.
+    Embeddings sum a pseudo-random vector per word, so texts sharing words are similar.
+    """
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        latency_jitter_seconds: float = 0.0,
+        dimension: int = 1536,
+        rate_limited: bool = True,
+    ) -> None:
+        self.rate_limited = rate_limited
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.dimension = dimension
+
+    def _latency(self, rng: random.Random) -> float:
+        return self.latency_seconds + rng.uniform(0, self.latency_jitter_seconds)
+
+    def _generate(
+        self,
+        schema: Dict[str, Any],
+        rng: random.Random,
+        item_count: int,
+        id_range: int,
+        words: List[str],
+        index: int = 0,
+        nested: bool = False,
+    ) -> Any:
+        """
+        Generates a value for the schema.
+
+        The outer array has item_count elements (random if 0), integer "*_id" properties are the element's
+        index, and other integers without bounds are below id_range so they can be used as indices. Strings
+        are sampled from words, so generated texts overlap with the prompt like real answers do.
+        """
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        schema_type = schema.get("type")
+        if schema_type == "object":
+            values: Dict[str, Any] = {}
+            for name, property_schema in schema.get("properties", {}).items():
+                if name.endswith("_id") and property_schema.get("type") == "integer":
+                    values[name] = index
+                else:
+                    values[name] = self._generate(
+                        property_schema, rng, item_count, id_range, words, index, nested
+                    )
+            return values
+        if schema_type == "array":
+            if nested:
+                length = rng.randint(0, min(id_range, 3))
+            elif item_count > 0:
+                length = item_count
+            else:
+                length = rng.randint(1, 5)
+            return [
+                self._generate(
+                    schema.get("items", {}), rng, item_count, id_range, words, i, True
+                )
+                for i in range(length)
+            ]
+        if schema_type == "boolean":
+            return rng.random() < 0.5
+        if schema_type == "integer":
+            if "minimum" in schema or "maximum" in schema or id_range == 0:
+                return rng.randint(schema.get("minimum", 0), schema.get("maximum", 100))
+            return rng.randrange(id_range)
+        if schema_type == "number":
+            return rng.uniform(schema.get("minimum", 0.0), schema.get("maximum", 1.0))
+        if len(words) == 0:
+            return f"Stub text {rng.getrandbits(32):08x}."
+        return " ".join(rng.choice(words) for _ in range(rng.randint(6, 16))) + "."
+
+    def _complete(self, kwargs: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        """
+        Returns the response to a chat completion request, and how long it should take.
+        """
+        messages: List[Dict[str, str]] = kwargs.get("messages", [])
+        functions: List[Dict[str, Any]] = kwargs.get("functions", [])
+        function_call: Optional[Dict[str, str]] = kwargs.get("function_call")
+        rng = seeded_random(kwargs.get("model"), messages, functions, function_call)
+        latency = self._latency(rng)
+
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        if len(functions) > 0:
+            function = functions[0]
+            if isinstance(function_call, dict):
+                function = next(
+                    f for f in functions if f["name"] == function_call["name"]
+                )
+            # Answers are about the last list in the prompt, e.g. the candidates, and may refer to any list
+            last_content = messages[-1]["content"] if len(messages) > 0 else ""
+            lengths = numbered_list_lengths(last_content) or [0]
+            words = re.findall(r"[A-Za-z']+", last_content)
+            arguments = self._generate(
+                function["parameters"], rng, lengths[-1], min(lengths), words
+            )
+            message["function_call"] = {
+                "name": function["name"],
+                "arguments": json.dumps(arguments),
+            }
+        else:
+            message["content"] = f"Stub response {rng.getrandbits(32):08x}."
+
+        prompt_tokens = len(json.dumps(messages)) // 4
+        completion_tokens = len(json.dumps(message)) // 4
+        response = {
+            "object": "chat.completion",
+            "model": kwargs.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        return response, latency
+
+    def chat_completion(self, **kwargs: Any) -> Dict[str, Any]:
+        response, latency = self._complete(kwargs)
+        time.sleep(latency)
+        return response
+
+    def chat_completion_stream(self, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Streams the same response chat_completion would give, in small chunks spread over the latency.
+        """
+        response, latency = self._complete(kwargs)
+        message = response["choices"][0]["message"]
+        function_call = message.get("function_call")
+        text = function_call["arguments"] if function_call else message["content"]
+        fragments = [
+            text[start : start + STREAM_CHUNK_CHARS]
+            for start in range(0, len(text), STREAM_CHUNK_CHARS)
+        ]
+
+        for i, fragment in enumerate(fragments):
+            time.sleep(latency / max(len(fragments), 1))
+            if function_call:
+                delta: Dict[str, Any] = {"function_call": {"arguments": fragment}}
+                if i == 0:
+                    delta["role"] = "assistant"
+                    delta["function_call"]["name"] = function_call["name"]
+            else:
+                delta = {"content": fragment}
+            yield {
+                "object": "chat.completion.chunk",
+                "model": response["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+        yield {
+            "object": "chat.completion.chunk",
+            "model": response["model"],
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+
+    def pseudo_embedding(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.sha256(word.encode("utf-8")).digest()
+            word_rng = np.random.default_rng(int.from_bytes(digest[:8], "big"))
+            vector += word_rng.standard_normal(self.dimension)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embedding(self, **kwargs: Any) -> Dict[str, Any]:
+        texts = kwargs.get("input", "")
+        if isinstance(texts, str):
+            texts = [texts]
+        time.sleep(self._latency(seeded_random(kwargs.get("model"), texts)))
+        return {
+            "object": "list",
+            "model": kwargs.get("model"),
+            "data": [
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": self.pseudo_embedding(text),
+                }
+                for i, text in enumerate(texts)
+            ],
+            "usage": {"total_tokens": sum(len(text) for text in texts) // 4},
+        }
+
+
+_provider: Optional[LLMProvider] = None
+
+
+def get_provider() -> LLMProvider:
+    global _provider
+    if _provider is None:
+        if os.environ.get("LLM_PROVIDER", "openai") == "stub":
+            _provider = StubProvider(
+                latency_seconds=float(os.environ.get("STUB_LLM_LATENCY_SECONDS", "0")),
+                latency_jitter_seconds=float(
+                    os.environ.get("STUB_LLM_LATENCY_JITTER_SECONDS", "0")
+                ),
+                rate_limited=os.environ.get("STUB_LLM_RATE_LIMITED", "true").lower()
+                != "false",
+            )
+        else:
+            _provider = OpenAIProvider()
+    return _provider
+
+
+def set_provider(provider: LLMProvider) -> None:
+    global _provider
+    _provider = provider
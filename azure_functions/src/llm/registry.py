@@ -0,0 +1,155 @@
+"""
+Registry of the prompt templates and function schemas sent to the LLM.
+
+Each template is compiled once, when the module declaring it is imported: its function schema is
+serialised, its static token count (everything but the filled in fields) is counted, and it gets a
+fingerprint. Templates are identified by a versioned key, e.g. "observation_to_topics@v1", which labels
+token usage metrics and stamps response cache keys. Bump the version when a prompt's meaning changes.
+
+Print every template's static size with: python -m src.llm.registry
+"""
+
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from src.llm.prompts import count_request_tokens
+
+DEFAULT_MODEL = "gpt-3.5-turbo-0613"
+
+FIELD_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+class PromptTemplate:
+    """
+    A system and user message with {field} placeholders, and the function the model must call.
+
+    The function schema may also contain placeholders. Schemas without any are reused as is on every render.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        version: int,
+        system: str,
+        user: str,
+        function: Dict[str, Any],
+        model: str = DEFAULT_MODEL,
+        temperature: Optional[float] = None,
+    ) -> None:
+        self.name = name
+        self.version = version
+        self.key = f"{name}@v{version}"
+        self.system = system
+        self.user = user
+        self.function = function
+        self.model = model
+        self.temperature = temperature
+
+        self.function_json = json.dumps(function, sort_keys=True)
+        self.dynamic_function = FIELD_PATTERN.search(self.function_json) is not None
+        self.fields = sorted(
+            set(FIELD_PATTERN.findall(system + user + self.function_json))
+        )
+        self.static_tokens = count_request_tokens(
+            {
+                "messages": [
+                    {"role": "system", "content": FIELD_PATTERN.sub("", system)},
+                    {"role": "user", "content": FIELD_PATTERN.sub("", user)},
+                ],
+                "functions": [function],
+            }
+        )
+        self.fingerprint = hashlib.sha256(
+            json.dumps(
+                [self.key, model, temperature, system, user, self.function_json]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def _fill(self, text: str, fields: Dict[str, str]) -> str:
+        return FIELD_PATTERN.sub(lambda match: fields[match.group(1)], text)
+
+    def render(self, **fields: str) -> Dict[str, Any]:
+        """
+        Returns the arguments for create_chat_completion (or cached_chat_completion).
+        """
+        missing = set(self.fields) - set(fields)
+        if len(missing) > 0:
+            raise ValueError(f"{self.key} is missing fields: {sorted(missing)}")
+
+        function = self.function
+        if self.dynamic_function:
+            # Escape the values as JSON string contents, since they are filled into serialised JSON
+            escaped = {name: json.dumps(value)[1:-1] for name, value in fields.items()}
+            function = json.loads(self._fill(self.function_json, escaped))
+
+        kwargs: Dict[str, Any] = dict(
+            label=self.key,
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self._fill(self.system, fields)},
+                {"role": "user", "content": self._fill(self.user, fields)},
+            ],
+            functions=[function],
+            function_call={"name": function["name"]},
+        )
+        if self.temperature is not None:
+            kwargs["temperature"] = self.temperature
+        return kwargs
+
+
+REGISTRY: Dict[str, PromptTemplate] = {}
+
+
+def register(template: PromptTemplate) -> PromptTemplate:
+    existing = REGISTRY.get(template.key)
+    if existing is not None and existing.fingerprint != template.fingerprint:
+        raise ValueError(
+            f"{template.key} is already registered with different content. Bump its version."
+        )
+    REGISTRY[template.key] = template
+    return template
+
+
+def get_template(key: Optional[str]) -> Optional[PromptTemplate]:
+    if key is None:
+        return None
+    return REGISTRY.get(key)
+
+
+def sizes() -> List[Dict[str, Any]]:
+    """
+    Static token count and schema size of every registered template, largest first.
+    """
+    return sorted(
+        [
+            {
+                "key": template.key,
+                "static_tokens": template.static_tokens,
+                "function_json_chars": len(template.function_json),
+                "fields": template.fields,
+            }
+            for template in REGISTRY.values()
+        ],
+        key=lambda size: size["static_tokens"],
+        reverse=True,
+    )
+
+
+def main() -> None:
+    # Importing the modules registers their templates
+    import src.llm.action_items  # noqa: F401
+    import src.llm.connections  # noqa: F401
+    import src.llm.observations  # noqa: F401
+    import src.llm.scores  # noqa: F401
+    import src.llm.topics  # noqa: F401
+
+    for size in sizes():
+        print(
+            f"{size['key']:<64} {size['static_tokens']:>6} tokens {size['function_json_chars']:>6} schema chars  fields: {', '.join(size['fields'])}"
+        )
+
+
+if __name__ == "__main__":
+    main()
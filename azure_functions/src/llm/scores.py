@@ -1,10 +1,14 @@
-import openai
+import logging
+from src.llm.client import create_chat_completion
 from enum import Enum
 from typing import List, Dict, Any, Tuple
 from src.data.scores import Score, ScoreNames
 from pydantic import BaseModel
 
 from src.llm.utils import unpack_function_call_arguments
+from src.llm.concurrency import map_concurrently
+from src.llm.prompts import feedback_context, numbered_list
+from src.llm.registry import PromptTemplate, register
 
 
 class ScoreConfig(BaseModel):
@@ -85,47 +89,109 @@ def generate_score_properties_and_required(
     return (properties, required)
 
 
-def score_observation(
-    observation: str, feedback_item: str, score_types: List[ScoreType]
-) -> List[Score]:
-    model_name = "gpt-3.5-turbo-0613"
-
-    messages = [
-        {
-            "role": "system",
-            "content": "You are an expert in customer service. Your task is to report a score.",
-        },
-        {
-            "role": "user",
-            "content": f"""Here is a customer's complete feedback:\n{feedback_item}\n\nFrom this feedback, we have the following observation:\n{observation}\n\nFrom that observation, report the customer's scores on a continuous scale.""",
-        },
-    ]
+def compile_score_prompts(
+    score_types: Tuple[ScoreType, ...],
+) -> Tuple[PromptTemplate, PromptTemplate]:
+    """
+    Compiles the prompts for scoring one observation and for scoring a batch of observations with the score types provided.
+    """
+    properties, required = generate_score_properties_and_required(list(score_types))
+    suffix = "+".join(score_type.value.var_name for score_type in score_types)
 
-    properties, required = generate_score_properties_and_required(score_types)
+    single = register(
+        PromptTemplate(
+            name=f"score_observation[{suffix}]",
+            version=1,
+            system="You are an expert in customer service. Your task is to report a score.",
+            user="Here is a customer's complete feedback:\n{feedback}\n\nFrom this feedback, we have the following observation:\n{observation}\n\nFrom that observation, report the customer's scores on a continuous scale.",
+            function={
+                "name": "report_scores",
+                "description": "Used to report the requested scores.",
+                "parameters": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": required,
+                },
+            },
+        )
+    )
 
-    functions = [
-        {
-            "name": "report_scores",
-            "description": "Used to report the requested scores.",
-            "parameters": {
-                "type": "object",
-                "properties": properties,
-                "required": required,
+    batch = register(
+        PromptTemplate(
+            name=f"score_observations[{suffix}]",
+            version=1,
+            system="You are an expert in customer service. Your task is to report scores.",
+            user="Here is a customer's complete feedback:\n{feedback}\n\nFrom this feedback, we have the following observations:\n{numbered_observations}\nFor each observation, report the customer's scores on a continuous scale.",
+            function={
+                "name": "report_scores",
+                "description": "Used to report the requested scores for every observation.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "scores": {
+                            "type": "array",
+                            "description": "One object per observation, in the same order as the observations.",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "observation_id": {
+                                        "type": "integer",
+                                        "description": "The number of the observation. For example: 0",
+                                    },
+                                    **properties,
+                                },
+                                "required": ["observation_id"] + required,
+                            },
+                        }
+                    },
+                    "required": ["scores"],
+                },
             },
-        }
-    ]
+        )
+    )
+
+    return (single, batch)
+
 
-    function_call = {"name": "report_scores"}
+_score_prompts: Dict[Tuple[ScoreType, ...], Tuple[PromptTemplate, PromptTemplate]] = {}
 
-    response = openai.ChatCompletion.create(  # type: ignore
-        model=model_name,
-        messages=messages,
-        functions=functions,
-        function_call=function_call,
+
+def get_score_prompts(
+    score_types: List[ScoreType],
+) -> Tuple[PromptTemplate, PromptTemplate]:
+    """
+    Gets the compiled (single, batch) scoring prompts for the score types, compiling them on first use.
+    """
+    key = tuple(score_types)
+    if key not in _score_prompts:
+        _score_prompts[key] = compile_score_prompts(key)
+    return _score_prompts[key]
+
+
+# Every score type is what the handlers ask for
+get_score_prompts(list(ScoreType))
+
+
+def score_observation(
+    observation: str, feedback_item: str, score_types: List[ScoreType]
+) -> List[Score]:
+    prompt, _ = get_score_prompts(score_types)
+
+    response = create_chat_completion(
+        **prompt.render(
+            feedback=feedback_context(feedback_item), observation=observation
+        )
     )
 
     result = unpack_function_call_arguments(response)  # type: ignore
 
+    return unpack_scores(result, score_types)
+
+
+def unpack_scores(result: Dict[str, Any], score_types: List[ScoreType]) -> List[Score]:
+    """
+    Converts the reported score fields of a single observation into Score objects.
+    """
     scores: List[Score] = []
     for score_type in score_types:
         score = Score(
@@ -136,3 +202,92 @@ def score_observation(
         scores.append(score)
 
     return scores
+
+
+def validate_batch_scores(
+    results: Any, observation_count: int, score_types: List[ScoreType]
+) -> bool:
+    """
+    Checks that a batch response has exactly one complete, in range score object per observation.
+    """
+    if not isinstance(results, list) or len(results) != observation_count:  # type: ignore
+        return False
+
+    observation_ids = set()
+    for result in results:  # type: ignore
+        if not isinstance(result, dict):
+            return False
+        observation_ids.add(result.get("observation_id"))  # type: ignore
+        for score_type in score_types:
+            score = result.get(f"{score_type.value.var_name}_score")  # type: ignore
+            if isinstance(score, bool) or not isinstance(score, (int, float)):
+                return False
+            if not score_type.value.range_min <= score <= score_type.value.range_max:
+                return False
+            if not isinstance(result.get(f"{score_type.value.var_name}_explanation"), str):  # type: ignore
+                return False
+
+    return observation_ids == set(range(observation_count))
+
+
+def score_observations_request(
+    observations: List[str], feedback_item: str, score_types: List[ScoreType]
+) -> Dict[str, Any]:
+    """
+    The chat completion arguments for scoring every observation of a feedback item in a single request.
+    """
+    _, prompt = get_score_prompts(score_types)
+    return prompt.render(
+        feedback=feedback_context(feedback_item),
+        numbered_observations=numbered_list(observations),
+    )
+
+
+def unpack_batch_scores(
+    response: Any,
+    observations: List[str],
+    feedback_item: str,
+    score_types: List[ScoreType],
+) -> List[List[Score]]:
+    """
+    Returns the scores of each observation, in order, from a response to score_observations_request.
+
+    Falls back to one score_observation call per observation if the response doesn't have exactly one valid result per observation.
+    """
+    try:
+        results = unpack_function_call_arguments(response).get("scores")  # type: ignore
+    except (ValueError, KeyError):
+        results = None  # No function call, or its arguments were not valid JSON
+
+    if not validate_batch_scores(results, len(observations), score_types):
+        logging.warning(
+            f"Batch scoring didn't return one valid result for each of the {len(observations)} observations. Scoring them one by one."
+        )
+        return map_concurrently(
+            lambda observation: score_observation(  # type: ignore
+                observation, feedback_item, score_types
+            ),
+            observations,
+        )
+
+    results_by_id = {result["observation_id"]: result for result in results}  # type: ignore
+    return [
+        unpack_scores(results_by_id[i], score_types) for i in range(len(observations))
+    ]
+
+
+def score_observations(
+    observations: List[str], feedback_item: str, score_types: List[ScoreType]
+) -> List[List[Score]]:
+    """
+    Scores every observation of a feedback item in a single request. Returns the scores of each observation, in order.
+
+    Falls back to one score_observation call per observation if the response doesn't have exactly one valid result per observation.
+    """
+    if len(observations) == 0:
+        return []
+
+    response = create_chat_completion(
+        **score_observations_request(observations, feedback_item, score_types)
+    )
+    return unpack_batch_scores(response, observations, feedback_item, score_types)
@@ -1,58 +1,60 @@
-import openai
-from typing import List
+from src.llm.client import create_chat_completion
+from typing import Any, Dict, List
 from src.data import Topic, Observation
 
 from src.llm.utils import unpack_function_call_arguments
+from src.llm.prompts import feedback_context, numbered_list
+from src.llm.registry import PromptTemplate, register
 
+GENERATE_TOPICS_PROMPT = register(
+    PromptTemplate(
+        name="generate_topics",
+        version=1,
+        system="You are an expert in customer service. Your task is to interpret customer's reviews, feedback, and conversations with us to infer topics that are being discussed. ",
+        user="Here is a customer's feedback:\n\n{feedback}\n\nFrom this feedback, we have the following observations:\n\n{numbered_observations}\n\nHere are the existing topics identified from other feedback items:\n\n{numbered_existing_topics}\n\nWhat topics do we need to add? Don't add topics if the existing topics already reasonably cover the feedback and its observations. When you do decide to add a topic, make sure the topic is neutral. For example, 'The service was super quick!!' is about the 'Speed of Service'",
+        function={
+            "name": "report_topics",
+            "description": "This function is used to add more topics to the list. It accepts an array of topics as strings.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "topics": {
+                        "type": "array",
+                        "description": "A list of topics. For example: ['Checkout process.', 'Payment options.', 'Outdoor Patio.']",
+                        "items": {"type": "string"},
+                    }
+                },
+                "required": ["topics"],
+            },
+        },
+    )
+)
 
-def generate_topics(
+
+def generate_topics_request(
     feedback_item: str,
     observations: List[Observation],
     existing_topics: List[Topic],
-) -> List[Topic]:
+) -> Dict[str, Any]:
     """
-    Given a feedback item, a list of observations, and a list of existing topics, return a list of new topics to add.
+    The chat completion arguments for generate_topics.
     """
-    numbered_observations = ""
-    for i, observation in enumerate(observations):
-        numbered_observations += f"{i}. {observation.text}\n"
-
-    numbered_existing_topics = ""
-    for i, topic_text in enumerate(existing_topics):
-        numbered_existing_topics += f"{i}. {topic_text.text}\n"
-
-    response = openai.ChatCompletion.create(  # type: ignore
-        model="gpt-3.5-turbo-0613",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an expert in customer service. Your task is to interpret customer's reviews, feedback, and conversations with us to infer topics that are being discussed. ",
-            },
-            {
-                "role": "user",
-                "content": f"Here is a customer's feedback:\n\n{feedback_item}\n\nFrom this feedback, we have the following observations:\n\n{numbered_observations}\n\nHere are the existing topics identified from other feedback items:\n\n{numbered_existing_topics}\n\nWhat topics do we need to add? Don't add topics if the existing topics already reasonably cover the feedback and its observations. When you do decide to add a topic, make sure the topic is neutral. For example, 'The service was super quick!!' is about the 'Speed of Service'",
-            },
-        ],
-        functions=[
-            {
-                "name": "report_topics",
-                "description": "This function is used to add more topics to the list. It accepts an array of topics as strings.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "topics": {
-                            "type": "array",
-                            "description": "A list of topics. For example: ['Checkout process.', 'Payment options.', 'Outdoor Patio.']",
-                            "items": {"type": "string"},
-                        }
-                    },
-                    "required": ["topics"],
-                },
-            },
-        ],
-        function_call={"name": "report_topics"},
+    numbered_observations = numbered_list(
+        [observation.text for observation in observations]
     )
 
+    numbered_existing_topics = numbered_list(
+        [topic_text.text for topic_text in existing_topics]
+    )
+
+    return GENERATE_TOPICS_PROMPT.render(
+        feedback=feedback_context(feedback_item),
+        numbered_observations=numbered_observations,
+        numbered_existing_topics=numbered_existing_topics,
+    )
+
+
+def unpack_topics(response: Any) -> List[Topic]:
     new_topics_text: List[str] = unpack_function_call_arguments(response)["topics"]  # type: ignore
 
     new_topics: List[Topic] = []
@@ -61,3 +63,17 @@ def generate_topics(
         new_topics.append(topic)
 
     return new_topics  # type: ignore
+
+
+def generate_topics(
+    feedback_item: str,
+    observations: List[Observation],
+    existing_topics: List[Topic],
+) -> List[Topic]:
+    """
+    Given a feedback item, a list of observations, and a list of existing topics, return a list of new topics to add.
+    """
+    response = create_chat_completion(
+        **generate_topics_request(feedback_item, observations, existing_topics)
+    )
+    return unpack_topics(response)
@@ -1,7 +1,8 @@
-import openai
+from src.llm.client import create_embedding, Priority
 import re
 import json
-from typing import Dict, Any, List
+import logging
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 
 
 def fix_trailing_commas(json_str: str) -> str:
@@ -27,7 +28,168 @@ def unpack_function_call_arguments(response: Any) -> Dict[str, Any]:
     return arguments
 
 
+def parse_json_tolerantly(json_str: str) -> Any:
+    """
+    Parses JSON, fixing trailing commas and a string or containers left open by a cut off response.
+
+    Raises ValueError if it still can't be parsed.
+    """
+    try:
+        return json.loads(json_str)
+    except ValueError:
+        pass
+
+    json_str = fix_trailing_commas(json_str)
+    closers = ""
+    in_string = False
+    escaped = False
+    for character in json_str:
+        if escaped:
+            escaped = False
+        elif character == "\\":
+            escaped = in_string
+        elif character == '"':
+            in_string = not in_string
+        elif not in_string and character in "[{":
+            closers = ("]" if character == "[" else "}") + closers
+        elif not in_string and character in "]}":
+            closers = closers[1:]
+    if in_string:
+        json_str += '"'
+    return json.loads(fix_trailing_commas(json_str + closers))
+
+
+class StreamingArrayParser:
+    """
+    Incrementally extracts the elements of the array under key from a JSON object that arrives in fragments.
+
+    feed returns each element as soon as it is complete. If the arguments never take the expected shape,
+    close falls back to parsing everything received, so elements are never lost.
+    """
+
+    def __init__(self, key: str) -> None:
+        self.key_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self.key = key
+        self.buffer = ""
+        self.position = 0  # Next character to scan
+        self.element_start: Optional[int] = None  # Set once inside the array
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.finished = False
+        self.emitted = 0
+
+    def _parse_element(self, element: str) -> List[Any]:
+        element = element.strip()
+        if element == "":
+            return []
+        try:
+            value = parse_json_tolerantly(element)
+        except ValueError:
+            logging.warning(f"Skipping unparsable streamed element: {element}")
+            return []
+        self.emitted += 1
+        return [value]
+
+    def feed(self, fragment: str) -> List[Any]:
+        self.buffer += fragment
+        if self.finished:
+            return []
+
+        if self.element_start is None:
+            match = self.key_pattern.search(self.buffer)
+            if match is None:
+                return []
+            self.element_start = self.position = match.end()
+
+        elements: List[Any] = []
+        while self.position < len(self.buffer):
+            character = self.buffer[self.position]
+            if self.escaped:
+                self.escaped = False
+            elif self.in_string:
+                if character == "\\":
+                    self.escaped = True
+                elif character == '"':
+                    self.in_string = False
+            elif character == '"':
+                self.in_string = True
+            elif character in "[{":
+                self.depth += 1
+            elif character in "]}" and self.depth > 0:
+                self.depth -= 1
+            elif character in ",]" and self.depth == 0:
+                elements += self._parse_element(
+                    self.buffer[self.element_start : self.position]
+                )
+                self.element_start = self.position + 1
+                if character == "]":
+                    self.finished = True
+                    self.position += 1
+                    break
+            self.position += 1
+        return elements
+
+    def close(self) -> List[Any]:
+        """
+        Returns whatever elements can still be recovered once the stream has ended.
+        """
+        if self.finished:
+            return []
+        if self.element_start is not None:
+            return self._parse_element(self.buffer[self.element_start :])
+        if self.emitted == 0:
+            try:
+                value = parse_json_tolerantly(self.buffer).get(self.key, [])
+            except (ValueError, AttributeError):
+                value = None
+            if isinstance(value, list):
+                return value
+            logging.warning(f"Could not parse streamed arguments: {self.buffer}")
+        return []
+
+
+def iter_function_call_fragments(chunks: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """
+    Yields the function call argument fragments of a streamed chat completion.
+    """
+    for chunk in chunks:
+        choices = chunk.get("choices") or []
+        if len(choices) == 0:
+            continue
+        function_call = choices[0].get("delta", {}).get("function_call") or {}
+        fragment = function_call.get("arguments")
+        if fragment:
+            yield fragment
+
+
+def stream_function_call_array(
+    chunks: Iterable[Dict[str, Any]], key: str
+) -> Iterator[Any]:
+    """
+    Yields the elements of the array argument key of a streamed function call, each as soon as it is complete.
+    """
+    parser = StreamingArrayParser(key)
+    for fragment in iter_function_call_fragments(chunks):
+        yield from parser.feed(fragment)
+    yield from parser.close()
+
+
 def generate_embedding(text: str) -> List[float]:
-    response = openai.Embedding.create(input=text, model="text-embedding-ada-002")  # type: ignore
+    response = create_embedding(input=text, model="text-embedding-ada-002")  # type: ignore
     embeddings = response["data"][0]["embedding"]  # type: ignore
     return embeddings  # type: ignore
+
+
+def generate_embeddings(
+    texts: List[str], batch_size: int = 100, priority: Priority = Priority.NORMAL
+) -> List[List[float]]:
+    """
+    Embed multiple texts, sending up to batch_size texts per request. Embeddings are returned in input order.
+    """
+    embeddings: List[List[float]] = []
+    for start in range(0, len(texts), batch_size):
+        response = create_embedding(priority=priority, input=texts[start : start + batch_size], model="text-embedding-ada-002")  # type: ignore
+        data = sorted(response["data"], key=lambda item: item["index"])  # type: ignore
+        embeddings.extend([item["embedding"] for item in data])  # type: ignore
+    return embeddings
@@ -0,0 +1,509 @@
+"""
+The stages HandleFeedbackItemChange runs a feedback item through:
+
+1. observations: generates the observations, scores them, flags the ones needing action, and stores them.
+2. action_items: generates new action items for the observations needing action, and stores them.
+3. topics: generates new topics, and stores the ones that don't already exist.
+4. connections: connects the observations to the action items and topics found for the feedback item and
+   generated by the run.
+
+Each stage records what it generated in a FeedbackItemCheckpoint before writing it, so a retry stores the
+same nodes again instead of generating new ones (writes skip nodes that already exist). The handler keeps
+the checkpoint on its ledger entry (see Storage.open_ledger_entry), and src.jobs.rerun_stage runs single
+stages for a batch of feedback items.
+
+Long feedback items can be fanned out (see should_fan_out): HandleFeedbackItemChange only generates the
+observations, and sends one message per observation to HandleObservationScoring, which scores and stores
+it. Each of those records its completion as a ledger entry under the feedback item's. The one that finds
+every observation done, and claims the join, runs the remaining stages.
+
+The nodes a run stores are tagged with its ledger entry (see Storage.origin_run), and their change messages
+come back through GraphChangeRouter. The run already holds what their handlers would search for, so:
+- HandleObservationChange skips the run's observations, which the connections stage connects (see
+  connects_observation). Later writes to them only update their flags, and are skipped unless they raise
+  the needs_action flag (see is_flag_update).
+- HandleTopicChange and HandleActionItemChange leave out candidates from the same run as the changed node.
+  The connections stage decides observations against the run's topics and action items, and
+  HandleTopicChange decides the run's topics against its action items.
+"""
+
+import logging
+import os
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from pydantic import BaseModel
+
+from src.data import ActionItem, FeedbackItem, LedgerEntry, Observation, Topic
+from src.data.ledger import document_property
+from src.data.scores import Score
+from src.storage import Storage
+from src.vector.cutoff import SimilaritySource
+from src.llm.action_items import flag_needs_action, generate_action_items
+from src.llm.concurrency import iter_batches_in_background, map_concurrently, submit
+from src.llm.connections import (
+    infer_observation_to_action_items_connections,
+    infer_observation_to_topics_connections,
+)
+from src.llm.observations import generate_observations_stream, observation_streams
+from src.llm.prompts import normalize_for_deduplication
+from src.llm.scores import ScoreType, score_observations
+from src.llm.topics import generate_topics
+
+OBSERVATIONS = "observations"
+ACTION_ITEMS = "action_items"
+TOPICS = "topics"
+CONNECTIONS = "connections"
+STAGES = [OBSERVATIONS, ACTION_ITEMS, TOPICS, CONNECTIONS]
+
+# Feedback items at least this long have their observations scored and stored by HandleObservationScoring,
+# one message per observation, instead of all in one invocation. Unset, nothing is fanned out.
+FAN_OUT_MIN_CHARACTERS: Optional[int] = (
+    int(os.environ["FAN_OUT_MIN_CHARACTERS"])
+    if "FAN_OUT_MIN_CHARACTERS" in os.environ
+    else None
+)
+
+SCORE_TYPES = [
+    ScoreType.SATISFACTION,
+    ScoreType.SPECIFICITY,
+    ScoreType.BUSINESS_IMPACT,
+]
+
+# How the connections stage connects an observation: the inference, the edges to add, and the candidates
+ConnectionTask = Tuple[
+    Callable[..., List[Any]],
+    Callable[..., None],
+    Observation,
+    Tuple[List[Any], List[float]],
+]
+
+
+class FeedbackItemCheckpoint(BaseModel):
+    """
+    What the stages generated for a feedback item. action_items and topics are None until generated.
+    """
+
+    observations: List[Observation] = []
+    scores: Dict[str, List[Score]] = {}
+    stored_observation_ids: List[str] = []
+    action_items: Optional[List[ActionItem]] = None
+    topics: Optional[List[Topic]] = None
+    # The existing action items and topics found for the feedback item, which generation was shown
+    action_item_candidates: Optional[List[ActionItem]] = None
+    topic_candidates: Optional[List[Topic]] = None
+    # The topics stored for the generated ones, which are existing topics where they matched
+    stored_topics: List[Topic] = []
+
+    @classmethod
+    def from_json(cls, data: str) -> "FeedbackItemCheckpoint":
+        if data == "":
+            return cls()
+        return cls.model_validate_json(data)
+
+
+class FeedbackItemPipeline:
+    def __init__(
+        self,
+        storage: Storage,
+        feedback_item: FeedbackItem,
+        checkpoint: Optional[FeedbackItemCheckpoint] = None,
+        on_checkpoint: Optional[Callable[[FeedbackItemCheckpoint], None]] = None,
+    ) -> None:
+        self.storage = storage
+        self.feedback_item = feedback_item
+        self.checkpoint = checkpoint or FeedbackItemCheckpoint()
+        self.on_checkpoint = on_checkpoint
+
+    def save(self) -> None:
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self.checkpoint)
+
+    def store_observations(self, observations: List[Observation]) -> None:
+        """
+        Stores observations and their scores. The ids are only saved with the next checkpoint, as storing them
+        again is harmless.
+        """
+        for observation in observations:
+            self.storage.add_observation_for_feedback_item(
+                observation, self.feedback_item
+            )
+            for score in self.checkpoint.scores.get(observation.id, []):
+                self.storage.add_score(observation, score)
+        self.checkpoint.stored_observation_ids.extend(
+            observation.id for observation in observations
+        )
+
+    def score_observations(self, observations: List[Observation]) -> None:
+        """
+        Scores observations into the checkpoint, and flags the ones needing action.
+        """
+        logging.info(f"DATAPOINTS: Scoring {len(observations)} Observations")
+        scores_per_observation = score_observations(
+            [observation.text for observation in observations],
+            self.feedback_item.text,
+            SCORE_TYPES,
+        )
+        for observation, scores in zip(observations, scores_per_observation):
+            # Flagged before storing, so the flag is written with the node and its embedding
+            flag_needs_action(observation, scores)
+            self.checkpoint.scores[observation.id] = scores
+
+    def add_observations(self) -> List[Observation]:
+        """
+        Generates, scores and stores observations. Observations already in the checkpoint are stored again if
+        their write may not have finished, and generated observations with the same text are dropped.
+
+        Observations are scored and stored while the rest are still being generated, with the chunks of long
+        feedback generated in parallel (see observation_streams). Each batch holds the observations that
+        arrived while the previous one was scored, and is checkpointed once, before it is stored.
+        """
+        stored = set(self.checkpoint.stored_observation_ids)
+        unstored = [
+            observation
+            for observation in self.checkpoint.observations
+            if observation.id not in stored
+        ]
+        if len(unstored) > 0:
+            logging.info(
+                f"DATAPOINTS: Storing {len(unstored)} checkpointed Observations"
+            )
+            self.store_observations(unstored)
+
+        known_texts = {
+            normalize_for_deduplication(observation.text)
+            for observation in self.checkpoint.observations
+        }
+        new_observations: List[Observation] = []
+        for batch in iter_batches_in_background(
+            *observation_streams(self.feedback_item.text)
+        ):
+            batch = [
+                observation
+                for observation in batch
+                if normalize_for_deduplication(observation.text) not in known_texts
+            ]
+            if len(batch) == 0:
+                continue
+            known_texts.update(
+                normalize_for_deduplication(observation.text) for observation in batch
+            )
+
+            self.score_observations(batch)
+            self.checkpoint.observations.extend(batch)
+            self.save()
+
+            logging.info("DATAPOINTS: Adding to Storage")
+            self.store_observations(batch)
+            new_observations.extend(batch)
+        return new_observations
+
+    def extract_observations(self) -> List[Observation]:
+        """
+        Generates observations into the checkpoint without scoring or storing them, for fanning them out (see
+        should_fan_out). Generated observations with the same text as one in the checkpoint are dropped.
+        """
+        known_texts = {
+            normalize_for_deduplication(observation.text)
+            for observation in self.checkpoint.observations
+        }
+        for observation in generate_observations_stream(self.feedback_item.text):
+            text = normalize_for_deduplication(observation.text)
+            if text not in known_texts:
+                known_texts.add(text)
+                self.checkpoint.observations.append(observation)
+        self.save()
+        return self.checkpoint.observations
+
+    def search_action_items(self) -> Tuple[List[ActionItem], List[float]]:
+        """
+        Only depends on the feedback item, so it can run while observations are generated.
+        """
+        return self.storage.search_semantically(  # type: ignore
+            search_for=ActionItem,
+            from_text=self.feedback_item.text,
+            top_k=10,
+            min_score=0.0,
+        )
+
+    def add_action_items(
+        self,
+        action_items_search: Optional[
+            "Future[Tuple[List[ActionItem], List[float]]]"
+        ] = None,
+    ) -> List[ActionItem]:
+        """
+        Generates new action items for the observations needing action, unless the checkpoint has them, and
+        stores them.
+        """
+        if self.checkpoint.action_items is None:
+            if action_items_search is not None:
+                existing_action_items, scores = action_items_search.result()
+            else:
+                existing_action_items, scores = self.search_action_items()
+            self.checkpoint.action_item_candidates = existing_action_items
+            observations_requiring_actions = [
+                observation
+                for observation in self.checkpoint.observations
+                if self.storage.observation_needs_action(observation)
+            ]
+            self.checkpoint.action_items = generate_action_items(
+                self.feedback_item.text,
+                observations_requiring_actions,
+                existing_action_items,
+            )
+            self.save()
+
+        for action_item in self.checkpoint.action_items:
+            self.storage.add_action_item(action_item)
+        logging.info(
+            f"Feedback Item {self.feedback_item.text}\n\nNew Action Items: {[action_item.text for action_item in self.checkpoint.action_items]}\n\n"
+        )
+        return self.checkpoint.action_items
+
+    def search_topics(self) -> List[Topic]:
+        existing_topics, scores = self.storage.search_semantically(
+            search_for=Topic, from_text=self.feedback_item.text, top_k=10, min_score=0.0
+        )
+        return existing_topics
+
+    def generate_topics(self) -> Tuple[List[Topic], List[Topic]]:
+        """
+        Searches for existing topics and generates new ones. Only depends on the observations, not their
+        scores, so it can run alongside action item generation. Returns the existing and the new topics.
+        """
+        existing_topics = self.search_topics()
+        return existing_topics, generate_topics(
+            self.feedback_item.text, self.checkpoint.observations, existing_topics
+        )
+
+    def add_topics(
+        self,
+        topics_generation: Optional["Future[Tuple[List[Topic], List[Topic]]]"] = None,
+    ) -> List[Topic]:
+        """
+        Generates new topics, unless the checkpoint has them, and stores them. Returns the topics added, as
+        topics that already exist are reused.
+        """
+        if self.checkpoint.topics is None:
+            if topics_generation is not None:
+                existing_topics, new_topics = topics_generation.result()
+            else:
+                existing_topics, new_topics = self.generate_topics()
+            self.checkpoint.topic_candidates = existing_topics
+            self.checkpoint.topics = new_topics
+            self.save()
+
+        stored_topics = [
+            self.storage.find_or_add_topic(new_topic)
+            for new_topic in self.checkpoint.topics
+        ]
+        self.checkpoint.stored_topics = stored_topics
+        self.save()
+        added_topics = [
+            stored
+            for new, stored in zip(self.checkpoint.topics, stored_topics)
+            if stored is new
+        ]
+        logging.info(
+            f"Feedback Item {self.feedback_item.text}\n\nNew Topics: {[new_topic.text for new_topic in added_topics]}\n\n"
+        )
+        return added_topics
+
+    def connect_observations(self) -> int:
+        """
+        Connects the observations to the existing action items and topics found for the feedback item or for
+        any of its observations, and to the ones stored for it. The search per observation finds what a
+        search for the whole feedback item ranks too low, e.g. in long feedback about several subjects. Each
+        observation's candidates are ranked from their stored embeddings (see Storage.rank_candidates).
+        Returns the number of observations connected to anything.
+        """
+        if self.checkpoint.action_item_candidates is None:
+            self.checkpoint.action_item_candidates, _ = self.search_action_items()
+        if self.checkpoint.topic_candidates is None:
+            self.checkpoint.topic_candidates = self.search_topics()
+
+        observations = self.checkpoint.observations
+        needs_action = self.storage.observations_need_action(observations)
+        acting = [
+            observation for observation in observations if needs_action[observation.id]
+        ]
+        action_items_found = self.storage.search_semantically_many(
+            search_for=ActionItem,
+            embeddings=self.storage.embed_nodes(acting),
+            top_k=10,
+            min_score=0.0,
+            adaptive=True,
+        )
+        topics_found = self.storage.search_topics_many(
+            observations, top_k=10, min_score=0.0, adaptive=True
+        )
+        action_items = unique_by_id(
+            self.checkpoint.action_item_candidates
+            + (self.checkpoint.action_items or [])
+            + [action_item for found, _ in action_items_found for action_item in found]
+        )
+        topics = unique_by_id(
+            self.checkpoint.topic_candidates
+            + self.checkpoint.stored_topics
+            + [topic for found, _ in topics_found for topic in found]
+        )
+        logging.info(
+            f"CONNECTIONS: Ranking {len(action_items)} action items for {len(acting)} observations and {len(topics)} topics for {len(observations)}"
+        )
+        tasks: List[ConnectionTask] = [
+            (
+                infer_observation_to_action_items_connections,
+                self.storage.add_observation_to_action_items_edges,
+                observation,
+                matches,
+            )
+            for observation, matches in zip(
+                acting,
+                self.storage.rank_candidates(
+                    acting, action_items, top_k=10, min_score=0.0, adaptive=True
+                ),
+            )
+        ] + [
+            (
+                infer_observation_to_topics_connections,
+                self.storage.add_observation_to_topics_edges,
+                observation,
+                matches,
+            )
+            for observation, matches in zip(
+                observations,
+                self.storage.rank_candidates(
+                    observations, topics, top_k=10, min_score=0.0, adaptive=True
+                ),
+            )
+        ]
+
+        def connect(task: ConnectionTask) -> Optional[str]:
+            infer, add_edges, observation, (candidates, similarities) = task
+            if len(candidates) == 0:
+                return None
+            related = infer(
+                observation,
+                candidates,
+                similarities=similarities,
+                embed=self.storage.embed_nodes,
+                source=SimilaritySource.RANKED,
+            )
+            add_edges(observation, related)
+            return observation.id if len(related) > 0 else None
+
+        connected = map_concurrently(connect, tasks)
+        return len({id for id in connected if id is not None})
+
+
+NodeVar = TypeVar("NodeVar", ActionItem, Topic)
+
+
+def unique_by_id(nodes: Sequence[NodeVar]) -> List[NodeVar]:
+    unique: Dict[str, NodeVar] = {}
+    for node in nodes:
+        unique.setdefault(node.id, node)
+    return list(unique.values())
+
+
+def connects_observation(run: LedgerEntry, body: Dict[str, Any]) -> bool:
+    """
+    Whether the run that stored an observation connects it, so the observation's change message is skipped.
+    True until the run completes, since the run's own message resumes its unfinished stages if it is
+    redelivered, and afterwards for writes made before it completed. Later writes only change the
+    observation's flags, e.g. from src.jobs.rethreshold, and are handled as flag updates (see is_flag_update).
+    """
+    if not run.completed:
+        return True
+    written_at = body.get("_ts")
+    return written_at is None or float(written_at) <= run.updated_at
+
+
+def is_flag_update(body: Dict[str, Any]) -> bool:
+    """
+    Whether a change message is about a write of only an observation's flags (see
+    Storage.update_observation_flags). The observation was connected when it was stored, so the change
+    handlers only connect it to action items again, and only if the write raised its needs_action flag.
+    """
+    return document_property(body, "flags_updated_at") is not None
+
+
+def raises_needs_action(body: Dict[str, Any]) -> bool:
+    """
+    Whether a flag update turned the observation's needs_action flag from False to True.
+    """
+    return document_property(body, "needs_action_raised") is True
+
+
+def from_other_runs(
+    node: Any, candidates: List[Any], similarities: List[float]
+) -> Tuple[List[Any], List[float]]:
+    """
+    Leaves out the candidates stored by the same run as node, whose connection the run or another handler
+    decides (see the module docstring).
+    """
+    if node.origin_run is None:
+        return candidates, similarities
+    kept = [
+        (candidate, similarity)
+        for candidate, similarity in zip(candidates, similarities)
+        if candidate.origin_run != node.origin_run
+    ]
+    if len(kept) < len(candidates):
+        logging.info(
+            f"Left out {len(candidates) - len(kept)} candidates from the run that stored {node.id}."
+        )
+    return [candidate for candidate, _ in kept], [similarity for _, similarity in kept]
+
+
+def should_fan_out(feedback_item: FeedbackItem) -> bool:
+    return FAN_OUT_MIN_CHARACTERS is not None and (
+        len(feedback_item.text) >= FAN_OUT_MIN_CHARACTERS
+    )
+
+
+def scoring_message(ledger: LedgerEntry, observation: Observation) -> Dict[str, Any]:
+    """
+    The message HandleObservationScoring scores and stores one fanned out observation from.
+    """
+    return {
+        "feedback_item_id": ledger.node_id,
+        "ledger_id": ledger.id,
+        "observation": observation.model_dump(mode="json"),
+    }
+
+
+def run_remaining_stages(
+    storage: Storage,
+    ledger: LedgerEntry,
+    pipeline: FeedbackItemPipeline,
+    action_items_search: Optional[
+        "Future[Tuple[List[ActionItem], List[float]]]"
+    ] = None,
+) -> None:
+    """
+    Runs the action_items, topics and connections stages the ledger entry doesn't have yet, with topic
+    generation alongside action item generation, and completes the entry.
+    """
+    topics_generation = None
+    if not ledger.is_done(TOPICS) and pipeline.checkpoint.topics is None:
+        logging.info("TOPICS: Generating new topics alongside action items")
+        topics_generation = submit(pipeline.generate_topics)
+
+    if not ledger.is_done(ACTION_ITEMS):
+        logging.info("ACTIONITEMS: Generating new action items and adding to storage")
+        pipeline.add_action_items(action_items_search)
+        storage.complete_stage(ledger, ACTION_ITEMS)
+
+    if not ledger.is_done(TOPICS):
+        logging.info("TOPICS: Adding new topics to storage")
+        pipeline.add_topics(topics_generation)
+        storage.complete_stage(ledger, TOPICS)
+
+    if not ledger.is_done(CONNECTIONS):
+        logging.info("CONNECTIONS: Connecting observations to action items and topics")
+        pipeline.connect_observations()
+        storage.complete_stage(ledger, CONNECTIONS)
+
+    storage.complete_ledger_entry(ledger)
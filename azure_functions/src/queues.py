@@ -0,0 +1,59 @@
+"""
+Sends messages to the Service Bus queues from inside a handler.
+
+Output bindings send one message per invocation (see GraphChangeRouter), so handlers that fan out to a
+variable number of messages send them with this instead, before they return.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from azure.servicebus import ServiceBusClient, ServiceBusMessage  # type: ignore
+from azure.servicebus.exceptions import MessageSizeExceededError  # type: ignore
+
+OBSERVATION_SCORING_QUEUE = "observationscoringqueue"
+OBSERVATION_CHANGE_QUEUE = "observationchangequeue"
+ACTION_ITEM_CHANGE_QUEUE = "actionitemchangequeue"
+TOPIC_CHANGE_QUEUE = "topicchangequeue"
+
+
+def send_messages(
+    queue_name: str,
+    bodies: List[Dict[str, Any]],
+    message_ids: Optional[List[str]] = None,
+    delay_seconds: float = 0.0,
+) -> None:
+    """
+    Sends every body as its own message, in as few batches as fit. The messages can be given their ids, and
+    be scheduled to be delivered after a delay.
+    """
+    connection_string = os.environ.get("MESSAGE_QUEUE_CONNECTION")
+    if connection_string is None:
+        raise Exception("MESSAGE_QUEUE_CONNECTION is not set")
+
+    with ServiceBusClient.from_connection_string(connection_string) as client:
+        with client.get_queue_sender(queue_name) as sender:
+            batch = sender.create_message_batch()
+            scheduled_at = (
+                datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)
+                if delay_seconds > 0
+                else None
+            )
+            for i, body in enumerate(bodies):
+                message = ServiceBusMessage(
+                    json.dumps(body),
+                    message_id=message_ids[i] if message_ids is not None else None,
+                    scheduled_enqueue_time_utc=scheduled_at,
+                )
+                try:
+                    batch.add_message(message)
+                except MessageSizeExceededError:
+                    sender.send_messages(batch)
+                    batch = sender.create_message_batch()
+                    batch.add_message(message)
+            sender.send_messages(batch)
+
+    logging.info(f"Sent {len(bodies)} messages to {queue_name}.")
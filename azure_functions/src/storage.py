@@ -1,5 +1,16 @@
 from src.graph.connect import GraphConnection
+from src.graph.topic_index import (
+    DUPLICATE_TOPIC_SIMILARITY,
+    get_topic_index,
+    topic_key,
+)
 from src.vector.search import VectorStore, VectorEnv, Vector
+from src.vector.cutoff import SimilaritySource, adaptive_cutoff
+from src.vector.centroids import (
+    REFRESH_SECONDS,
+    TopicCentroidIndex,
+    get_centroid_index,
+)
 from src.data import (
     FeedbackItem,
     Review,
@@ -9,19 +20,36 @@ from src.data import (
     ActionItem,
     EmbeddableGraphNode,
     EmbeddableGraphNodeVar,
+    LedgerEntry,
 )
 from src.data.scores import Score, ScoreNames
+from src.data.observations import SCORE_FIELDS
 from src.data.edges import determine_edge_label
 
-from src.llm.utils import generate_embedding
+from src.llm.utils import generate_embedding, generate_embeddings
+from src.llm.client import Priority
+from src.llm.action_items import check_needs_action, flag_needs_action
+from src.llm.concurrency import map_concurrently
 
 
 from src.data import ListGraphNodes, GraphNode, GraphNodeVar
 
-from typing import List, Type, Union, Dict, Any, Tuple
+from typing import List, Type, Union, Dict, Any, Tuple, Iterator, Optional
 import logging
+import threading
+import time
+from collections import OrderedDict
 
+import numpy as np
 from enum import Enum
+from pydantic import BaseModel
+
+# Number of embeddings a Storage keeps of the nodes it last embedded, stored or fetched, so a node embedded or
+# searched for isn't fetched from the vectorstore again, e.g. by update_topic_centroids after search_topics
+EMBEDDING_CACHE_SIZE = 1000
+
+# Metadata filter that only lets observations needing action through (see Storage.vector_metadata)
+NEEDS_ACTION_FILTER: Dict[str, Any] = {"needs_action": {"$eq": True}}
 
 
 class AggregationMethod(Enum):
@@ -42,8 +70,13 @@ class Storage:
     This class should be initialized with a "with" statement, so that the connections are closed properly.
     """
 
+    # The ledger entry of the pipeline run the handler is doing, if any. Nodes added while it is set are tagged
+    # with it (see src.pipeline), so their change handlers can skip the work the run already did.
+    origin_run: Optional[str] = None
+
     def __init__(self):
-        pass
+        self._embeddings: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._embeddings_lock = threading.Lock()
 
     def __enter__(self):
         self.eventual_graph = GraphConnection()
@@ -57,7 +90,8 @@ class Storage:
         self.vectorstore.close()
 
     def _get_graph(self, node_type: type) -> GraphConnection:
-        if node_type == AppState:
+        # Ledger entries are read back right after being written, e.g. by a redelivered message
+        if node_type in (AppState, LedgerEntry):
             return self.strong_graph
         else:
             return self.eventual_graph
@@ -68,7 +102,26 @@ class Storage:
     def get_all_nodes_by_type(self, type: Type[GraphNodeVar]) -> List[GraphNodeVar]:
         return self._get_graph(type).get_all_nodes_by_type(type)
 
+    def get_nodes(self, ids: List[str], type: Type[GraphNodeVar]) -> List[GraphNodeVar]:
+        return self._get_graph(type).get_nodes(ids, type)
+
+    def get_existing_node_ids(self, ids: List[str], type: Type[GraphNode]) -> List[str]:
+        return self._get_graph(type).get_existing_node_ids(ids)
+
+    def stream_node_ids(
+        self,
+        type: Type[GraphNodeVar],
+        page_size: int = 1000,
+        without_edge: Optional[str] = None,
+        created_before: Optional[float] = None,
+    ) -> Iterator[List[str]]:
+        return self._get_graph(type).stream_node_ids(
+            type, page_size, without_edge, created_before
+        )
+
     def add_node(self, node: GraphNode):
+        if self.origin_run is not None and getattr(node, "origin_run", "") is None:
+            node.origin_run = self.origin_run  # type: ignore
         self._get_graph(type(node)).add_node(node)
 
     def add_nodes(self, nodes: ListGraphNodes):
@@ -146,6 +199,17 @@ class Storage:
         self.connect_nodes([feedback_item], [observation])
         self.embed_and_store(observation)
 
+    def get_feedback_item_observations(
+        self, feedback_item: FeedbackItem
+    ) -> List[Observation]:
+        """
+        Gets the observations derived from the feedback item.
+        """
+        observations = self.traverse(
+            feedback_item, determine_edge_label(FeedbackItem, Observation)
+        )
+        return observations  # type: ignore
+
     def get_observation_parent_feedback_item(
         self, observation: Observation
     ) -> FeedbackItem:
@@ -182,6 +246,91 @@ class Storage:
         self.add_node(score)
         self.connect_nodes([score], [node])
 
+    def get_observation_score_values(
+        self, ids: List[str]
+    ) -> List[Tuple[str, ScoreNames, float]]:
+        """
+        Gets (observation id, score name, score) for every score of multiple observations, in one query.
+        """
+        rows = self._get_graph(Observation).get_neighbor_properties(
+            ids, determine_edge_label(Observation, Score), ["name", "score"]
+        )
+        score_names = {name.value for name in ScoreNames}
+        return [
+            (row["id"], ScoreNames(row["name"]), float(row["score"]))
+            for row in rows
+            if row["name"] in score_names
+        ]
+
+    def get_observation_flags(self, ids: List[str]) -> Dict[str, Optional[bool]]:
+        """
+        Gets the needs_action flag of multiple observations, in one query. None for observations never flagged.
+        """
+        flags = self._get_graph(Observation).get_property_values(ids, "needs_action")
+        return {id: flags.get(id) for id in ids}
+
+    def observation_needs_action(self, observation: Observation) -> bool:
+        """
+        Uses the needs_action flag stored on the observation, and only checks its scores if it was never set.
+        """
+        if observation.needs_action is not None:
+            return observation.needs_action
+        return check_needs_action(self.get_observation_scores(observation))
+
+    def observations_need_action(
+        self, observations: List[Observation]
+    ) -> Dict[str, bool]:
+        """
+        Like observation_needs_action for multiple observations, reading the scores of the unflagged ones in
+        one query.
+        """
+        flags = {
+            observation.id: observation.needs_action
+            for observation in observations
+            if observation.needs_action is not None
+        }
+        unflagged = [
+            observation.id
+            for observation in observations
+            if observation.id not in flags
+        ]
+        scores: Dict[str, List[Score]] = {id: [] for id in unflagged}
+        for id, name, value in self.get_observation_score_values(unflagged):
+            scores[id].append(Score(name=name, score=value))
+        for id in unflagged:
+            flags[id] = check_needs_action(scores[id])
+        return flags  # type: ignore
+
+    def set_observation_scores(self, observation: Observation, scores: List[Score]):
+        """
+        Adds the scores of a stored observation, and updates its needs_action flag and raw score values in
+        both the graph and the vectorstore.
+        """
+        for score in scores:
+            self.add_score(observation, score)
+        previous_needs_action = observation.needs_action
+        flag_needs_action(observation, scores)
+        self.update_observation_flags(observation, previous_needs_action)
+
+    def update_observation_flags(
+        self, observation: Observation, previous_needs_action: Optional[bool] = None
+    ):
+        """
+        Writes the observation's needs_action flag and raw score values to the graph and the vectorstore.
+
+        The write is marked as a flag update, so the change handlers don't connect the observation again. They
+        only connect it to action items if the flag stored before, previous_needs_action, was False and the
+        new one is True (see src.pipeline.is_flag_update).
+        """
+        observation.flags_updated_at = time.time()
+        observation.needs_action_raised = (
+            previous_needs_action is False and observation.needs_action is True
+        )
+        self.update_node(observation)
+        self.vectorstore.update_metadata(
+            Observation.__name__, observation.id, self.vector_metadata(observation)
+        )
+
     def add_action_item(self, action_item: ActionItem):
         """
         Adds action item as a node. Doesn't add any edges. This is done in a separate method.
@@ -264,6 +413,8 @@ class Storage:
         feedback_item = self.get_observation_parent_feedback_item(observation)
         self.connect_nodes(topics, [feedback_item])
 
+        self.update_topic_centroids(topics, [observation])
+
     def add_topic_to_observations_edges(
         self, topic: Topic, observations: List[Observation]
     ):
@@ -285,6 +436,8 @@ class Storage:
             )
         self.connect_nodes([topic], feedback_items)
 
+        self.update_topic_centroids([topic], observations)
+
     def get_child_feedback_items_of_topic(self, topic: Topic) -> List[FeedbackItem]:
         """
         Gets the feedback items that the topic is a parent of.
@@ -292,6 +445,17 @@ class Storage:
         feedback_items = self.traverse(topic, determine_edge_label(Topic, FeedbackItem))
         return feedback_items  # type: ignore
 
+    def get_child_observation_ids_of_topics(
+        self, topic_ids: List[str]
+    ) -> List[Tuple[str, str]]:
+        """
+        Gets (topic id, observation id) for every observation of multiple topics, in one query.
+        """
+        pairs = self._get_graph(Topic).get_neighbor_ids(
+            topic_ids, determine_edge_label(Topic, Observation)
+        )
+        return [(topic_id, observation_id) for topic_id, observation_id in pairs]
+
     def get_child_observations_of_topic(self, topic: Topic) -> List[Observation]:
         """
         Gets the observations that the topic is a parent of.
@@ -318,12 +482,108 @@ class Storage:
         observations = self.get_child_observations_of_topic(topic)
         self.connect_nodes(action_items, observations)
 
+    def find_existing_topic(self, text: str) -> Optional[Topic]:
+        """
+        Finds a stored topic with the same normalised text (see src.graph.topic_index).
+        """
+        index = get_topic_index()
+        key = topic_key(text)
+        topic_id = index.lookup(key)
+        if topic_id is None:
+            return None
+        topics = self.get_nodes([topic_id], Topic)
+        if len(topics) == 0:
+            index.forget(key)  # The topic was merged or deleted since
+            return None
+        return topics[0]
+
+    def find_similar_topic(self, text: str, embedding: List[float]) -> Optional[Topic]:
+        """
+        Finds a stored topic whose embedding is nearly identical to the text's, and indexes the text under it.
+        """
+        matches = self.vectorstore.search_with_embedding(Topic, embedding, 1)
+        if len(matches) == 0 or matches[0]["score"] < DUPLICATE_TOPIC_SIMILARITY:
+            return None
+        topics = self.get_nodes([matches[0]["id"]], Topic)
+        if len(topics) == 0:
+            return None
+        get_topic_index().record(topic_key(text), topics[0].id)
+        return topics[0]
+
+    def find_similar_topics(
+        self, texts: List[str], priority: Priority = Priority.NORMAL
+    ) -> List[Optional[Topic]]:
+        """
+        Like find_similar_topic for multiple texts, embedded with one request and searched concurrently.
+        """
+        if len(texts) == 0:
+            return []
+        embeddings = generate_embeddings(texts, priority=priority)
+        return map_concurrently(
+            lambda item: self.find_similar_topic(*item), list(zip(texts, embeddings))
+        )
+
     def add_topic(self, topic: Topic):
         """
         Adds topic as a node. Doesn't add any edges. This is done in a separate method.
         """
         self.add_node(topic)
         self.embed_and_store(topic)
+        get_topic_index().record(topic_key(topic.text), topic.id)
+
+    def find_or_add_topic(self, topic: Topic) -> Topic:
+        """
+        Adds a generated topic like add_topic, unless a topic with the same normalised text or a nearly
+        identical embedding is already stored. Returns the stored topic, which is the existing one if there
+        was a match.
+        """
+        existing = self.find_existing_topic(topic.text)
+        if existing is None:
+            embedding = generate_embedding(topic.text)
+            existing = self.find_similar_topic(topic.text, embedding)
+        if existing is not None:
+            logging.info(
+                f"Topic '{topic.text}' already exists as '{existing.text}' ({existing.id})."
+            )
+            return existing
+
+        self.add_node(topic)
+        self.add_embeddings(Topic, [Vector(values=embedding, id=topic.id)])
+        get_topic_index().record(topic_key(topic.text), topic.id)
+        return topic
+
+    def merge_topics(self, canonical: Topic, duplicates: List[Topic]) -> int:
+        """
+        Moves the edges of duplicate topics to the canonical topic and deletes the duplicates and their
+        embeddings. Returns the number of edges moved.
+
+        Action items addressing the canonical topic are also connected to the observations and feedback
+        items it gains, as add_topic_to_action_items_edges would have.
+        """
+        ids = [duplicate.id for duplicate in duplicates]
+        graph = self._get_graph(Topic)
+        moved = 0
+        for neighbor_type in [Observation, FeedbackItem, ActionItem]:
+            moved += graph.copy_edges(
+                ids,
+                canonical.id,
+                determine_edge_label(Topic, neighbor_type),
+                determine_edge_label(neighbor_type, Topic),
+            )
+        action_items = self.traverse(canonical, determine_edge_label(Topic, ActionItem))
+        self.add_topic_to_action_items_edges(canonical, action_items)  # type: ignore
+        graph.delete_nodes(ids)
+        self.delete_embeddings(Topic, ids)
+
+        centroids = get_centroid_index()
+        if centroids is not None:
+            centroids.remove(ids)
+
+        # So the duplicates' texts keep resolving to the topic they were merged into
+        index = get_topic_index()
+        for duplicate in duplicates:
+            index.record(topic_key(duplicate.text), canonical.id)
+        return moved
 
     def get_feedback_item_source(self, feedback_item: FeedbackItem) -> Review:
         result = self.traverse(
@@ -335,6 +595,108 @@ class Storage:
             )
         return result[0]  # type: ignore
 
+    def open_ledger_entry(
+        self, handler: str, node_id: str, version: str = "", parent_id: str = ""
+    ) -> LedgerEntry:
+        """
+        Gets the ledger entry of a handler for a version of a node, adding it if this is the first delivery.
+        """
+        entry = LedgerEntry(
+            handler=handler, node_id=node_id, version=version, parent_id=parent_id
+        )
+        existing = self.get_nodes([entry.id], LedgerEntry)
+        if len(existing) > 0:
+            entry = existing[0]
+            if entry.completed:
+                logging.info(
+                    f"{handler} already processed {node_id} at version '{version}'."
+                )
+            else:
+                logging.info(
+                    f"{handler} resuming {node_id} at version '{version}' after stages: {entry.completed_stages or 'none'}."
+                )
+            return entry
+        graph = self._get_graph(LedgerEntry)
+        # Added by a concurrent delivery of the same message since it was read
+        if not graph.try_add_node(entry):
+            entry = graph.get_node(entry.id, LedgerEntry)
+        return entry
+
+    def complete_stage(self, entry: LedgerEntry, stage: str):
+        """
+        Records that a stage finished, so a redelivered message skips it.
+        """
+        entry.mark_done(stage)
+        self.update_node(entry)
+
+    def open_ledger_entries(
+        self, handler: str, keys: List[Tuple[str, str]]
+    ) -> List[LedgerEntry]:
+        """
+        Like open_ledger_entry for multiple (node id, version) pairs, reading the existing entries in one query.
+        """
+        entries = [
+            LedgerEntry(handler=handler, node_id=node_id, version=version)
+            for node_id, version in keys
+        ]
+        existing = {
+            entry.id: entry
+            for entry in self.get_nodes([entry.id for entry in entries], LedgerEntry)
+        }
+        graph = self._get_graph(LedgerEntry)
+        opened: List[LedgerEntry] = []
+        for entry in entries:
+            if entry.id not in existing:
+                # Added by a concurrent delivery of the same message since it was read
+                if not graph.try_add_node(entry):
+                    entry = graph.get_node(entry.id, LedgerEntry)
+                existing[entry.id] = entry
+            opened.append(existing[entry.id])
+        return opened
+
+    def save_checkpoint(self, entry: LedgerEntry, checkpoint: BaseModel):
+        """
+        Records the intermediate results of the stages run so far, so a redelivered message resumes from them.
+        """
+        entry.checkpoint = checkpoint.model_dump_json()
+        entry.updated_at = time.time()
+        self.update_node(entry)
+
+    def complete_ledger_entry(self, entry: LedgerEntry):
+        entry.completed = True
+        entry.updated_at = time.time()
+        self.update_node(entry)
+
+    def delete_ledger_entries(self, ids: List[str]):
+        self._get_graph(LedgerEntry).delete_nodes(ids)
+
+    def count_completed_children(self, entry: LedgerEntry) -> int:
+        """
+        Counts the completed entries of the messages an entry fanned out to.
+        """
+        return self._get_graph(LedgerEntry).count_nodes(
+            LedgerEntry, {"parent_id": entry.id, "completed": True}
+        )
+
+    def claim_ledger_entry(self, entry: LedgerEntry) -> bool:
+        """
+        Adds an entry owned by entry.owner, unless another owner added it first. Returns whether entry.owner
+        holds it, which is also the case when its own message is redelivered.
+        """
+        graph = self._get_graph(LedgerEntry)
+        if graph.try_add_node(entry):
+            return True
+        return graph.get_node(entry.id, LedgerEntry).owner == entry.owner
+
+    def get_runs(self, nodes: List[Any]) -> Dict[str, LedgerEntry]:
+        """
+        The ledger entries of the runs that created nodes (see origin_run), by id, read in one query.
+        """
+        ids = sorted({node.origin_run for node in nodes if node.origin_run is not None})
+        if len(ids) == 0:
+            return {}
+        return {entry.id: entry for entry in self.get_nodes(ids, LedgerEntry)}
+
     def get_app_state(self) -> AppState:
         nodes = self.get_all_nodes_by_type(AppState)
 
@@ -395,13 +757,81 @@ class Storage:
 
         return result
 
+    def vector_metadata(self, node: EmbeddableGraphNode) -> Dict[str, Any]:
+        """
+        Metadata stored with a node's embedding, for searches to filter on.
+
+        Observations carry their needs_action flag and raw score values, so searches for observations needing
+        action can filter on the index instead of fetching every candidate's scores.
+        """
+        if not isinstance(node, Observation):
+            return {}
+        metadata: Dict[str, Any] = {"needs_action": self.observation_needs_action(node)}
+        for field in SCORE_FIELDS.values():
+            if getattr(node, field) is not None:
+                metadata[field] = getattr(node, field)
+        return metadata
+
     def embed_and_store(self, node: EmbeddableGraphNode):
         embedding = generate_embedding(node.text)
         self.add_embeddings(
             type(node),
-            [Vector(values=embedding, id=node.id)],
+            [Vector(values=embedding, id=node.id, metadata=self.vector_metadata(node))],
+        )
+
+    def embed_and_store_many(
+        self,
+        nodes: List[EmbeddableGraphNodeVar],
+        priority: Priority = Priority.NORMAL,
+    ):
+        """
+        Embeds multiple nodes of the same type with batched embedding requests and stores them in one upsert.
+        """
+        if len(nodes) == 0:
+            return
+        embeddings = generate_embeddings(
+            [node.text for node in nodes], priority=priority
+        )
+        self.add_embeddings(
+            type(nodes[0]),
+            [
+                Vector(
+                    values=embedding, id=node.id, metadata=self.vector_metadata(node)
+                )
+                for node, embedding in zip(nodes, embeddings)
+            ],
         )
 
+    def fetch_embeddings(
+        self, source_type: Type[EmbeddableGraphNodeVar], ids: List[str]
+    ) -> Dict[str, List[float]]:
+        """
+        Gets the stored embeddings of nodes. Nodes without an embedding are omitted.
+        """
+        return self.vectorstore.fetch_embeddings(source_type.__name__, ids)
+
+    def delete_embeddings(
+        self, source_type: Type[EmbeddableGraphNodeVar], ids: List[str]
+    ):
+        """
+        Removes embeddings from the vectorstore.
+        """
+        self.vectorstore.delete_embeddings(source_type.__name__, ids)
+        with self._embeddings_lock:
+            for id in ids:
+                self._embeddings.pop(id, None)
+
+    def count_embeddings(self, source_type: Type[EmbeddableGraphNodeVar]) -> int:
+        return self.vectorstore.count_embeddings(source_type.__name__)
+
+    def can_stream_embedding_ids(self) -> bool:
+        return self.vectorstore.supports_listing_ids()
+
+    def stream_embedding_ids(
+        self, source_type: Type[EmbeddableGraphNodeVar], page_size: int = 100
+    ) -> Iterator[List[str]]:
+        return self.vectorstore.stream_ids(source_type.__name__, page_size)
+
     def add_embeddings(
         self, source_type: Type[EmbeddableGraphNodeVar], embeddings: List[Vector]
     ):
@@ -409,6 +839,26 @@ class Storage:
         Stores the embedding of a node in the vectorstore.
         """
         self.vectorstore.add_embeddings(source_type.__name__, embeddings)
+        self.remember_embeddings({vector.id: vector.values for vector in embeddings})
+
+    def remember_embeddings(self, embeddings: Dict[str, List[float]]):
+        """
+        Keeps the embeddings of nodes for embed_nodes, evicting the least recently used past
+        EMBEDDING_CACHE_SIZE.
+        """
+        with self._embeddings_lock:
+            for id, embedding in embeddings.items():
+                self._embeddings[id] = embedding
+                self._embeddings.move_to_end(id)
+            while len(self._embeddings) > EMBEDDING_CACHE_SIZE:
+                self._embeddings.popitem(last=False)
+
+    def remembered_embeddings(self, ids: List[str]) -> Dict[str, List[float]]:
+        with self._embeddings_lock:
+            found = {id: self._embeddings[id] for id in ids if id in self._embeddings}
+            for id in found:
+                self._embeddings.move_to_end(id)
+        return found
 
     def search_semantically(
         self,
@@ -416,13 +866,27 @@ class Storage:
         from_text: str,
         top_k: int,
         min_score: float = 0.0,
+        adaptive: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
     ) -> Tuple[List[EmbeddableGraphNodeVar], List[float]]:
         """
-        Searches the vectorstore for the nearest neighbors to the given embedding.
+        Searches the vectorstore for the nearest neighbors to the given embedding. filter is a metadata filter
+        applied by the vectorstore, e.g. NEEDS_ACTION_FILTER.
+
+        With adaptive, top_k is only an upper bound. The number of candidates returned is picked from the
+        shape of the similarity scores (see src.vector.cutoff), so cut candidates are never fetched from the graph.
         """
 
         embedding = generate_embedding(from_text)
-        matches = self.vectorstore.search_with_embedding(search_for, embedding, top_k)
+        matches = self.vectorstore.search_with_embedding(
+            search_for, embedding, top_k, filter=filter
+        )
+
+        if adaptive:
+            kept = adaptive_cutoff(
+                [match["score"] for match in matches], search_for.__name__, min_score
+            )
+            matches = matches[:kept]
 
         nodes: List[EmbeddableGraphNodeVar] = []
         scores: List[float] = []
@@ -433,3 +897,221 @@ class Storage:
                 scores.append(match["score"])
 
         return nodes, scores
+
+    def embed_nodes(self, nodes: List[EmbeddableGraphNodeVar]) -> List[List[float]]:
+        """
+        The embeddings of stored nodes of the same type. Those this Storage embedded, stored or fetched
+        recently are reused, the others are fetched from the vectorstore in one request, and nodes not in the
+        vectorstore yet are embedded in one batched request.
+        """
+        if len(nodes) == 0:
+            return []
+        stored = self.remembered_embeddings([node.id for node in nodes])
+        unknown = [node.id for node in nodes if node.id not in stored]
+        if len(unknown) > 0:
+            stored.update(self.fetch_embeddings(type(nodes[0]), unknown))
+        missing = [node for node in nodes if node.id not in stored]
+        if len(missing) > 0:
+            for node, embedding in zip(
+                missing, generate_embeddings([node.text for node in missing])
+            ):
+                stored[node.id] = embedding
+        self.remember_embeddings({id: stored[id] for id in unknown})
+        return [stored[node.id] for node in nodes]
+
+    def search_semantically_many(
+        self,
+        search_for: Type[EmbeddableGraphNodeVar],
+        embeddings: List[List[float]],
+        top_k: int,
+        min_score: float = 0.0,
+        adaptive: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[List[EmbeddableGraphNodeVar], List[float]]]:
+        """
+        search_semantically for multiple embeddings. The vectorstore is queried concurrently, and the nodes
+        found are read from the graph in one query, once each even if several embeddings found them.
+        """
+        all_matches = map_concurrently(
+            lambda embedding: self.vectorstore.search_with_embedding(
+                search_for, embedding, top_k, filter=filter
+            ),
+            embeddings,
+        )
+
+        kept_matches: List[List[Tuple[str, float]]] = []
+        for matches in all_matches:
+            if adaptive:
+                kept = adaptive_cutoff(
+                    [match["score"] for match in matches],
+                    search_for.__name__,
+                    min_score,
+                )
+                matches = matches[:kept]
+            kept_matches.append(
+                [
+                    (match["id"], match["score"])
+                    for match in matches
+                    if match["score"] > min_score
+                ]
+            )
+
+        found_ids = sorted({id for matches in kept_matches for id, _ in matches})
+        nodes = {node.id: node for node in self.get_nodes(found_ids, search_for)}
+        results: List[Tuple[List[EmbeddableGraphNodeVar], List[float]]] = []
+        for matches in kept_matches:
+            matches = [(id, score) for id, score in matches if id in nodes]
+            results.append(
+                ([nodes[id] for id, _ in matches], [score for _, score in matches])
+            )
+        return results
+
+    def rank_candidates(
+        self,
+        nodes: List[EmbeddableGraphNode],
+        candidates: List[EmbeddableGraphNodeVar],
+        top_k: int,
+        min_score: float = 0.0,
+        adaptive: bool = False,
+    ) -> List[Tuple[List[EmbeddableGraphNodeVar], List[float]]]:
+        """
+        Like search_semantically_many, but over known candidates of one type instead of the whole vectorstore,
+        e.g. the ones a pipeline run found or created. Similarities are computed from the stored embeddings,
+        fetched in one request per type.
+        """
+        if len(nodes) == 0:
+            return []
+        if len(candidates) == 0:
+            return [([], []) for _ in nodes]
+
+        def normalized(embeddings: List[List[float]]) -> np.ndarray:
+            matrix = np.array(embeddings, dtype=np.float64)
+            return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+        similarities = (
+            normalized(self.embed_nodes(nodes))
+            @ normalized(self.embed_nodes(candidates)).T
+        )
+
+        results: List[Tuple[List[EmbeddableGraphNodeVar], List[float]]] = []
+        for row in similarities:
+            order = [int(i) for i in np.argsort(-row)[:top_k]]
+            scores = [float(row[i]) for i in order]
+            if adaptive:
+                kept = adaptive_cutoff(
+                    scores,
+                    type(candidates[0]).__name__,
+                    min_score,
+                    SimilaritySource.RANKED,
+                )
+                order, scores = order[:kept], scores[:kept]
+            matches = [
+                (i, score) for i, score in zip(order, scores) if score > min_score
+            ]
+            results.append(
+                ([candidates[i] for i, _ in matches], [score for _, score in matches])
+            )
+        return results
+
+    def topic_centroids(self) -> Optional[TopicCentroidIndex]:
+        """
+        The worker's topic centroid index (see src.vector.centroids), with the topics created since it was
+        last refreshed added. None if the worker has no snapshot.
+        """
+        index = get_centroid_index()
+        if index is None or not index.needs_refresh():
+            return index
+        refreshed_at = time.time()
+        # Looks back one more period, for topics written late or by workers with clocks behind
+        created_ids = self._get_graph(Topic).get_ids_created_after(
+            Topic, index.refreshed_at - REFRESH_SECONDS
+        )
+        embeddings = self.fetch_embeddings(
+            Topic, [id for id in created_ids if id not in index]
+        )
+        index.add_topics(list(embeddings), list(embeddings.values()))
+        index.refreshed_at = refreshed_at
+        return index
+
+    def update_topic_centroids(
+        self, topics: List[Topic], observations: List[Observation]
+    ):
+        """
+        Moves the centroids of topics towards observations they now contain, if the worker has centroids.
+        """
+        index = get_centroid_index()
+        if index is None or len(topics) == 0 or len(observations) == 0:
+            return
+        ids = [observation.id for observation in observations]
+        embeddings = self.embed_nodes(observations)
+        for topic in topics:
+            index.add_members(topic.id, ids, embeddings)
+
+    def topic_search_source(self) -> SimilaritySource:
+        """
+        Where the similarities search_topics returns come from.
+        """
+        if get_centroid_index() is None:
+            return SimilaritySource.VECTOR
+        return SimilaritySource.CENTROID
+
+    def search_topics(
+        self,
+        observation: Observation,
+        top_k: int,
+        min_score: float = 0.0,
+        adaptive: bool = False,
+    ) -> Tuple[List[Topic], List[float]]:
+        """
+        Finds the topics an observation may belong to, like search_semantically, but scored against topic
+        centroids in memory when the worker has them. Scores are then similarities to the centroids (see
+        topic_search_source).
+        """
+        return self.search_topics_many([observation], top_k, min_score, adaptive)[0]
+
+    def search_topics_many(
+        self,
+        observations: List[Observation],
+        top_k: int,
+        min_score: float = 0.0,
+        adaptive: bool = False,
+    ) -> List[Tuple[List[Topic], List[float]]]:
+        """
+        search_topics for multiple observations, with their embeddings fetched together (see embed_nodes) and
+        the topics found read in one query.
+        """
+        if len(observations) == 0:
+            return []
+        index = self.topic_centroids()
+        embeddings = self.embed_nodes(observations)
+        if index is None:
+            return self.search_semantically_many(
+                Topic, embeddings, top_k, min_score, adaptive
+            )
+
+        matches_per_observation: List[List[Tuple[str, float]]] = []
+        for embedding in embeddings:
+            matches = index.search(embedding, top_k)
+            if adaptive:
+                kept = adaptive_cutoff(
+                    [score for _, score in matches],
+                    Topic.__name__,
+                    min_score,
+                    SimilaritySource.CENTROID,
+                )
+                matches = matches[:kept]
+            matches_per_observation.append(
+                [(id, score) for id, score in matches if score > min_score]
+            )
+
+        found_ids = {id for matches in matches_per_observation for id, _ in matches}
+        topics = {topic.id: topic for topic in self.get_nodes(sorted(found_ids), Topic)}
+        # Topics merged or deleted since they were indexed
+        index.remove([id for id in found_ids if id not in topics])
+        results: List[Tuple[List[Topic], List[float]]] = []
+        for matches in matches_per_observation:
+            matches = [(id, score) for id, score in matches if id in topics]
+            results.append(
+                ([topics[id] for id, _ in matches], [score for _, score in matches])
+            )
+        return results
@@ -0,0 +1,225 @@
+"""
+In-memory index of topic centroids, for finding the topics of an observation without a vectorstore search.
+
+A topic's centroid is the normalised sum of its own embedding, weighted by TOPIC_WEIGHT, and the embeddings
+of the observations it contains, so it follows how the topic is used rather than only its name. An
+observation is scored against every centroid with one matrix-vector product. The topics found go through
+the similarity cascade (see src.llm.cascade), so only the ambiguous ones are sent to the LLM. Similarities
+to centroids are on a scale of their own, so they get their own minimum scores and cascade thresholds (see
+src.vector.cutoff.SimilaritySource).
+
+The index is saved as a directory of .npy files (see src.jobs.build_topic_centroids), which workers
+memory-map at start when TOPIC_CENTROIDS_PATH points at it. Storage.topic_centroids adds topics created
+since, and the edges a worker adds update centroids in place. Rebuild the snapshot periodically to pick up
+the edges added by other workers.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+# Snapshot directory. Unset, observations are matched to topics with vectorstore searches instead.
+CENTROIDS_PATH = os.environ.get("TOPIC_CENTROIDS_PATH")
+
+# A topic's own embedding counts as this many member observations, so small topics stay near their text
+TOPIC_WEIGHT = 3.0
+
+# Seconds between checks for topics created by other workers
+REFRESH_SECONDS = 60.0
+
+
+class TopicCentroidIndex:
+    """
+    Centroids of topics as one contiguous float32 matrix, with the weighted embedding sums they are normalised from.
+
+    Loaded snapshots are memory-mapped read-only, and only copied into memory on the first update.
+    """
+
+    def __init__(self, dimension: int = 1536) -> None:
+        self.dimension = dimension
+        self.refreshed_at = 0.0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._members: Dict[str, Set[str]] = {}
+        self._sums = np.zeros((0, dimension), dtype=np.float32)
+        self._centroids = np.zeros((0, dimension), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, topic_id: str) -> bool:
+        return topic_id in self._rows
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self._ids)
+
+    def _make_writable(self) -> None:
+        if not self._sums.flags.writeable:
+            self._sums = np.array(self._sums)
+            self._centroids = np.array(self._centroids)
+
+    def _normalise(self, rows: Sequence[int]) -> None:
+        sums = self._sums[rows]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        self._centroids[rows] = sums / np.where(norms == 0, 1, norms)
+
+    def add_topics(
+        self, topic_ids: Sequence[str], embeddings: Sequence[Sequence[float]]
+    ) -> None:
+        """
+        Adds topics without members. Topics already in the index are skipped.
+        """
+        with self._lock:
+            new = [
+                (topic_id, embedding)
+                for topic_id, embedding in zip(topic_ids, embeddings)
+                if topic_id not in self._rows
+            ]
+            if len(new) == 0:
+                return
+            matrix = np.asarray([embedding for _, embedding in new], dtype=np.float32)
+            first_row = len(self._ids)
+            for topic_id, _ in new:
+                self._rows[topic_id] = len(self._ids)
+                self._ids.append(topic_id)
+                self._members[topic_id] = set()
+            self._sums = np.vstack([self._sums, matrix * TOPIC_WEIGHT])
+            self._centroids = np.vstack([self._centroids, matrix])
+            self._normalise(range(first_row, len(self._ids)))
+
+    def add_members(
+        self,
+        topic_id: str,
+        member_ids: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+    ) -> None:
+        """
+        Moves a topic's centroid towards observations it now contains. Members already counted are skipped.
+        """
+        with self._lock:
+            if topic_id not in self._rows:
+                return
+            members = self._members[topic_id]
+            new = [
+                embedding
+                for member_id, embedding in zip(member_ids, embeddings)
+                if member_id not in members
+            ]
+            if len(new) == 0:
+                return
+            members.update(member_ids)
+            self._make_writable()
+            row = self._rows[topic_id]
+            self._sums[row] += np.asarray(new, dtype=np.float32).sum(axis=0)
+            self._normalise([row])
+
+    def remove(self, topic_ids: Sequence[str]) -> None:
+        """
+        Removes topics, e.g. ones merged or deleted since they were indexed.
+        """
+        with self._lock:
+            rows = [self._rows[id] for id in topic_ids if id in self._rows]
+            if len(rows) == 0:
+                return
+            keep = np.setdiff1d(np.arange(len(self._ids)), rows)
+            self._ids = [self._ids[row] for row in keep]
+            self._rows = {id: row for row, id in enumerate(self._ids)}
+            for topic_id in topic_ids:
+                self._members.pop(topic_id, None)
+            self._sums = self._sums[keep]
+            self._centroids = self._centroids[keep]
+
+    def search(self, vector: Sequence[float], top_k: int) -> List[Tuple[str, float]]:
+        """
+        Returns the top_k (topic id, similarity to its centroid) pairs, highest first.
+        """
+        with self._lock:
+            centroids, ids = self._centroids, self._ids
+        count = len(ids)
+        if count == 0 or top_k <= 0:
+            return []
+        scores = centroids @ np.asarray(vector, dtype=np.float32)
+        top_k = min(top_k, count)
+        rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        rows = rows[np.argsort(-scores[rows])]
+        return [(ids[row], float(scores[row])) for row in rows]
+
+    def save(self, path: str) -> None:
+        """
+        Writes a snapshot directory, replacing any previous one at path.
+        """
+        partial_path = path + ".partial"
+        shutil.rmtree(partial_path, ignore_errors=True)
+        os.makedirs(partial_path)
+        with self._lock:
+            np.save(os.path.join(partial_path, "centroids.npy"), self._centroids)
+            np.save(os.path.join(partial_path, "sums.npy"), self._sums)
+            with open(os.path.join(partial_path, "index.json"), "w") as file:
+                json.dump(
+                    {
+                        "dimension": self.dimension,
+                        "refreshed_at": self.refreshed_at,
+                        "ids": self._ids,
+                        "members": {
+                            id: sorted(members) for id, members in self._members.items()
+                        },
+                    },
+                    file,
+                )
+
+        # Swap directories, so a worker starting meanwhile never loads half a snapshot
+        previous_path = path + ".previous"
+        shutil.rmtree(previous_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, previous_path)
+        os.rename(partial_path, path)
+        shutil.rmtree(previous_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str) -> "TopicCentroidIndex":
+        with open(os.path.join(path, "index.json")) as file:
+            data = json.load(file)
+        index = cls(dimension=data["dimension"])
+        index.refreshed_at = data["refreshed_at"]
+        index._ids = data["ids"]
+        index._rows = {id: row for row, id in enumerate(index._ids)}
+        index._members = {id: set(members) for id, members in data["members"].items()}
+        index._centroids = np.load(os.path.join(path, "centroids.npy"), mmap_mode="r")
+        index._sums = np.load(os.path.join(path, "sums.npy"), mmap_mode="r")
+        return index
+
+    def needs_refresh(self) -> bool:
+        return time.time() - self.refreshed_at >= REFRESH_SECONDS
+
+
+_index: Optional[TopicCentroidIndex] = None
+_loaded = False
+
+
+def get_centroid_index() -> Optional[TopicCentroidIndex]:
+    """
+    Gets the index shared by the worker process, loading the snapshot on first use. None if there is no
+    snapshot, or it can't be read.
+    """
+    global _index, _loaded
+    if not _loaded:
+        _loaded = True
+        if CENTROIDS_PATH is not None and os.path.exists(CENTROIDS_PATH):
+            try:
+                _index = TopicCentroidIndex.load(CENTROIDS_PATH)
+                logging.info(
+                    f"Loaded {len(_index)} topic centroids from {CENTROIDS_PATH}."
+                )
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(
+                    f"Could not load topic centroids from {CENTROIDS_PATH}: {e}. Using vectorstore searches."
+                )
+    return _index
@@ -0,0 +1,191 @@
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Fetches full precision embeddings for the given ids. For example, for topics:
+# lambda ids: vectorstore.fetch_embeddings("Topic", ids)
+FullPrecisionSource = Callable[[List[str]], Dict[str, List[float]]]
+
+# Number of rows widened to float32 at a time while scoring.
+SCORE_CHUNK_ROWS = 4096
+
+
+class Precision(Enum):
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"
+
+
+class CompactEmbeddingStore:
+    """
+    In-process store of embeddings kept as one contiguous NumPy array instead of Python lists.
+
+    FLOAT32 is the uncompressed baseline. FLOAT16 halves its memory. INT8 quarters it by quantizing
+    each vector symmetrically with its own scale (max absolute value / 127).
+
+    Searches run on the compact form. If a full precision source is provided, the top candidates
+    can be rescored with the original embeddings to recover the ordering lost to quantization.
+    """
+
+    def __init__(
+        self,
+        dimension: int = 1536,
+        precision: Precision = Precision.INT8,
+        initial_capacity: int = 1024,
+    ) -> None:
+        self.dimension = dimension
+        self.precision = precision
+
+        dtype = np.int8 if precision == Precision.INT8 else np.dtype(precision.value)
+        self._vectors = np.zeros((initial_capacity, dimension), dtype=dtype)
+        self._scales = np.ones(initial_capacity, dtype=np.float32)
+        self._ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._id_to_row
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self._ids)
+
+    def _grow(self, required: int) -> None:
+        capacity = self._vectors.shape[0]
+        if required <= capacity:
+            return
+        new_capacity = max(required, capacity * 2)
+        vectors = np.zeros((new_capacity, self.dimension), dtype=self._vectors.dtype)
+        vectors[:capacity] = self._vectors
+        scales = np.ones(new_capacity, dtype=np.float32)
+        scales[:capacity] = self._scales
+        self._vectors = vectors
+        self._scales = scales
+
+    def _encode(self, matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Converts a float matrix into the compact representation and its per-vector scales.
+        """
+        if self.precision != Precision.INT8:
+            scales = np.ones(matrix.shape[0], dtype=np.float32)
+            return matrix.astype(self._vectors.dtype), scales
+
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0  # Avoid dividing by zero for all-zero vectors
+        quantized = np.rint(matrix / scales[:, None]).clip(-127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def add(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        """
+        Adds or replaces embeddings. Embeddings are expected to be normalized, as Ada embeddings are.
+        """
+        if len(ids) == 0 and len(embeddings) == 0:
+            return
+
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError(
+                f"Expected a sequence of embeddings, got an array of shape {matrix.shape}."
+            )
+        if len(ids) != matrix.shape[0]:
+            raise ValueError(f"Got {len(ids)} ids but {matrix.shape[0]} embeddings.")
+        if matrix.shape[1] != self.dimension:
+            raise ValueError(
+                f"Expected embeddings of dimension {self.dimension}, got {matrix.shape[1]}."
+            )
+        encoded, scales = self._encode(matrix)
+
+        rows: List[int] = []
+        for id in ids:
+            if id not in self._id_to_row:
+                self._id_to_row[id] = len(self._ids)
+                self._ids.append(id)
+            rows.append(self._id_to_row[id])
+
+        self._grow(len(self._ids))
+        self._vectors[rows] = encoded
+        self._scales[rows] = scales
+
+    def remove(self, ids: Sequence[str]) -> None:
+        """
+        Removes embeddings by moving the last row into each freed slot, keeping the array contiguous.
+        """
+        for id in ids:
+            row = self._id_to_row.pop(id, None)
+            if row is None:
+                continue
+            last_row = len(self._ids) - 1
+            last_id = self._ids.pop()
+            if row != last_row:
+                self._vectors[row] = self._vectors[last_row]
+                self._scales[row] = self._scales[last_row]
+                self._ids[row] = last_id
+                self._id_to_row[last_id] = row
+
+    def get(self, id: str) -> np.ndarray:
+        """
+        Returns the dequantized embedding as float32.
+        """
+        row = self._id_to_row[id]
+        return self._vectors[row].astype(np.float32) * self._scales[row]
+
+    def scores(self, vector: Sequence[float]) -> np.ndarray:
+        """
+        Dot product of the query against every stored embedding, computed on the compact form.
+
+        Rows are widened to float32 one chunk at a time so a search never holds a full float32 copy.
+        """
+        count = len(self._ids)
+        query = np.asarray(vector, dtype=np.float32)
+        raw = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SCORE_CHUNK_ROWS):
+            end = min(start + SCORE_CHUNK_ROWS, count)
+            raw[start:end] = self._vectors[start:end].astype(np.float32) @ query
+        return raw * self._scales[:count]
+
+    def search(
+        self,
+        vector: Sequence[float],
+        top_k: int,
+        full_precision_source: Optional[FullPrecisionSource] = None,
+        rescore_candidates: int = 0,
+    ) -> List[Tuple[str, float]]:
+        """
+        Returns the top_k (id, score) pairs, highest score first.
+
+        If full_precision_source is given, the best max(top_k, rescore_candidates) compact matches are
+        rescored with their full precision embeddings before taking the top_k.
+        """
+        count = len(self._ids)
+        if count == 0 or top_k <= 0:
+            return []
+
+        scores = self.scores(vector)
+        candidate_count = min(count, max(top_k, rescore_candidates))
+        candidate_rows = np.argpartition(-scores, candidate_count - 1)[:candidate_count]
+        candidates = [(self._ids[row], float(scores[row])) for row in candidate_rows]
+
+        if full_precision_source is not None:
+            full_embeddings = full_precision_source([id for id, _ in candidates])
+            query = np.asarray(vector, dtype=np.float32)
+            rescored: List[Tuple[str, float]] = []
+            for id, score in candidates:
+                if id in full_embeddings:
+                    score = float(
+                        np.asarray(full_embeddings[id], dtype=np.float32) @ query
+                    )
+                rescored.append((id, score))
+            candidates = rescored
+
+        candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+        return candidates[:top_k]
+
+    def memory_bytes(self) -> int:
+        """
+        Bytes used by the stored vectors and scales, excluding unused capacity and the id index.
+        """
+        count = len(self._ids)
+        return int(self._vectors[:count].nbytes + self._scales[:count].nbytes)
@@ -0,0 +1,132 @@
+import logging
+from enum import Enum
+from typing import Dict, List, Tuple
+
+from pydantic import BaseModel
+
+
+class SimilaritySource(Enum):
+    """
+    Where the similarity of a candidate to the node it was found for comes from. Their scales differ, so
+    the minimum scores here and the cascade's thresholds (see src.llm.cascade) are kept per source.
+    """
+
+    # Cosine similarity from a vectorstore search
+    VECTOR = "vector"
+    # Similarity to a topic's centroid (see src.vector.centroids)
+    CENTROID = "centroid"
+    # Exact cosine similarity between stored embeddings (see Storage.rank_candidates)
+    RANKED = "ranked"
+
+
+# Minimum similarity per source and searched type for text-embedding-ada-002, set by hand rather than fitted:
+# unrelated restaurant feedback texts typically score between 0.70 and 0.75 against each other. The decision
+# log (see DecisionStore.record_similarities) only holds candidates above them, so it can't lower them.
+MIN_SCORES: Dict[SimilaritySource, Dict[str, float]] = {
+    SimilaritySource.VECTOR: {
+        "Observation": 0.76,
+        "ActionItem": 0.76,
+        "Topic": 0.75,
+    },
+    # Centroids average out what sets their members apart, so unrelated observations score at least as
+    # high against them as against a topic's text. The vectorstore's minimum cuts no more than it should.
+    SimilaritySource.CENTROID: {
+        "Topic": 0.75,
+    },
+    # The same metric over the same embeddings as the vectorstore, computed exactly
+    SimilaritySource.RANKED: {
+        "Observation": 0.76,
+        "ActionItem": 0.76,
+        "Topic": 0.75,
+    },
+}
+
+# A drop between consecutive scores counts as a gap when it is at least this large...
+MIN_GAP = 0.02
+# ...and at least this many times the median of the other drops.
+GAP_FACTOR = 3.0
+# A gap never cuts the candidates to fewer than this, since a few drops can't tell a gap from noise.
+MIN_KEPT = 3
+
+
+class CutoffStats(BaseModel):
+    """
+    Running totals of how many candidates adaptive searches were offered and how many they cut.
+    """
+
+    searches: int = 0
+    candidates: int = 0
+    kept: int = 0
+    cut_by_min_score: int = 0
+    cut_by_gap: int = 0
+
+    def record(
+        self, candidates: int, kept: int, cut_by_min_score: int, cut_by_gap: int
+    ) -> None:
+        self.searches += 1
+        self.candidates += candidates
+        self.kept += kept
+        self.cut_by_min_score += cut_by_min_score
+        self.cut_by_gap += cut_by_gap
+
+    def cut_ratio(self) -> float:
+        if self.candidates == 0:
+            return 0.0
+        return 1 - self.kept / self.candidates
+
+
+# Per source and searched type, for the lifetime of the worker
+CUTOFF_STATS: Dict[Tuple[SimilaritySource, str], CutoffStats] = {}
+
+
+def find_score_gap(scores: List[float]) -> int:
+    """
+    Given scores sorted from highest to lowest, return how many come before the most pronounced gap after
+    the first MIN_KEPT.
+
+    Returns len(scores) if there is no gap that stands out from the other drops.
+    """
+    if len(scores) <= MIN_KEPT:
+        return len(scores)
+
+    drops = [scores[i] - scores[i + 1] for i in range(len(scores) - 1)]
+    largest_drop_index = max(range(MIN_KEPT - 1, len(drops)), key=lambda i: drops[i])
+    largest_drop = drops[largest_drop_index]
+
+    other_drops = sorted(drops[:largest_drop_index] + drops[largest_drop_index + 1 :])
+    median_drop = other_drops[len(other_drops) // 2] if len(other_drops) > 0 else 0.0
+
+    if largest_drop >= MIN_GAP and largest_drop >= GAP_FACTOR * median_drop:
+        return largest_drop_index + 1
+    return len(scores)
+
+
+def adaptive_cutoff(
+    scores: List[float],
+    type_name: str,
+    min_score: float = 0.0,
+    source: SimilaritySource = SimilaritySource.VECTOR,
+) -> int:
+    """
+    Given similarity scores sorted from highest to lowest, return how many candidates to keep.
+
+    Candidates below the type's minimum for the source (or min_score, if higher) are dropped first. The rest
+    are cut at the most pronounced gap in the score distribution, if there is one, keeping at least MIN_KEPT.
+    """
+    threshold = max(min_score, MIN_SCORES.get(source, {}).get(type_name, 0.0))
+    above_threshold = len([score for score in scores if score > threshold])
+    kept = find_score_gap(scores[:above_threshold])
+
+    stats = CUTOFF_STATS.setdefault((source, type_name), CutoffStats())
+    stats.record(
+        candidates=len(scores),
+        kept=kept,
+        cut_by_min_score=len(scores) - above_threshold,
+        cut_by_gap=above_threshold - kept,
+    )
+    logging.info(
+        f"Adaptive search for {type_name} ({source.value}) kept {kept} of {len(scores)} candidates "
+        f"({len(scores) - above_threshold} below {threshold}, {above_threshold - kept} after gap). "
+        f"Cut {stats.cut_ratio():.0%} of candidates over {stats.searches} searches."
+    )
+    return kept
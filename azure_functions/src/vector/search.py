@@ -1,6 +1,6 @@
 import os
 from enum import Enum
-from typing import List, Dict, Type
+from typing import Any, List, Dict, Optional, Type, Iterator
 
 import pinecone  # type: ignore
 from pinecone.core.client.models import Vector  # type: ignore
@@ -82,15 +82,18 @@ class VectorStore:
         search_for_type: Type[EmbeddableGraphNodeVar],
         vector: List[float],
         top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
     ) -> List[ScoredVector]:
         """
-        Search using embedding in the index.
+        Search using embedding in the index. filter is a metadata filter applied by the index, e.g.
+        {"needs_action": {"$eq": True}}.
         """
         class_namespace = self.get_namespace(self.default_env, search_for_type.__name__)
         query_reponse = self.index.query(  # type: ignore
             namespace=class_namespace,
             vector=vector,
             top_k=top_k,
+            filter=filter,
         )
         matches = query_reponse["matches"]
 
@@ -105,5 +108,83 @@ class VectorStore:
             vectors=embeddings,
         )
 
+    def update_metadata(
+        self, node_class_name: str, id: str, metadata: Dict[str, Any]
+    ) -> None:
+        """
+        Sets metadata fields of a stored embedding, keeping its other fields.
+        """
+        self.index.update(  # type: ignore
+            id=id,
+            set_metadata=metadata,
+            namespace=self.get_namespace(self.default_env, node_class_name),
+        )
+
+    def fetch_embeddings(
+        self, node_class_name: str, ids: List[str], batch_size: int = 1000
+    ) -> Dict[str, List[float]]:
+        """
+        Fetch stored embeddings by id. Ids that are not in the index are omitted from the result.
+        """
+        namespace = self.get_namespace(self.default_env, node_class_name)
+        embeddings: Dict[str, List[float]] = {}
+        for start in range(0, len(ids), batch_size):
+            fetch_response = self.index.fetch(  # type: ignore
+                ids=ids[start : start + batch_size], namespace=namespace
+            )
+            for id, vector in fetch_response["vectors"].items():  # type: ignore
+                embeddings[id] = vector["values"]  # type: ignore
+        return embeddings  # type: ignore
+
+    def delete_embeddings(self, node_class_name: str, ids: List[str]) -> None:
+        """
+        Delete embeddings by id.
+        """
+        if len(ids) == 0:
+            return
+        self.index.delete(  # type: ignore
+            ids=ids, namespace=self.get_namespace(self.default_env, node_class_name)
+        )
+
+    def count_embeddings(self, node_class_name: str) -> int:
+        """
+        Number of embeddings stored in the namespace of the class.
+        """
+        namespace = self.get_namespace(self.default_env, node_class_name)
+        namespaces = self.index.describe_index_stats()["namespaces"]  # type: ignore
+        if namespace not in namespaces:
+            return 0
+        return namespaces[namespace]["vector_count"]  # type: ignore
+
+    def supports_listing_ids(self) -> bool:
+        """
+        Listing ids needs a client and index that support paginated listing (pinecone-client >= 3, serverless).
+        """
+        return hasattr(self.index, "list_paginated")
+
+    def stream_ids(
+        self, node_class_name: str, page_size: int = 100
+    ) -> Iterator[List[str]]:
+        """
+        Yields pages of the ids stored in the namespace of the class.
+        """
+        if not self.supports_listing_ids():
+            raise NotImplementedError(
+                "The installed Pinecone client cannot list vector ids."
+            )
+
+        namespace = self.get_namespace(self.default_env, node_class_name)
+        pagination_token = None
+        while True:
+            response = self.index.list_paginated(  # type: ignore
+                namespace=namespace, limit=page_size, pagination_token=pagination_token
+            )
+            page = [vector.id for vector in response.vectors]  # type: ignore
+            if len(page) > 0:
+                yield page
+            if response.pagination is None or not response.pagination.next:  # type: ignore
+                return
+            pagination_token = response.pagination.next  # type: ignore
+
     def close(self) -> None:
         self.index.close()
@@ -0,0 +1,98 @@
+import unittest
+import azure.functions as func
+from contextlib import ExitStack
+from typing import Callable, Any, Dict, List
+from unittest import mock
+
+from HandleFeedbackItemChange import main
+
+from src.storage import Storage
+from src.data.reviews import Review, Rating, ReviewSource
+from src.data.feedbackItems import FeedbackItem
+from src.data.observations import Observation
+from src.data.actionItems import ActionItem
+from src.data.topics import Topic
+from src.misc import iso_to_unix_timestamp
+
+# The LLM calls each stage makes, as src.pipeline imports them
+OBSERVATION_CALLS = ["observation_streams", "score_observations", "flag_needs_action"]
+ACTION_ITEM_CALLS = ["generate_action_items"]
+TOPIC_CALLS = ["generate_topics"]
+CONNECTION_CALLS = [
+    "infer_observation_to_action_items_connections",
+    "infer_observation_to_topics_connections",
+]
+
+
+def message(feedback_item_id: str) -> func.ServiceBusMessage:
+    req = mock.Mock(spec=func.ServiceBusMessage)
+    req.message_id = f"message_{feedback_item_id}"
+    req.get_body.return_value = '{"id": "%s"}' % feedback_item_id  # type: ignore
+    return req
+
+
+def count_nodes() -> Dict[str, int]:
+    with Storage() as storage:
+        return {
+            type.__name__: len(storage.get_all_nodes_by_type(type))
+            for type in (Observation, ActionItem, Topic)
+        }
+
+
+class TestFeedbackItemRedelivery(unittest.TestCase):
+    def setup_method(self, method: Callable[[], Any]):
+        # Each test gets its own feedback item, as the storage isn't reset between tests
+        self.feedback_item_id = f"feedback_item_{method.__name__}"
+        with Storage() as storage:
+            review = Review(
+                rating=Rating.TWO,
+                source=ReviewSource.YELP,
+                source_review_id=f"Review_{method.__name__}",
+            )
+            feedback_item = FeedbackItem(
+                id=self.feedback_item_id,
+                text="The pasta arrived cold and we waited forty minutes for it. The waiter apologised and took it off the bill.",
+                text_written_at=iso_to_unix_timestamp("2023-07-25T00:00:00.000Z"),
+            )
+            storage.add_feedback_item_and_source(feedback_item, source=review)
+
+    def teardown_method(self, method: Callable[[], Any]):
+        pass
+
+    def patched(self, stack: ExitStack, names: List[str]) -> List[mock.Mock]:
+        return [
+            stack.enter_context(mock.patch(f"src.pipeline.{name}")) for name in names
+        ]
+
+    def test_redelivered_message_is_skipped(self):
+        main(message(self.feedback_item_id))
+        stored = count_nodes()
+
+        with ExitStack() as stack:
+            calls = self.patched(
+                stack,
+                OBSERVATION_CALLS + ACTION_ITEM_CALLS + TOPIC_CALLS + CONNECTION_CALLS,
+            )
+            main(message(self.feedback_item_id))
+
+        for call in calls:
+            call.assert_not_called()
+        self.assertEqual(count_nodes(), stored)
+
+    def test_retry_resumes_from_checkpoint(self):
+        with mock.patch(
+            "src.pipeline.generate_topics", side_effect=Exception("Topics failed")
+        ):
+            with self.assertRaises(Exception):
+                main(message(self.feedback_item_id))
+        stored = count_nodes()
+
+        with ExitStack() as stack:
+            calls = self.patched(stack, OBSERVATION_CALLS + ACTION_ITEM_CALLS)
+            main(message(self.feedback_item_id))
+
+        for call in calls:
+            call.assert_not_called()
+        resumed = count_nodes()
+        self.assertEqual(resumed[Observation.__name__], stored[Observation.__name__])
+        self.assertEqual(resumed[ActionItem.__name__], stored[ActionItem.__name__])
@@ -0,0 +1,76 @@
+import json
+import unittest
+import azure.functions as func
+from typing import Callable, Any
+from unittest import mock
+
+from HandleObservationChange import main
+from src.storage import Storage
+from src.data.observations import Observation
+from src.data.feedbackItems import FeedbackItem
+from src.data.reviews import Review, Rating, ReviewSource
+from src.misc import iso_to_unix_timestamp
+
+
+def flag_update_message(observation: Observation) -> func.ServiceBusMessage:
+    """
+    A change message for a flag update, carrying the properties the way the change feed does.
+    """
+    body = {"id": observation.id, "_etag": f'"{observation.flags_updated_at}"'}
+    for key in ("needs_action", "flags_updated_at", "needs_action_raised"):
+        body[key] = [{"id": key, "_value": getattr(observation, key)}]
+    req = mock.Mock(spec=func.ServiceBusMessage)
+    req.get_body.return_value = json.dumps(body)  # type: ignore
+    return req
+
+
+class TestHandleFlaggedObservationChange(unittest.TestCase):
+    def setup_method(self, method: Callable[[], Any]):
+        # Each test gets its own nodes, as the storage isn't reset between tests
+        suffix = method.__name__
+        with Storage() as storage:
+            review = Review(
+                rating=Rating.TWO,
+                source=ReviewSource.YELP,
+                source_review_id=f"Review_fl4g5_{suffix}",
+            )
+            feedback_item = FeedbackItem(
+                text="The fries were soggy and the music was too loud to talk.",
+                text_written_at=iso_to_unix_timestamp("2023-07-25T00:00:00.000Z"),
+            )
+            self.observation = Observation(
+                text="The music was too loud to hold a conversation.",
+                id=f"Observation_fl4g5_{suffix}",
+                needs_action=False,
+            )
+            storage.add_feedback_item_and_source(feedback_item, review)
+            storage.add_observation_for_feedback_item(self.observation, feedback_item)
+
+    def teardown_method(self, method: Callable[[], Any]):
+        pass
+
+    def test_unchanged_flag_is_not_connected_again(self):
+        with Storage() as storage:
+            storage.update_observation_flags(self.observation, False)
+        with mock.patch(
+            "HandleObservationChange.infer_observation_to_topics_connections"
+        ) as infer_topics, mock.patch(
+            "HandleObservationChange.infer_observation_to_action_items_connections"
+        ) as infer_action_items:
+            main(flag_update_message(self.observation))
+        infer_topics.assert_not_called()
+        infer_action_items.assert_not_called()
+
+    def test_raised_flag_is_only_connected_to_action_items(self):
+        self.observation.needs_action = True
+        with Storage() as storage:
+            storage.update_observation_flags(self.observation, False)
+        with mock.patch(
+            "HandleObservationChange.infer_observation_to_topics_connections"
+        ) as infer_topics, mock.patch(
+            "HandleObservationChange.infer_observation_to_action_items_connections",
+            return_value=[],
+        ) as infer_action_items:
+            main(flag_update_message(self.observation))
+        infer_topics.assert_not_called()
+        infer_action_items.assert_called_once()
@@ -0,0 +1,97 @@
+import json
+import unittest
+import azure.functions as func
+from typing import Callable, Any, Dict, List, Union
+from unittest import mock
+
+from src.change_batches import (
+    FAILED,
+    OBSERVATION_STAGES,
+    PROCESSED,
+    SKIPPED,
+    process_change_batch,
+)
+from src.storage import Storage
+from src.data.observations import Observation
+from src.data.feedbackItems import FeedbackItem
+from src.data.reviews import Review, Rating, ReviewSource
+from src.misc import iso_to_unix_timestamp
+
+
+def change_message(
+    message_id: str, body: Union[Dict[str, Any], str]
+) -> func.ServiceBusMessage:
+    req = mock.Mock(spec=func.ServiceBusMessage)
+    req.message_id = message_id
+    req.get_body.return_value = body if isinstance(body, str) else json.dumps(body)  # type: ignore
+    return req
+
+
+class TestHandleObservationChangeBatch(unittest.TestCase):
+    def setup_method(self, method: Callable[[], Any]):
+        with Storage() as storage:
+            review = Review(
+                rating=Rating.TWO,
+                source=ReviewSource.YELP,
+                source_review_id="Review_batch_obs",
+            )
+            feedback_item = FeedbackItem(
+                text="The soup was lukewarm and the bread was stale, but the staff were lovely.",
+                text_written_at=iso_to_unix_timestamp("2023-07-25T00:00:00.000Z"),
+            )
+            self.observation = Observation(
+                text="The customer found the soup lukewarm.",
+                id="Observation_batch_1",
+                needs_action=True,
+            )
+            storage.add_feedback_item_and_source(feedback_item, review)
+            storage.add_observation_for_feedback_item(self.observation, feedback_item)
+
+        # Connecting is covered by the single message tests, the batch only decides what runs
+        self.stages = [
+            stage.model_copy(update={"infer": mock.Mock(return_value=[])})
+            for stage in OBSERVATION_STAGES
+        ]
+
+    def teardown_method(self, method: Callable[[], Any]):
+        pass
+
+    def process(self, msgs: List[func.ServiceBusMessage]) -> List[str]:
+        with Storage() as storage:
+            report = process_change_batch(
+                storage,
+                "HandleObservationChangeBatchTest",
+                Observation,
+                self.stages,
+                msgs,
+            )
+        return [result.status for result in report.results]
+
+    def test_handle_observation_change_batch(self):
+        change = {"id": self.observation.id, "_etag": '"1"'}
+        unchanged_flag = {
+            "id": self.observation.id,
+            "_etag": '"2"',
+            "flags_updated_at": [{"id": "flags_updated_at", "_value": 2.0}],
+            "needs_action_raised": [{"id": "needs_action_raised", "_value": False}],
+        }
+        msgs = [
+            change_message("change", change),
+            change_message("unreadable", "not json"),
+            change_message("missing", {"id": "Observation_batch_missing"}),
+            change_message("duplicate", change),
+            change_message("unchanged_flag", unchanged_flag),
+        ]
+
+        self.assertEqual(
+            self.process(msgs), [PROCESSED, FAILED, FAILED, SKIPPED, SKIPPED]
+        )
+        for stage in self.stages:
+            stage.infer.assert_called_once()
+
+        # Redelivered because messages failed, the processed message is skipped by the ledger
+        self.assertEqual(
+            self.process(msgs), [SKIPPED, FAILED, FAILED, SKIPPED, SKIPPED]
+        )
+        for stage in self.stages:
+            stage.infer.assert_called_once()
@@ -0,0 +1,63 @@
+import unittest
+import azure.functions as func
+from typing import Callable, Any
+from unittest import mock
+import json
+
+from HandleObservationScoring import main
+
+from src.storage import Storage
+from src.data.reviews import Review, Rating, ReviewSource
+from src.data.feedbackItems import FeedbackItem
+from src.data.observations import Observation
+from src.data.ledger import LedgerEntry
+from src.pipeline import OBSERVATIONS, FeedbackItemCheckpoint, scoring_message
+from src.misc import iso_to_unix_timestamp
+
+
+class TestObservationScoring(unittest.TestCase):
+    def setup_method(self, method: Callable[[], Any]):
+        with Storage() as storage:
+            review = Review(
+                rating=Rating.TWO,
+                source=ReviewSource.YELP,
+                source_review_id="Review_scoring",
+            )
+            feedback_item = FeedbackItem(
+                id="fanned_out_feedback_item_id",
+                text="The patio is lovely, but we waited forty minutes for two sandwiches and nobody apologized.",
+                text_written_at=iso_to_unix_timestamp("2023-07-25T00:00:00.000Z"),
+            )
+            storage.add_feedback_item_and_source(feedback_item, source=review)
+
+            # As left by HandleFeedbackItemChange after fanning out
+            self.observation = Observation(
+                text="The customer waited forty minutes for two sandwiches.",
+                id="Observation_fanned_out",
+            )
+            self.ledger = LedgerEntry(
+                handler="HandleFeedbackItemChange",
+                node_id=feedback_item.id,
+                completed_stages=OBSERVATIONS,
+                checkpoint=FeedbackItemCheckpoint(
+                    observations=[self.observation]
+                ).model_dump_json(),
+                fan_out=1,
+            )
+            storage.add_node(self.ledger)
+
+    def teardown_method(self, method: Callable[[], Any]):
+        pass
+
+    def test_handle_observation_scoring(self):
+        req = mock.Mock(spec=func.ServiceBusMessage)
+        req.get_body.return_value = json.dumps(scoring_message(self.ledger, self.observation))  # type: ignore
+
+        main(req)
+
+        with Storage() as storage:
+            observation = storage.get_node(self.observation.id, Observation)
+            self.assertIsNotNone(observation.needs_action)
+            self.assertEqual(len(storage.get_observation_scores(observation)), 3)
+            ledger = storage.get_node(self.ledger.id, LedgerEntry)
+            self.assertTrue(ledger.completed)